@@ -0,0 +1,196 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+try:
+    from backend.matrix_store import get_store, save_arrays, save_sparse_matrix, dense_frame
+except ImportError:
+    from matrix_store import get_store, save_arrays, save_sparse_matrix, dense_frame
+
+# Item vectors with more features than this are projected down before indexing
+DEFAULT_N_DIMS = 128
+DEFAULT_N_PROBE = 8
+
+def item_vectors(features):
+    # L2-normalized item feature rows (one-hot genres, TF-IDF, item-user columns) as CSR, so that the inner product
+    # of two rows is exactly the cosine similarity stored in the dense similarity matrices
+    return sp.csr_matrix(normalize(sp.csr_matrix(features, dtype=np.float64), norm='l2', axis=1))
+
+def save_item_vectors(vectors, ids, data_path, name):
+    save_sparse_matrix(vectors, ids, pd.RangeIndex(vectors.shape[1], name='Feature'), data_path, name)
+
+def _projection(vectors, n_dims, random_seed):
+    # Truncated SVD basis of the item vectors (keeps inner products as well as n_dims allows), identity when the
+    # vectors are already small. Queries are projected on the same basis.
+    n_features = vectors.shape[1]
+    if n_features > n_dims:
+        svd = TruncatedSVD(n_components=n_dims, random_state=random_seed).fit(vectors)
+        projection = svd.components_.T.astype(np.float32)
+    else:
+        projection = np.eye(n_features, dtype=np.float32)
+    return projection, np.asarray(vectors @ projection, dtype=np.float32)
+
+def _spherical_kmeans(x, n_clusters, n_iter, rng):
+    centroids = x[rng.choice(len(x), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, x)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Empty clusters keep their previous centroid
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    return centroids, np.argmax(x @ centroids.T, axis=1)
+
+class IVFIndex:
+    # Pure NumPy inverted-file index for maximum inner product search over item vectors:
+    # items are clustered with spherical k-means and a query only scans the n_probe closest clusters.
+    # High-dimensional (sparse) vectors are first reduced to DEFAULT_N_DIMS dimensions with a truncated SVD.
+    def __init__(self, projection, reduced, centroids, list_offsets, list_items, ids):
+        self.projection = projection
+        self.reduced = reduced
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_items = list_items
+        self.ids = ids
+
+    @classmethod
+    def build(cls, vectors, ids, n_lists=None, n_dims=DEFAULT_N_DIMS, random_seed=42, n_iter=10):
+        rng = np.random.default_rng(random_seed)
+        n_items = vectors.shape[0]
+        projection, reduced = _projection(vectors, n_dims, random_seed)
+
+        n_lists = n_lists or max(1, int(np.sqrt(n_items)))
+        centroids, assignment = _spherical_kmeans(normalize(reduced), min(n_lists, n_items), n_iter, rng)
+
+        list_items = np.argsort(assignment, kind='stable').astype(np.int32)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))]).astype(np.int64)
+        return cls(projection, reduced, centroids.astype(np.float32), list_offsets, list_items, ids)
+
+    def query(self, query_vectors, k, n_probe=DEFAULT_N_PROBE):
+        # Approximate top-k item positions (and reduced-space scores) for each full-dimensional query vector
+        queries = np.atleast_2d(np.asarray(query_vectors @ self.projection, dtype=np.float32))
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :n_probe]
+
+        positions = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for row, (query, probe) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([self.list_items[self.list_offsets[l]:self.list_offsets[l + 1]] for l in probe])
+            candidate_scores = self.reduced[candidates] @ query
+            top = np.argsort(-candidate_scores)[:k]
+            positions[row, :len(top)] = candidates[top]
+            scores[row, :len(top)] = candidate_scores[top]
+        return positions, scores
+
+    def save(self, data_path, name):
+        arrays = {
+            "projection": self.projection,
+            "reduced": self.reduced,
+            "centroids": self.centroids,
+            "list_offsets": self.list_offsets,
+            "list_items": self.list_items,
+            "ids": np.asarray(self.ids)
+        }
+        save_arrays(arrays, data_path, name, meta={"backend": "numpy", "index_name": self.ids.name})
+
+class HnswIndex:
+    # Optional hnswlib backend with the same query interface; the graph is stored next to the matrix store
+    def __init__(self, index, projection, ids):
+        self.index = index
+        self.projection = projection
+        self.ids = ids
+
+    @classmethod
+    def build(cls, vectors, ids, n_dims=DEFAULT_N_DIMS, random_seed=42, ef_construction=200, m=16):
+        import hnswlib
+
+        n_items = vectors.shape[0]
+        projection, reduced = _projection(vectors, n_dims, random_seed)
+
+        index = hnswlib.Index(space='ip', dim=reduced.shape[1])
+        index.init_index(max_elements=n_items, ef_construction=ef_construction, M=m, random_seed=random_seed)
+        index.add_items(reduced, np.arange(n_items))
+        return cls(index, projection, ids)
+
+    def query(self, query_vectors, k, n_probe=DEFAULT_N_PROBE):
+        # n_probe plays the role of the search breadth: ef = k * n_probe
+        queries = np.atleast_2d(np.asarray(query_vectors @ self.projection, dtype=np.float32))
+        self.index.set_ef(max(k * n_probe, k))
+        labels, distances = self.index.knn_query(queries, k=min(k, self.index.get_current_count()))
+        return labels.astype(np.int64), (1 - distances).astype(np.float32)
+
+    def save(self, data_path, name):
+        store = get_store(data_path)
+        store.store_path.mkdir(parents=True, exist_ok=True)
+        self.index.save_index(str(store.store_path / f'{name}.hnsw.bin'))
+        save_arrays({"projection": self.projection, "ids": np.asarray(self.ids)}, data_path, name,
+                    meta={"backend": "hnswlib", "index_name": self.ids.name})
+
+def build_ann_index(vectors, ids, backend='numpy', **kwargs):
+    if backend == 'hnswlib':
+        return HnswIndex.build(vectors, ids, **kwargs)
+    return IVFIndex.build(vectors, ids, **kwargs)
+
+def load_ann_index(store, name):
+    arrays, meta = store.load_arrays(name)
+    ids = pd.Index(arrays["ids"], name=meta.get("index_name"))
+    if meta.get("backend") == "hnswlib":
+        import hnswlib
+
+        index = hnswlib.Index(space='ip', dim=arrays["projection"].shape[1])
+        index.load_index(str(store.store_path / f'{name}.hnsw.bin'))
+        return HnswIndex(index, arrays["projection"], ids)
+    return IVFIndex(arrays["projection"], arrays["reduced"], arrays["centroids"], arrays["list_offsets"], arrays["list_items"], ids)
+
+def benchmark(index, vectors, exact_similarity, k=10, n_queries=200, n_probes=(1, 2, 4, 8, 16, 32), random_seed=42):
+    # Recall@k and latency of item-to-item queries against the exact similarity matrix.
+    # A returned item counts as a hit when its exact similarity reaches the k-th best one, so ties are not penalized.
+    rng = np.random.default_rng(random_seed)
+    query_rows = rng.choice(vectors.shape[0], min(n_queries, vectors.shape[0]), replace=False)
+    exact_similarity = np.asarray(exact_similarity)
+
+    rows = []
+    exact_start = time.perf_counter()
+    exact_kth = [np.sort(exact_similarity[row])[-k] for row in query_rows]
+    exact_latency = (time.perf_counter() - exact_start) / len(query_rows)
+
+    for n_probe in n_probes:
+        latencies = []
+        hits = 0
+        for row, kth in zip(query_rows, exact_kth):
+            start = time.perf_counter()
+            positions, _ = index.query(vectors[row], k, n_probe=n_probe)
+            latencies.append(time.perf_counter() - start)
+            found = positions[0][positions[0] >= 0]
+            hits += np.count_nonzero(exact_similarity[row, found] >= kth - 1e-9)
+        rows.append({
+            "n_probe": n_probe,
+            f"recall@{k}": hits / (k * len(query_rows)),
+            "p50_ms": np.percentile(latencies, 50) * 1000,
+            "p95_ms": np.percentile(latencies, 95) * 1000,
+            "exact_ms": exact_latency * 1000
+        })
+    return pd.DataFrame(rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recall-vs-latency benchmark of the ANN indexes against the exact similarity matrices.")
+    parser.add_argument('--data-path', default='../data/processed')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    store = get_store(args.data_path)
+    benchmarks = {
+        'item_ann': ('item_vectors', 'item_similarity_matrix_df'),
+        'content_one_hot_ann': ('content_one_hot_vectors', 'content_similarity_matrix_one_hot'),
+        'content_tfidf_ann': ('content_tfidf_vectors', 'content_similarity_matrix_tfidf'),
+    }
+    for index_name, (vectors_name, similarity_name) in benchmarks.items():
+        index = load_ann_index(store, index_name)
+        vectors, ids, _ = store.load_sparse(vectors_name)
+        exact_similarity = dense_frame(store.load_frame(similarity_name)).loc[ids, ids].values
+        print(f"ANN benchmark: {index_name}")
+        print(benchmark(index, vectors, exact_similarity, k=args.k, n_queries=args.queries).to_string(index=False))
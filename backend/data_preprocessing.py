@@ -1,69 +1,287 @@
+import argparse
+import json
+import numpy as np
 import pandas as pd
+from pathlib import Path
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
+from matrix_store import get_store, save_matrix, save_sparse_matrix, remove_matrix, dense_frame
+from item_similarity import save_item_similarity
+from user_similarity import save_user_similarity, DEFAULT_MIN_CO_RATED
+from sparse_matrix import ratings_to_csr
+from ingestion import load_ingested_ratings, INGESTED_RATINGS_FILE
+from preprocessing_pipeline import Stage, Pipeline, read_dat
+from ann_index import item_vectors, save_item_vectors, build_ann_index
+from matrix_factorization import train_and_save_factors, factors_name, DEFAULT_ALS_PARAMS
+from popularity import save_popularity_rankings, GENDER_CODES, POPULARITY_HALF_LIFE_DAYS
+from snapshots import publish_snapshot
+
+RAW_PATH = '../data/raw/ml-1m'
+DATA_PATH = '../data/processed'
+
+# User similarity: minimum number of co-rated items per pair, and whether the full (users x users) matrix is stored
+# besides the top-N neighbor lists (without it, UserBasedCFRecommender scores from the neighbor lists)
+USER_MIN_CO_RATED = DEFAULT_MIN_CO_RATED
+USER_SIMILARITY_DENSE = True
+
+with open(Path(__file__).resolve().parent / 'evaluation_config.json', 'r') as f:
+    config = json.load(f)
+
+# Storage precision of the similarity and correlation matrices (see MATRIX_PRECISIONS in matrix_store.py), shared with
+# the evaluation matrices
+SIMILARITY_PRECISION = config.get("SIMILARITY_PRECISION", "float64")
+
+# CSR backend: no dense (users x items) or (items x items) artifact is written, only the CSR ratings and the top-N
+# neighbor lists, so preprocessing scales with the number of ratings. Recommenders switch to the CSR ratings and the
+# neighbor lists by themselves when the dense artifacts are missing.
+SPARSE_BACKEND = config.get("SPARSE_BACKEND", False)
+
+# Dense artifacts the CSR backend does not write; stale copies of an earlier dense run are removed with the pivot
+DENSE_ARTIFACTS = (
+    'user_item_matrix', 'item_similarity_matrix_df', 'adjusted_item_similarity_matrix_df', 'user_correlation_matrix',
+    'content_similarity_matrix_one_hot', 'content_similarity_matrix_tfidf', 'content_one_hot_aligned', 'content_tfidf_aligned'
+)
+
+def store_file(name, suffix='npy'):
+    return f'matrix_store/{name}.{suffix}'
 
 # Load and preprocess the raw ratings data
-ratings = pd.read_csv('../data/raw/ml-1m/ratings.dat', sep='::', engine='python', names=['UserID', 'MovieID', 'Rating', 'Timestamp'])
-user_item_matrix = ratings.pivot(index='UserID', columns='MovieID', values='Rating').fillna(0)
-print("Data Preprocessing: User-Item matrix extracted successfully.")
-item_user_matrix = user_item_matrix.T.fillna(0)
-print("Data Preprocessing: Item-User matrix converted successfully.")
-item_similarity_matrix = cosine_similarity(item_user_matrix)
-print("Data Preprocessing: Cosine similarity matrix computed successfully.")
-
-user_mean = item_user_matrix.mean(axis=1)
-adjusted_item_user_matrix = item_user_matrix.sub(user_mean, axis=0).fillna(0)
-adjusted_item_similarity_matrix = cosine_similarity(adjusted_item_user_matrix)
-print("Data Preprocessing: Adjusted cosine similarity matrix computed successfully.")
-
-# Save the processed matrices for local storage
-user_item_matrix.to_pickle('../data/processed/user_item_matrix.pkl')
-print("Data Preprocessing: User-Item matrix saved successfully.")
-
-item_user_matrix.to_pickle('../data/processed/item_user_matrix.pkl')
-print("Data Preprocessing: Item-User matrix saved successfully.")
-
-item_similarity_matrix_df = pd.DataFrame(item_similarity_matrix, index=item_user_matrix.index, columns=item_user_matrix.index)
-item_similarity_matrix_df.to_pickle('../data/processed/item_similarity_matrix_df.pkl')
-print("Data Preprocessing: Cosine similarity matrix saved successfully.")
-
-adjusted_item_similarity_matrix_df = pd.DataFrame(adjusted_item_similarity_matrix, index=item_user_matrix.index, columns=item_user_matrix.index)
-adjusted_item_similarity_matrix_df.to_pickle('../data/processed/adjusted_item_similarity_matrix_df.pkl')
-print("Data Preprocessing: Adjusted cosine similarity matrix saved successfully.")
+def parse_ratings():
+    ratings = read_dat(f'{RAW_PATH}/ratings.dat', names=['UserID', 'MovieID', 'Rating', 'Timestamp'])
+
+    # Compaction: fold in ratings ingested through the API since the last run, the latest rating per user and movie wins
+    ingested_ratings = load_ingested_ratings(DATA_PATH)
+    if len(ingested_ratings) > 0:
+        ratings = pd.concat([ratings, ingested_ratings], ignore_index=True).drop_duplicates(['UserID', 'MovieID'], keep='last')
+        print(f"Data Preprocessing: {len(ingested_ratings)} ingested ratings merged successfully.")
+
+    ratings.to_pickle(f'{DATA_PATH}/ratings.pkl')
+    print("Data Preprocessing: Ratings parsed successfully.")
+    return ratings
+
+def load_ratings():
+    return pd.read_pickle(f'{DATA_PATH}/ratings.pkl')
+
+# The pivot is (CSR User-Item matrix, user index, item index) for every downstream stage
+def pivot_ratings(ratings):
+    user_item_csr, user_index, item_index = ratings_to_csr(ratings)
+    print("Data Preprocessing: Sparse User-Item matrix extracted successfully.")
+
+    # Save the processed matrices to the memory-mapped matrix store
+    # The Item-User matrix is not stored separately: recommenders use a transposed view of the User-Item matrix
+    save_sparse_matrix(user_item_csr, user_index, item_index, DATA_PATH, 'user_item_csr')
+    print("Data Preprocessing: Sparse User-Item matrix saved successfully.")
+
+    if SPARSE_BACKEND:
+        for name in DENSE_ARTIFACTS:
+            remove_matrix(DATA_PATH, name)
+    else:
+        user_item_matrix = pd.DataFrame(user_item_csr.toarray(), index=user_index, columns=item_index)
+        save_matrix(user_item_matrix, DATA_PATH, 'user_item_matrix')
+        print("Data Preprocessing: User-Item matrix saved successfully.")
+    return user_item_csr, user_index, item_index
+
+def load_pivot():
+    return get_store(DATA_PATH).load_sparse('user_item_csr')
+
+# Item cosine and adjusted (item-centered) cosine similarity, computed block by block from the CSR Item-User matrix
+# together with their top-N neighbor lists; the full matrices are only written by the dense backend
+def item_similarity(pivot):
+    user_item_csr, _, item_index = pivot
+    save_item_similarity(
+        user_item_csr.T, item_index, DATA_PATH, name=None if SPARSE_BACKEND else 'item_similarity_matrix_df',
+        topn_name='item_topn', precision=SIMILARITY_PRECISION
+    )
+    print("Data Preprocessing: Cosine similarity saved successfully.")
+
+def adjusted_item_similarity(pivot):
+    user_item_csr, _, item_index = pivot
+    save_item_similarity(
+        user_item_csr.T, item_index, DATA_PATH, name=None if SPARSE_BACKEND else 'adjusted_item_similarity_matrix_df',
+        topn_name='adjusted_item_topn', centered=True, precision=SIMILARITY_PRECISION
+    )
+    print("Data Preprocessing: Adjusted cosine similarity saved successfully.")
 
 # Popularity data preprocessing
-popularity = ratings.groupby('MovieID')["Rating"].count().reset_index()
-popularity.columns = ['MovieID', 'NumRatings']
-popularity.to_pickle('../data/processed/popularity.pkl')
-print("Data Preprocessing: Popularity data saved successfully.")
+def popularity(ratings, users):
+    popularity = ratings.groupby('MovieID')["Rating"].count().reset_index()
+    popularity.columns = ['MovieID', 'NumRatings']
+    popularity.to_pickle(f'{DATA_PATH}/popularity.pkl')
+    print("Data Preprocessing: Popularity data saved successfully.")
+
+    # Global, time-decayed and demographic rankings served to cold-start users
+    save_popularity_rankings(popularity, ratings, users, DATA_PATH, 'popularity_rankings', half_life_days=POPULARITY_HALF_LIFE_DAYS)
+    print("Data Preprocessing: Popularity rankings saved successfully.")
 
 # Optional preprocessing for other .dat files
-users = pd.read_csv('../data/raw/ml-1m/users.dat', sep='::', engine='python', names=['UserID', 'Gender', 'Age', 'Occupation', 'Zip-code'])
-users['Gender'] = users['Gender'].map({'F': 0, 'M': 1}) # Gender encoding
-users.to_pickle('../data/processed/users.pkl')
-print("Data Preprocessing: Users data saved successfully.")
-
-movies = pd.read_csv('../data/raw/ml-1m/movies.dat', sep='::', engine='python', names=['MovieID', 'Title', 'Genres'], encoding='latin-1')
-movies["GenresStr"] = movies["Genres"] # Preserve original genres text
-genres_split = movies['Genres'].str.get_dummies(sep='|') # One-hot encoding for genres
-movies = pd.concat([movies[['MovieID', 'Title', 'GenresStr']], genres_split], axis=1)
-movies.to_pickle('../data/processed/movies.pkl')
-print("Data Preprocessing: Movies data saved successfully.")
+def parse_users():
+    users = read_dat(f'{RAW_PATH}/users.dat', names=['UserID', 'Gender', 'Age', 'Occupation', 'Zip-code'])
+    users['Gender'] = users['Gender'].map(GENDER_CODES) # Gender encoding
+    users.to_pickle(f'{DATA_PATH}/users.pkl')
+    print("Data Preprocessing: Users data saved successfully.")
+    return users
+
+def load_users():
+    return pd.read_pickle(f'{DATA_PATH}/users.pkl')
+
+def parse_movies():
+    movies = read_dat(f'{RAW_PATH}/movies.dat', names=['MovieID', 'Title', 'Genres'], encoding='latin-1')
+    movies["GenresStr"] = movies["Genres"] # Preserve original genres text
+    genres_split = movies['Genres'].str.get_dummies(sep='|') # One-hot encoding for genres
+    movies = pd.concat([movies[['MovieID', 'Title', 'GenresStr']], genres_split], axis=1)
+    movies.to_pickle(f'{DATA_PATH}/movies.pkl')
+    print("Data Preprocessing: Movies data saved successfully.")
+    return movies
+
+def load_movies():
+    return pd.read_pickle(f'{DATA_PATH}/movies.pkl')
+
+def content_features(movies):
+    # One-hot genres and TF-IDF of title and genres, one row per movie
+    genres_split = movies.drop(columns=['MovieID', 'Title', 'GenresStr'])
+    content_text = movies['Title'] + " " + movies['GenresStr']
+    tfidf_vectorizer = TfidfVectorizer(stop_words='english')
+    tfidf_matrix = tfidf_vectorizer.fit_transform(content_text)
+    return genres_split, tfidf_matrix
 
 # Content similarity matrix computation
-content_similarity_matrix_one_hot = cosine_similarity(genres_split)
-pd.DataFrame(content_similarity_matrix_one_hot, index=movies['MovieID'], columns=movies['MovieID']).to_pickle('../data/processed/content_similarity_matrix_one_hot.pkl')
-print("Data Preprocessing: Content similarity matrix (one-hot) saved successfully.")
-
-movies["ContentText"] = movies['Title'] + " " + movies['GenresStr']
-
-tfidf_vectorizer = TfidfVectorizer(stop_words='english')
-tfidf_matrix = tfidf_vectorizer.fit_transform(movies['ContentText'])
-tfidf_similarity_matrix = cosine_similarity(tfidf_matrix)
-pd.DataFrame(tfidf_similarity_matrix, index=movies['MovieID'], columns=movies['MovieID']).to_pickle('../data/processed/content_similarity_matrix_tfidf.pkl')
-print("Data Preprocessing: Content similarity matrix (TF-IDF) saved successfully.")
-
-# User correlation matrix computation
-user_correlation_matrix = user_item_matrix.T.corr()
-user_correlation_matrix.to_pickle('../data/processed/user_correlation_matrix.pkl')
-print("Data Preprocessing: User correlation matrix saved successfully.")
\ No newline at end of file
+def content_similarity(movies):
+    genres_split, tfidf_matrix = content_features(movies)
+    content_similarity_matrix_one_hot = cosine_similarity(genres_split)
+    content_similarity_matrix_one_hot_df = pd.DataFrame(content_similarity_matrix_one_hot, index=movies['MovieID'], columns=movies['MovieID'])
+    save_matrix(content_similarity_matrix_one_hot_df, DATA_PATH, 'content_similarity_matrix_one_hot', precision=SIMILARITY_PRECISION)
+    print("Data Preprocessing: Content similarity matrix (one-hot) saved successfully.")
+
+    tfidf_similarity_matrix = cosine_similarity(tfidf_matrix)
+    tfidf_similarity_matrix_df = pd.DataFrame(tfidf_similarity_matrix, index=movies['MovieID'], columns=movies['MovieID'])
+    save_matrix(tfidf_similarity_matrix_df, DATA_PATH, 'content_similarity_matrix_tfidf', precision=SIMILARITY_PRECISION)
+    print("Data Preprocessing: Content similarity matrix (TF-IDF) saved successfully.")
+    return content_similarity_matrix_one_hot_df, tfidf_similarity_matrix_df
+
+def load_content_similarity():
+    store = get_store(DATA_PATH)
+    return (dense_frame(store.load_frame('content_similarity_matrix_one_hot')),
+            dense_frame(store.load_frame('content_similarity_matrix_tfidf')))
+
+def aligned_content_similarity(content_sims, pivot):
+    # float32 copies reordered once to the User-Item matrix columns (rows and columns are rated MovieIDs), so
+    # ContentBasedRecommender scores with plain row sums and matrix products on the mapped array instead of reindexing
+    item_index = pivot[2]
+    for name, sim_df in zip(('content_one_hot', 'content_tfidf'), content_sims):
+        aligned = pd.DataFrame(sim_df.loc[item_index, item_index].values.astype(np.float32), index=item_index, columns=item_index)
+        save_matrix(aligned, DATA_PATH, f'{name}_aligned', precision=float32_precision())
+    print("Data Preprocessing: Aligned content similarity matrices saved successfully.")
+
+def float32_precision():
+    # SIMILARITY_PRECISION for matrices computed in float32: never stored wider than that
+    return SIMILARITY_PRECISION if SIMILARITY_PRECISION in ('float16', 'int8') else 'float32'
+
+# User similarity (mean-centered over co-rated items) and its top-N neighbor lists, in one blocked pass
+def user_correlation(pivot):
+    user_item_csr, user_index, _ = pivot
+    save_user_similarity(
+        user_item_csr, user_index, DATA_PATH,
+        name='user_correlation_matrix' if dense_user_similarity() else None, topn_name='user_topn',
+        min_co_rated=USER_MIN_CO_RATED, precision=float32_precision()
+    )
+    if not dense_user_similarity():
+        remove_matrix(DATA_PATH, 'user_correlation_matrix')
+    print("Data Preprocessing: User similarity saved successfully.")
+
+def dense_user_similarity():
+    return USER_SIMILARITY_DENSE and not SPARSE_BACKEND
+
+# Top-N content neighbor lists, straight from the content features
+def content_neighbor_index(movies, pivot):
+    # Content neighbors are restricted to rated movies so positions line up with the User-Item matrix columns
+    item_index = pivot[2]
+    genres_split, tfidf_matrix = content_features(movies)
+    movie_rows = pd.Index(movies['MovieID']).get_indexer(item_index)
+    for name, features in (('content_one_hot_topn', genres_split.values[movie_rows]), ('content_tfidf_topn', tfidf_matrix[movie_rows])):
+        save_item_similarity(features, item_index, DATA_PATH, topn_name=name)
+        print(f"Data Preprocessing: Top-N neighbor index '{name}' saved successfully.")
+
+# Approximate nearest-neighbor indexes over L2-normalized item vectors
+def ann_indexes(pivot, movies):
+    # Inner products of the stored vectors equal the item and content cosine similarities, restricted to rated movies
+    user_item_csr, _, item_index = pivot
+    genres_split, tfidf_matrix = content_features(movies)
+    movie_rows = pd.Index(movies['MovieID']).get_indexer(item_index)
+
+    vector_sources = {
+        'item': user_item_csr.T,
+        'content_one_hot': genres_split.values[movie_rows],
+        'content_tfidf': tfidf_matrix[movie_rows]
+    }
+    for name, features in vector_sources.items():
+        vectors = item_vectors(features)
+        save_item_vectors(vectors, item_index, DATA_PATH, f'{name}_vectors')
+        build_ann_index(vectors, item_index).save(DATA_PATH, f'{name}_ann')
+        print(f"Data Preprocessing: ANN index '{name}_ann' saved successfully.")
+
+# Matrix factorization with the default ALS parameters
+def mf_factors(pivot):
+    user_item_csr = pivot[0]
+    name = factors_name(**DEFAULT_ALS_PARAMS)
+    train_and_save_factors(user_item_csr, DATA_PATH, name, **DEFAULT_ALS_PARAMS)
+    print(f"Data Preprocessing: Matrix factorization '{name}' saved successfully.")
+
+def build_pipeline(max_workers=None):
+    precision = {"precision": SIMILARITY_PRECISION}
+    user_similarity = dict(precision, min_co_rated=USER_MIN_CO_RATED, dense=dense_user_similarity())
+
+    def outputs(topn_name, dense_name, dense=not SPARSE_BACKEND):
+        # Neighbor lists, plus the full matrix when the dense artifacts are built
+        return [store_file(topn_name, 'neighbors.npy')] + ([store_file(dense_name)] if dense else [])
+
+    stages = [
+        Stage('ratings', parse_ratings, load_ratings,
+              inputs=[f'{RAW_PATH}/ratings.dat', f'{DATA_PATH}/{INGESTED_RATINGS_FILE}'], outputs=['ratings.pkl']),
+        Stage('pivot', pivot_ratings, load_pivot, deps=['ratings'],
+              outputs=[store_file('user_item_csr', 'indptr.npy')] + ([] if SPARSE_BACKEND else [store_file('user_item_matrix')]),
+              params={"sparse": SPARSE_BACKEND}, version=2),
+        Stage('item_similarity', item_similarity, deps=['pivot'],
+              outputs=outputs('item_topn', 'item_similarity_matrix_df'), params=precision, version=2),
+        Stage('adjusted_item_similarity', adjusted_item_similarity, deps=['pivot'],
+              outputs=outputs('adjusted_item_topn', 'adjusted_item_similarity_matrix_df'), params=precision, version=2),
+        Stage('popularity', popularity, deps=['ratings', 'users'],
+              outputs=['popularity.pkl', store_file('popularity_rankings', 'segments.npy')],
+              params={"half_life_days": POPULARITY_HALF_LIFE_DAYS}, version=2),
+        Stage('users', parse_users, load_users, inputs=[f'{RAW_PATH}/users.dat'], outputs=['users.pkl']),
+        Stage('movies', parse_movies, load_movies, inputs=[f'{RAW_PATH}/movies.dat'], outputs=['movies.pkl']),
+        Stage('user_correlation', user_correlation, deps=['pivot'],
+              outputs=outputs('user_topn', 'user_correlation_matrix', dense_user_similarity()), params=user_similarity, version=2),
+        Stage('content_topn', content_neighbor_index, deps=['movies', 'pivot'],
+              outputs=[store_file('content_one_hot_topn', 'neighbors.npy'), store_file('content_tfidf_topn', 'neighbors.npy')], version=2),
+        Stage('ann_index', ann_indexes, deps=['pivot', 'movies'],
+              outputs=[store_file(f'{name}_ann', 'list_items.npy') for name in ('item', 'content_one_hot', 'content_tfidf')]),
+        Stage('mf_factors', mf_factors, deps=['pivot'],
+              outputs=[store_file(factors_name(**DEFAULT_ALS_PARAMS), 'user_factors.npy')]),
+    ]
+    if not SPARSE_BACKEND:
+        # Full (movies x movies) content similarities and their copies aligned to the User-Item matrix
+        stages += [
+            Stage('content_similarity', content_similarity, load_content_similarity, deps=['movies'],
+                  outputs=[store_file('content_similarity_matrix_one_hot'), store_file('content_similarity_matrix_tfidf')], params=precision),
+            Stage('content_aligned', aligned_content_similarity, deps=['content_similarity', 'pivot'],
+                  outputs=[store_file('content_one_hot_aligned'), store_file('content_tfidf_aligned')], params=precision),
+        ]
+    return Pipeline(stages, DATA_PATH, max_workers=max_workers)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the processed recommender artifacts.")
+    parser.add_argument('--force', action='store_true', help="Rebuild every stage, ignoring the manifest.")
+    parser.add_argument('--jobs', type=int, default=None, help="Number of stages run concurrently.")
+    parser.add_argument('--min-co-rated', type=int, default=USER_MIN_CO_RATED,
+                        help="Minimum number of co-rated items for two users to get a similarity.")
+    parser.add_argument('--user-topn-only', action='store_true',
+                        help="Keep only the top-N user neighbor lists, not the full user similarity matrix.")
+    parser.add_argument('--no-snapshot', action='store_true',
+                        help="Do not publish the artifacts as a new versioned snapshot for the FastAPI server.")
+    args = parser.parse_args()
+
+    USER_MIN_CO_RATED = args.min_co_rated
+    USER_SIMILARITY_DENSE = not args.user_topn_only
+    build_pipeline(max_workers=args.jobs).run(force=args.force)
+    if not args.no_snapshot:
+        print(f"Data Preprocessing: Snapshot '{publish_snapshot(DATA_PATH)}' published successfully.")
@@ -0,0 +1,62 @@
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+from pathlib import Path
+
+SPLIT_DIRNAME = 'splits'
+
+def split_ratings(user_codes, test_ratio=0.2, random_seed=42):
+    # Per-user random train/test split of long-format ratings, returned as (train, test) positions.
+    # Each user holds out max(1, int(n_ratings * test_ratio)) ratings: ratings are ranked inside each user
+    # by a random key and the lowest ranks go to the test set.
+    user_codes = np.asarray(user_codes)
+    rng = np.random.default_rng(random_seed)
+    random_keys = rng.random(len(user_codes))
+
+    order = np.lexsort((random_keys, user_codes))
+    counts = np.bincount(user_codes)
+    group_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    rank_in_user = np.arange(len(order)) - group_starts
+
+    n_test = np.maximum(1, (counts * test_ratio).astype(int))
+    test_mask = np.empty(len(order), dtype=bool)
+    test_mask[order] = rank_in_user < np.repeat(n_test, counts)
+
+    return np.flatnonzero(~test_mask), np.flatnonzero(test_mask)
+
+def _csr_fingerprint(matrix):
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(matrix.indptr).tobytes())
+    digest.update(np.ascontiguousarray(matrix.indices).tobytes())
+    return digest.hexdigest()
+
+def load_or_create_split(matrix, test_ratio=0.2, random_seed=42, data_path=None):
+    # Split of a CSR rating matrix as positions into its stored entries, cached on disk per (test_ratio, random_seed)
+    fingerprint = _csr_fingerprint(matrix)
+    split_file = None
+    if data_path is not None:
+        split_file = Path(data_path) / SPLIT_DIRNAME / f'split_ratio{test_ratio}_seed{random_seed}.npz'
+        if split_file.exists():
+            cached = np.load(split_file)
+            # Reuse only if it was made for the same rating matrix
+            if str(cached['fingerprint']) == fingerprint:
+                return cached['train'], cached['test']
+
+    user_codes = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    train_idx, test_idx = split_ratings(user_codes, test_ratio=test_ratio, random_seed=random_seed)
+
+    if split_file is not None:
+        split_file.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(split_file, train=train_idx, test=test_idx, fingerprint=fingerprint)
+    return train_idx, test_idx
+
+def split_matrices(matrix, train_idx, test_idx):
+    # Train and test CSR matrices with the shape of the full matrix
+    coo = matrix.tocoo()
+
+    def subset(positions):
+        subset_matrix = sp.csr_matrix((coo.data[positions], (coo.row[positions], coo.col[positions])), shape=matrix.shape)
+        subset_matrix.sort_indices()
+        return subset_matrix
+
+    return subset(train_idx), subset(test_idx)
@@ -1,7 +1,15 @@
 import json
-import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import pandas as pd
+from matrix_store import get_store, save_matrix, save_sparse_matrix, remove_matrix
+from item_similarity import save_item_similarity
+from user_similarity import save_user_similarity, DEFAULT_MIN_CO_RATED
+from data_splitting import load_or_create_split, split_matrices
+from ann_index import item_vectors, save_item_vectors, build_ann_index
+from matrix_factorization import load_or_train_factors, factors_name, DEFAULT_ALS_PARAMS
+from popularity import save_popularity_rankings, POPULARITY_HALF_LIFE_DAYS
+
+DATA_PATH = '../data/processed'
 
 with open("evaluation_config.json", "r") as f:
     config = json.load(f)
@@ -9,56 +17,68 @@ with open("evaluation_config.json", "r") as f:
 TOP_K = config["TOP_K"]
 TEST_RATIO = config["TEST_RATIO"]
 RANDOM_SEED = config["RANDOM_SEED"]
+SIMILARITY_PRECISION = config.get("SIMILARITY_PRECISION", "float64")
+USER_MIN_CO_RATED = config.get("USER_MIN_CO_RATED", DEFAULT_MIN_CO_RATED)
+# Same backend as data_preprocessing.py: on the CSR backend only the CSR training matrix and neighbor lists are written
+SPARSE_BACKEND = config.get("SPARSE_BACKEND", False)
 
-user_item_matrix = pd.read_pickle('../data/processed/user_item_matrix.pkl')
+user_item_csr, user_index, item_index = get_store(DATA_PATH).load_sparse_or_dense('user_item_csr', 'user_item_matrix')
 
-np.random.seed(RANDOM_SEED)
-train_matrix = user_item_matrix.copy()
-test_matrix = pd.DataFrame(0, index=user_item_matrix.index, columns=user_item_matrix.columns)
+# Vectorized per-user split, cached on disk per (TEST_RATIO, RANDOM_SEED) and reused by the evaluation pipeline
+train_idx, test_idx = load_or_create_split(user_item_csr, test_ratio=TEST_RATIO, random_seed=RANDOM_SEED, data_path=DATA_PATH)
+train_csr, test_csr = split_matrices(user_item_csr, train_idx, test_idx)
 
-for user in user_item_matrix.index:
-    rated_items = user_item_matrix.loc[user].loc[user_item_matrix.loc[user] > 0].index
-    n_test = max(1, int(len(rated_items) * TEST_RATIO))
-    test_items = np.random.choice(rated_items, size=n_test, replace=False)
-    
-    train_matrix.loc[user, test_items] = 0
-    test_matrix.loc[user, test_items] = user_item_matrix.loc[user, test_items]
+save_sparse_matrix(train_csr, user_index, item_index, DATA_PATH, 'eval_train_csr')
+print("Evaluation Data Preprocessing: Sparse training matrix saved successfully.")
 
-train_matrix.to_pickle('../data/processed/eval_train_matrix.pkl')
-print("Evaluation Data Preprocessing: Training matrix saved successfully.")
+if SPARSE_BACKEND:
+    for name in ('eval_train_matrix', 'eval_item_similarity_matrix', 'eval_adjusted_item_similarity_matrix', 'eval_user_correlation_matrix'):
+        remove_matrix(DATA_PATH, name)
+else:
+    train_matrix = pd.DataFrame(train_csr.toarray(), index=user_index, columns=item_index)
+    save_matrix(train_matrix, DATA_PATH, 'eval_train_matrix')
+    print("Evaluation Data Preprocessing: Training matrix saved successfully.")
 
-item_user_matrix_eval = train_matrix.T.fillna(0)
-item_user_matrix_eval.to_pickle('../data/processed/eval_item_user_matrix.pkl')
-print("Evaluation Data Preprocessing: Item-User matrix for evaluation saved successfully.")
+# Item similarities of the training matrix and their top-N neighbor lists, from the CSR Item-User matrix
+# (the Item-User matrix is not stored separately: recommenders use a transposed view of the training matrix)
+save_item_similarity(
+    train_csr.T, item_index, DATA_PATH, name=None if SPARSE_BACKEND else 'eval_item_similarity_matrix',
+    topn_name='eval_item_topn', precision=SIMILARITY_PRECISION
+)
+print("Evaluation Data Preprocessing: Item similarity for evaluation saved successfully.")
 
-item_similarity_matrix_eval = cosine_similarity(item_user_matrix_eval)
-item_similarity_matrix_eval_df = pd.DataFrame(item_similarity_matrix_eval, index=item_user_matrix_eval.index, columns=item_user_matrix_eval.index)
-item_similarity_matrix_eval_df.to_pickle('../data/processed/eval_item_similarity_matrix.pkl')
-print("Evaluation Data Preprocessing: Item similarity matrix for evaluation saved successfully.")
+save_item_similarity(
+    train_csr.T, item_index, DATA_PATH, name=None if SPARSE_BACKEND else 'eval_adjusted_item_similarity_matrix',
+    topn_name='eval_adjusted_item_topn', centered=True, precision=SIMILARITY_PRECISION
+)
+print("Evaluation Data Preprocessing: Adjusted item similarity for evaluation saved successfully.")
 
-user_mean_eval = item_user_matrix_eval.mean(axis=1)
-adjusted_item_user_matrix_eval = item_user_matrix_eval.sub(user_mean_eval, axis=0).fillna(0)
-adjusted_item_similarity_matrix_eval = cosine_similarity(adjusted_item_user_matrix_eval)
-adjusted_item_similarity_matrix_eval_df = pd.DataFrame(adjusted_item_similarity_matrix_eval, index=item_user_matrix_eval.index, columns=item_user_matrix_eval.index)
-adjusted_item_similarity_matrix_eval_df.to_pickle('../data/processed/eval_adjusted_item_similarity_matrix.pkl')
-print("Evaluation Data Preprocessing: Adjusted item similarity matrix for evaluation saved successfully.")
+# Same user similarity engine as production preprocessing, on the training ratings
+save_user_similarity(
+    train_csr, user_index, DATA_PATH, name=None if SPARSE_BACKEND else 'eval_user_correlation_matrix', topn_name='eval_user_topn',
+    min_co_rated=USER_MIN_CO_RATED,
+    precision=SIMILARITY_PRECISION if SIMILARITY_PRECISION in ('float16', 'int8') else 'float32'
+)
+print("Evaluation Data Preprocessing: User correlation for evaluation saved successfully.")
 
-train_values = train_matrix.values.astype(float)
+# Item vectors and ANN index of the training matrix; content vectors do not depend on the split
+eval_item_vectors = item_vectors(train_csr.T)
+save_item_vectors(eval_item_vectors, item_index, DATA_PATH, 'eval_item_vectors')
+build_ann_index(eval_item_vectors, item_index).save(DATA_PATH, 'eval_item_ann')
+print("Evaluation Data Preprocessing: ANN index for evaluation saved successfully.")
 
-user_means = np.true_divide(train_values.sum(axis=1), (train_values != 0).sum(axis=1))
-centered = train_values - user_means[:, None]
-centered[train_values == 0] = 0
+load_or_train_factors(train_csr, DATA_PATH, factors_name(eval_mode=True, **DEFAULT_ALS_PARAMS), **DEFAULT_ALS_PARAMS)
+print("Evaluation Data Preprocessing: Matrix factorization for evaluation saved successfully.")
 
-norms = np.linalg.norm(centered, axis=1)
-norms[norms == 0] = 1
-similarity = centered @ centered.T / (norms[:, None] * norms[None, :])
-similarity = np.nan_to_num(similarity)
-
-user_correlation_matrix_eval = pd.DataFrame(similarity, index=train_matrix.index, columns=train_matrix.index)
-user_correlation_matrix_eval.to_pickle('../data/processed/eval_user_correlation_matrix.pkl')
-print("Evaluation Data Preprocessing: User correlation matrix for evaluation saved successfully.")
-
-popularity_eval = train_matrix.astype(bool).sum(axis=0).reset_index()
-popularity_eval.columns = ['MovieID', 'NumRatings']
+popularity_eval = pd.DataFrame({'MovieID': item_index, 'NumRatings': np.asarray((train_csr != 0).sum(axis=0)).ravel()})
 popularity_eval.to_pickle('../data/processed/eval_popularity.pkl')
-print("Evaluation Data Preprocessing: Popularity data for evaluation saved successfully.")
\ No newline at end of file
+print("Evaluation Data Preprocessing: Popularity data for evaluation saved successfully.")
+
+# Popularity rankings of the training ratings only, so time-decayed and segmented popularity can be evaluated
+ratings = pd.read_pickle(f'{DATA_PATH}/ratings.pkl')
+train_coo = train_csr.tocoo()
+train_pairs = pd.MultiIndex.from_arrays([user_index[train_coo.row], item_index[train_coo.col]])
+train_ratings = ratings[pd.MultiIndex.from_frame(ratings[['UserID', 'MovieID']]).isin(train_pairs)]
+save_popularity_rankings(popularity_eval, train_ratings, pd.read_pickle(f'{DATA_PATH}/users.pkl'), DATA_PATH,
+                         'eval_popularity_rankings', half_life_days=POPULARITY_HALF_LIFE_DAYS)
+print("Evaluation Data Preprocessing: Popularity rankings for evaluation saved successfully.")
\ No newline at end of file
@@ -1,66 +1,143 @@
-def precision_recall_f1_hit(recommended, actual, k=10):
-    recommended_k = recommended[:k]
-    actual = set(actual[actual > 0].index)
-    if not actual:
-        return 0, 0, 0, 0
-    
-    hits = len(set(recommended_k) & actual)
-    precision = hits / k
-    recall = hits / len(actual)
-    f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
-    hit_rate = 1 if hits > 0 else 0
-    return precision, recall, f1, hit_rate
-
-def run_evaluation_pipeline(user_item_matrix, models, top_k=10, test_ratio=0.2, random_seed=42):
-    import numpy as np
-    import pandas as pd
-    from tqdm import tqdm
-    from collections import defaultdict
-    
+import os
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+try:
+    from backend.sparse_matrix import frame_to_csr
+    from backend.data_splitting import load_or_create_split, split_matrices
+    from backend.ranking_metrics import recommendation_positions, per_user_metrics, summarize
+    from backend.recommenders import MODEL_CLASSES
+except ImportError:
+    from sparse_matrix import frame_to_csr
+    from data_splitting import load_or_create_split, split_matrices
+    from ranking_metrics import recommendation_positions, per_user_metrics, summarize
+    from recommenders import MODEL_CLASSES
+
+# Number of users evaluated per shard
+EVAL_CHUNK_SIZE = 512
+
+# Per-process state of evaluation workers, filled by _init_worker
+_worker_state = {}
+
+def _evaluate_shard(model, users, item_ids, top_k):
+    # (n_users, top_k) positions of the items recommended to one shard of users; scored later in bulk
+    if hasattr(model, "recommend_batch"):
+        recommendations = model.recommend_batch(users)
+    else:
+        recommendations = [model.recommend(user) for user in users]
+    return recommendation_positions(recommendations, item_ids, top_k)
+
+def _init_worker(models, user_ids, item_ids, top_k, random_seed):
+    np.random.seed(random_seed)
+    _worker_state.update(models=models, user_ids=user_ids, item_ids=item_ids, top_k=top_k)
+
+def _evaluate_shard_in_worker(task):
+    model_name, start, end = task
+    return _evaluate_shard(
+        _worker_state["models"][model_name],
+        _worker_state["user_ids"][start:end],
+        _worker_state["item_ids"],
+        _worker_state["top_k"]
+    )
+
+def _run_shards_in_pool(models, tasks, user_ids, item_ids, top_k, random_seed, n_jobs):
+    # fork lets workers inherit the models (and their memory-mapped matrices) without pickling them
+    mp_context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    initargs = (models, user_ids, item_ids, top_k, random_seed)
+
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp_context, initializer=_init_worker, initargs=initargs) as executor:
+        # map() yields results in task order, so merging stays deterministic
+        return list(tqdm(executor.map(_evaluate_shard_in_worker, tasks), total=len(tasks), desc="Shards"))
+
+def _evaluation_split(user_item_matrix, test_ratio, random_seed, data_path):
+    # Same cached split as evaluation_data_preprocessing.py when data_path is given, so eval-mode models
+    # are scored on exactly the ratings held out of their training matrix.
+    # user_item_matrix: dense DataFrame, or (CSR matrix, user index, item index) as from MatrixStore.load_sparse_or_dense
+    if isinstance(user_item_matrix, tuple):
+        user_item_csr, user_index, item_ids = user_item_matrix
+    else:
+        user_item_csr, user_index, item_ids = frame_to_csr(user_item_matrix)
+    train_idx, test_idx = load_or_create_split(user_item_csr, test_ratio=test_ratio, random_seed=random_seed, data_path=data_path)
+    train_csr, test_csr = split_matrices(user_item_csr, train_idx, test_idx)
+
+    # Training ratings per item, for the popularity bias and novelty of the recommendations
+    item_counts = np.diff(train_csr.tocsc().indptr)
+    n_train_users = max(np.count_nonzero(np.diff(train_csr.indptr)), 1)
+    return user_index, item_ids, test_csr, item_counts, n_train_users
+
+def run_evaluation_pipeline(user_item_matrix, models, top_k=10, test_ratio=0.2, random_seed=42, n_jobs=1, chunk_size=EVAL_CHUNK_SIZE,
+                            data_path=None, n_bootstrap=0, return_per_user=False):
+    # One report row per model (see ranking_metrics.py for the metrics). n_bootstrap > 0 adds bootstrap confidence
+    # intervals of every mean; return_per_user also returns each model's per-user metrics, indexed by UserID.
     np.random.seed(random_seed)
-    
-    train_matrix = user_item_matrix.copy()
-    test_matrix = pd.DataFrame(0, index=user_item_matrix.index, columns=user_item_matrix.columns)
-    
-    for user in user_item_matrix.index:
-        rated_items = user_item_matrix.loc[user][user_item_matrix.loc[user] > 0].index.tolist()
-        n_test_items = max(1, int(len(rated_items) * test_ratio))
-        test_items = np.random.choice(rated_items, size=n_test_items, replace=False)
-        
-        train_matrix.loc[user, test_items] = 0
-        test_matrix.loc[user, test_items] = user_item_matrix.loc[user, test_items]
-        
-    results = defaultdict(list)
-        
-    for model_name, model in tqdm(models.items(), desc="Models", position=0):
-        precisions = []
-        recalls = []
-        f1s = []
-        hit_rates = []
-        
-        recommended_items_all = set()
-        
-        for user in tqdm(train_matrix.index, desc=f"{model_name}", position=1, leave=False):
-            recommended_items = model.recommend(user)
-            actual_items = test_matrix.loc[user]
-            
-            precision, recall, f1, hit_rate = precision_recall_f1_hit(recommended_items, actual_items, k=top_k)
-            
-            precisions.append(precision)
-            recalls.append(recall)
-            f1s.append(f1)
-            hit_rates.append(hit_rate)
-            
-            recommended_items_all.update(recommended_items)
-        
-        user_coverage = np.mean(hit_rates)
-        catalog_coverage = len(recommended_items_all) / user_item_matrix.shape[1]
-        
-        results["Model"].append(model_name)
-        results["Precision"].append(np.mean(precisions))
-        results["Recall"].append(np.mean(recalls))
-        results["F1-Score"].append(np.mean(f1s))
-        results["User Coverage"].append(user_coverage)
-        results["Catalog Coverage"].append(catalog_coverage)
-    
-    return pd.DataFrame(results)
\ No newline at end of file
+    user_index, item_ids, test_csr, item_counts, n_train_users = _evaluation_split(user_item_matrix, test_ratio, random_seed, data_path)
+
+    # Shard users into contiguous chunks; every (model, chunk) pair is an independent task
+    user_ids = user_index.values
+    chunks = [(start, min(start + chunk_size, len(user_ids))) for start in range(0, len(user_ids), chunk_size)]
+    tasks = [(model_name, start, end) for model_name in models for start, end in chunks]
+
+    n_jobs = os.cpu_count() if n_jobs is None or n_jobs < 1 else n_jobs
+    if n_jobs > 1:
+        shard_results = _run_shards_in_pool(models, tasks, user_ids, item_ids, top_k, random_seed, n_jobs)
+    else:
+        shard_results = [
+            _evaluate_shard(models[model_name], user_ids[start:end], item_ids, top_k)
+            for model_name, start, end in tqdm(tasks, desc="Shards")
+        ]
+
+    results = []
+    per_user_results = {}
+    shards_per_model = len(chunks)
+
+    for model_index, model_name in enumerate(models):
+        # Shards are concatenated in user order, so the result matches a single serial pass
+        positions = np.concatenate(shard_results[model_index * shards_per_model:(model_index + 1) * shards_per_model])
+        per_user = per_user_metrics(positions, test_csr, item_counts, n_train_users, top_k)
+        results.append(dict(Model=model_name, **summarize(per_user, positions, len(item_ids), n_bootstrap, random_seed)))
+        per_user_results[model_name] = per_user.set_index(user_index)
+
+    results_df = pd.DataFrame(results)
+    return (results_df, per_user_results) if return_per_user else results_df
+
+def expand_grid(grid):
+    # Every combination of a {param: [values]} grid as a list of param dicts (a single empty dict for an empty grid)
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+def run_parameter_sweep(user_item_matrix, sweeps, top_k=10, test_ratio=0.2, random_seed=42, data_path=None, metric="NDCG"):
+    # sweeps: list of {"model": <MODEL_CLASSES name>, "params": {fixed constructor params}, "grid": {param: [values]}}.
+    # Grid parameters in the model's SWEEP_PARAMS are ranked from one scoring pass per user block (recommend_variants);
+    # every combination of the other grid parameters builds and scores its own model. Each grid point is evaluated at
+    # its own top_k. Returns the tidy results (one row per grid point: model, grid parameters, metrics) and the best
+    # row by `metric`.
+    np.random.seed(random_seed)
+    user_index, item_ids, test_csr, item_counts, n_train_users = _evaluation_split(user_item_matrix, test_ratio, random_seed, data_path)
+
+    results = []
+    parameter_columns = []
+    for sweep in sweeps:
+        model_class = MODEL_CLASSES[sweep["model"]]
+        params = dict({"top_k": top_k}, **sweep.get("params", {}))
+        grid = sweep.get("grid", {})
+        parameter_columns += [name for name in grid if name not in parameter_columns]
+        ranking_grid = {name: values for name, values in grid.items() if name in model_class.SWEEP_PARAMS}
+        scoring_grid = {name: values for name, values in grid.items() if name not in model_class.SWEEP_PARAMS}
+
+        for scoring_point in tqdm(expand_grid(scoring_grid), desc=sweep["model"]):
+            model = model_class(**dict(params, **scoring_point))
+            ranking_points = expand_grid(ranking_grid)
+            variants = [model.with_params(**ranking_point) for ranking_point in ranking_points]
+            recommendations = model.recommend_variants(user_index.values, [(variant, variant.top_k) for variant in variants])
+
+            for ranking_point, variant, variant_recommendations in zip(ranking_points, variants, recommendations):
+                positions = recommendation_positions(variant_recommendations, item_ids, variant.top_k)
+                per_user = per_user_metrics(positions, test_csr, item_counts, n_train_users, variant.top_k)
+                summary = summarize(per_user, positions, len(item_ids))
+                results.append(dict(Model=sweep["model"], **scoring_point, **ranking_point, **summary))
+
+    results_df = pd.DataFrame(results)[["Model"] + parameter_columns + list(summary)]
+    return results_df, results_df.loc[results_df[metric].idxmax()]
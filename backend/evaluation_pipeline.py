@@ -1,19 +1,20 @@
 import os
 import sys
 import json
+import argparse
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
 from collections import defaultdict
-from recommenders import UserBasedCFRecommender, ItemBasedCFRecommender, ContentBasedRecommender, HybridRecommender
-from evaluation_methods import precision_recall_f1_hit, run_evaluation_pipeline
+from recommenders import MODEL_CLASSES
+from evaluation_methods import run_evaluation_pipeline, run_parameter_sweep
+from matrix_store import get_store
 
-MODEL_CLASSES = {
-    "HybridRecommender": HybridRecommender,
-    "UserBasedCFRecommender": UserBasedCFRecommender,
-    "ItemBasedCFRecommender": ItemBasedCFRecommender,
-    "ContentBasedRecommender": ContentBasedRecommender
-}
+parser = argparse.ArgumentParser(description="Evaluate the recommenders configured in evaluation_config.json.")
+parser.add_argument('--sweep', action='store_true', help="Run the parameter grids in SWEEPS instead of evaluating MODELS.")
+parser.add_argument('--metric', default='NDCG', help="Metric that selects the best sweep configuration.")
+parser.add_argument('--output', default=None, help="Also write the results to this CSV file.")
+args = parser.parse_args()
 
 with open("evaluation_config.json", "r") as f:
     config = json.load(f)
@@ -21,25 +22,56 @@ with open("evaluation_config.json", "r") as f:
 TOP_K = config["TOP_K"]
 TEST_RATIO = config["TEST_RATIO"]
 RANDOM_SEED = config["RANDOM_SEED"]
+N_JOBS = config.get("N_JOBS", 1)
+BOOTSTRAP_RESAMPLES = config.get("BOOTSTRAP_RESAMPLES", 0)
 model_configs = config["MODELS"]
 
-models = {}
-for model_name, params in model_configs.items():
-    model_class = MODEL_CLASSES.get(model_name)
-    if model_class:
-        models[model_name] = model_class(**params)
-    else:
-        raise ValueError(f"Unknown model class: {model_name}")
+user_item_matrix = get_store('../data/processed').load_sparse_or_dense('user_item_csr', 'user_item_matrix')
 
-user_item_matrix = pd.read_pickle('../data/processed/user_item_matrix.pkl')
+if args.sweep:
+    # Score-once sweep: one scoring pass per model build, every blend/ranking parameter evaluated from it
+    results_df, best = run_parameter_sweep(
+        user_item_matrix=user_item_matrix,
+        sweeps=config["SWEEPS"],
+        top_k=TOP_K,
+        test_ratio=TEST_RATIO,
+        random_seed=RANDOM_SEED,
+        data_path='../data/processed',
+        metric=args.metric
+    )
 
-results_df = run_evaluation_pipeline(
-    user_item_matrix=user_item_matrix,
-    models=models,
-    top_k=TOP_K,
-    test_ratio=TEST_RATIO,
-    random_seed=RANDOM_SEED
-)
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(results_df.sort_values(args.metric, ascending=False).to_string(index=False))
+    print(f"\nBest configuration by {args.metric}:")
+    print(best.dropna().to_string())
+else:
+    models = {}
+    for model_name, params in model_configs.items():
+        model_class = MODEL_CLASSES.get(model_name)
+        if model_class:
+            models[model_name] = model_class(**params)
+        else:
+            raise ValueError(f"Unknown model class: {model_name}")
 
-print(results_df)
+    results_df, per_user_results = run_evaluation_pipeline(
+        user_item_matrix=user_item_matrix,
+        models=models,
+        top_k=TOP_K,
+        test_ratio=TEST_RATIO,
+        random_seed=RANDOM_SEED,
+        n_jobs=N_JOBS,
+        data_path='../data/processed',
+        n_bootstrap=BOOTSTRAP_RESAMPLES,
+        return_per_user=True
+    )
 
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(results_df)
+
+        # Per-user distribution of every metric
+        for model_name, per_user in per_user_results.items():
+            print(f"\n{model_name}")
+            print(per_user.describe(percentiles=[0.25, 0.5, 0.75, 0.9]).T)
+
+if args.output:
+    results_df.to_csv(args.output, index=False)
@@ -1,15 +1,190 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header, Request, Query
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, Response
+from pydantic import BaseModel
+import asyncio
+import itertools
+import json
+import numpy as np
 import pandas as pd
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from backend import instrumentation, snapshots
+from backend.instrumentation import span, count, profile_call
+from backend.ingestion import RatingIngestor, load_ingested_ratings
+from backend.matrix_store import release_store
+from backend.result_cache import ResultCache
+from backend.precomputed_recommendations import PrecomputedRecommendations
+from backend.popularity import GENDER_CODES
 from backend.recommenders import (
     UserBasedCFRecommender, 
     ItemBasedCFRecommender, 
     ContentBasedRecommender, 
-    HybridRecommender
+    HybridRecommender,
+    DATA_PATH
 )
 
-app = FastAPI(title="Recommender API")
+# Optional encoders of /recommend/batch responses: orjson for JSON (standard json otherwise), msgpack for format=msgpack
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Recommendation lists are cached per (model, params, user, data version); cache misses are computed in a thread pool
+RESULT_CACHE_SIZE = 10000
+RESULT_CACHE_TTL = 300
+RECOMMEND_WORKERS = 4
+
+# Users accepted by one /recommend/batch request, and the movie fields they can select
+MAX_BATCH_USERS = 10000
+BATCH_FIELDS = ["MovieID", "Title", "Genres"]
+
+# Artifacts are served from the current snapshot published by preprocessing (see snapshots.py), or from DATA_PATH
+# itself when none was published. POST /admin/reload switches snapshots without a restart; with
+# SNAPSHOT_WATCH_SECONDS > 0 the CURRENT pointer is also polled and a newly published snapshot loaded automatically.
+SNAPSHOT_ROOT = snapshots.snapshot_root(DATA_PATH)
+SNAPSHOT_WATCH_SECONDS = 0
+# Users scored by every model of a reloaded snapshot before it takes traffic
+WARMUP_USERS = 5
+
+# Serving mode: answer from the tables built by precomputed_recommendations.py, scoring live only when a table is missing
+USE_PRECOMPUTED = True
+
+# Phase timings, counters and histograms served at /metrics; when disabled every span is a no-op
+METRICS_ENABLED = True
+# Per-request cProfile reports, requested with ?profile=true or the "X-Profile: 1" header
+ALLOW_PROFILING = True
+
+instrumentation.enable(METRICS_ENABLED)
+REQUEST_SECONDS = instrumentation.registry.histogram('api_request_seconds', "Request latency per route.", ('route',))
+REQUESTS = instrumentation.registry.counter('api_requests_total', "Requests per route and status code.", ('route', 'status'))
+RECOMMENDATION_SOURCES = instrumentation.registry.counter(
+    'recommendation_source_total', "Recommendation lists by model and where they came from.", ('model', 'source')
+)
+
+model_params = {
+    "UserBasedCF": {"top_k": 10},
+    "ItemBasedCF": {"top_k": 10},
+    "ContentBased": {"top_k": 10},
+    "Hybrid": {"top_k": 10, "alpha": 0.8}
+}
+model_classes = {
+    "UserBasedCF": UserBasedCFRecommender,
+    "ItemBasedCF": ItemBasedCFRecommender,
+    "ContentBased": ContentBasedRecommender,
+    "Hybrid": HybridRecommender
+}
+
+recommend_executor = ThreadPoolExecutor(max_workers=RECOMMEND_WORKERS)
+
+class ServingState:
+    # Everything served from one artifact directory: recommenders, result cache, precomputed tables and lookup tables.
+    # Handlers read the current state once per request, so a reload never mixes two snapshots within a response.
+    def __init__(self, data_path, version=None):
+        self.data_path = data_path
+        self.version = version
+        # Created before the recommenders: the matrix store then maps its files copy-on-write,
+        # so ingested ratings update the matrices the recommenders read without a restart.
+        # The ingestion log stays in the processed directory, which compaction reads.
+        self.ingestor = RatingIngestor(data_path, log_path=DATA_PATH)
+        self.models = {name: model_classes[name](data_path=data_path, **params) for name, params in model_params.items()}
+        # Recommenders keep per-call state (e.g. their last scores), so each one serves a single computation at a time
+        self.model_locks = {name: threading.Lock() for name in self.models}
+        self.result_cache = ResultCache(max_size=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+        self.precomputed = PrecomputedRecommendations(data_path)
+
+        movies = pd.read_pickle(data_path / 'movies.pkl').set_index('MovieID')
+        self.users = pd.read_pickle(data_path / 'users.pkl')["UserID"].tolist()
+        self.user_index = self.models["UserBasedCF"].user_index
+        # Global, time-decayed and demographic popularity rankings (shared with the recommenders' cold-start fallback)
+        self.popularity_rankings = self.models["UserBasedCF"].popularity_rankings
+
+        # Enrichment lookup tables, built once: MovieID -> row position and one array per response field for batches,
+        # and the ready-made response entry of every movie for single-user lists
+        self.movie_positions = movies.index
+        self.movie_fields = {
+            "MovieID": movies.index.to_numpy(),
+            "Title": movies["Title"].to_numpy(dtype=object),
+            "Genres": movies["GenresStr"].to_numpy(dtype=object)
+        }
+        self.movie_details = {
+            mid: {"MovieID": mid, "Title": title, "Genres": genres}
+            for mid, title, genres in zip(self.movie_fields["MovieID"].tolist(), self.movie_fields["Title"], self.movie_fields["Genres"])
+        }
+
+def load_serving_state(version=None):
+    snapshot_path, version = snapshots.resolve_snapshot(SNAPSHOT_ROOT, version)
+    return ServingState(snapshot_path if snapshot_path is not None else DATA_PATH, version)
+
+serving = load_serving_state()
+
+# One reload at a time. Ratings are ingested under ingest_lock, so none is lost between replaying the ingestion log
+# into a new state and swapping it in.
+reload_lock = threading.Lock()
+ingest_lock = threading.Lock()
+reload_status = {"State": "idle", "Target": None, "Error": None}
+
+def warm_up(state):
+    # Scores a few users with every model: loads the artifacts the recommenders read lazily and pages in the
+    # memory-mapped matrices before the state takes traffic
+    user_ids = state.users[:WARMUP_USERS]
+    for model in state.models.values():
+        for user_id in user_ids:
+            model.recommend(user_id)
+        model.recommend_batch(user_ids)
+
+def reload_snapshot(version=None):
+    # Runs in a background thread while the current state keeps serving: verifies the snapshot (the current
+    # published one by default), loads and warms it, replays the ratings ingested since, swaps it in and releases
+    # the previous state. Its matrices are unmapped once the requests still using it are done.
+    global serving
+    with reload_lock:
+        snapshot_path = None
+        try:
+            snapshot_path, version = snapshots.resolve_snapshot(SNAPSHOT_ROOT, version)
+            if snapshot_path is None or version == serving.version:
+                reload_status.update(State="idle", Target=version, Error=None)
+                return
+            reload_status.update(State="loading", Target=version, Error=None)
+            snapshots.verify_snapshot(snapshot_path)
+            state = ServingState(snapshot_path, version)
+            reload_status["State"] = "warming"
+            warm_up(state)
+            with ingest_lock:
+                changed = state.ingestor.replay(load_ingested_ratings(DATA_PATH))
+                state.precomputed.invalidate_users(changed)
+                previous, serving = serving, state
+            release_store(previous.data_path)
+            reload_status.update(State="idle", Error=None)
+        except Exception as e:
+            if snapshot_path is not None and snapshot_path != serving.data_path:
+                release_store(snapshot_path)
+            reload_status.update(State="failed", Error=str(e))
+
+def watch_snapshots():
+    # Reloads whenever preprocessing publishes a new current snapshot; a snapshot that failed to load is not retried
+    while True:
+        time.sleep(SNAPSHOT_WATCH_SECONDS)
+        version = snapshots.current_version(SNAPSHOT_ROOT)
+        failed = reload_status["State"] == "failed" and reload_status["Target"] == version
+        if version is not None and version != serving.version and not failed:
+            reload_snapshot(version)
+
+@asynccontextmanager
+async def lifespan(app):
+    if SNAPSHOT_WATCH_SECONDS > 0:
+        threading.Thread(target=watch_snapshots, daemon=True).start()
+    yield
+
+app = FastAPI(title="Recommender API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,41 +194,333 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-user_cf = UserBasedCFRecommender(top_k=10)
-item_cf = ItemBasedCFRecommender(top_k=10)
-content_cb = ContentBasedRecommender(top_k=10)
-hybrid = HybridRecommender(top_k=10, alpha=0.8)
-
-# Assume backend server runs with provided command in README
-movies = pd.read_pickle('data/processed/movies.pkl').set_index('MovieID')
-users = pd.read_pickle('data/processed/users.pkl')["UserID"].tolist()
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if not instrumentation.registry.enabled:
+        return await call_next(request)
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Labelled by route template, so unknown paths do not create new series
+    route = request.scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - start, route_path)
+    REQUESTS.inc(route_path, str(response.status_code))
+    return response
 
 @app.get("/")
 async def root():
     return {"message": "Recommender API is running..."}
 
+def precomputed_recommendations(state, name, user_id):
+    if not USE_PRECOMPUTED:
+        return None
+    params = model_params[name]
+    return state.precomputed.lookup(type(state.models[name]).__name__, params, user_id, params["top_k"])
+
+def cache_key(name, user_id):
+    return (name, json.dumps(model_params[name], sort_keys=True), user_id)
+
+def stored_recommendations(state, name, user_id, data_version):
+    mids = precomputed_recommendations(state, name, user_id)
+    if mids is not None:
+        count(RECOMMENDATION_SOURCES, name, "precomputed")
+        return mids
+    mids = state.result_cache.get(cache_key(name, user_id), data_version)
+    if mids is not None:
+        count(RECOMMENDATION_SOURCES, name, "cache")
+    return mids
+
+def score_model(state, name, user_id, data_version, **score_inputs):
+    # Runs in the worker pool: the NumPy scoring would otherwise block the event loop.
+    # Returns the list and the aligned score array (if the model keeps one) for reuse within the request.
+    model = state.models[name]
+    with state.model_locks[name]:
+        mids = list(model.recommend(user_id, **score_inputs))
+        scores = getattr(model, 'score_vector', None)
+    count(RECOMMENDATION_SOURCES, name, "live")
+    state.result_cache.put(cache_key(name, user_id), data_version, mids)
+    return mids, scores
+
+async def model_recommendations(state, name, user_id, data_version):
+    mids = stored_recommendations(state, name, user_id, data_version)
+    if mids is not None:
+        return mids, None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(recommend_executor, score_model, state, name, user_id, data_version)
+
+async def hybrid_recommendations(state, user_id, data_version, item_cf_task, content_task):
+    # The hybrid's default children are configured like the ItemBasedCF and ContentBased models: their score arrays
+    # from this request are blended directly instead of being computed a second time
+    mids = stored_recommendations(state, "Hybrid", user_id, data_version)
+    if mids is not None:
+        return mids, None
+    (_, item_cf_scores), (_, content_scores) = await asyncio.gather(item_cf_task, content_task)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        recommend_executor,
+        lambda: score_model(state, "Hybrid", user_id, data_version, child_scores=[item_cf_scores, content_scores])
+    )
+
+def recommendation_tasks(state, user_id):
+    # All four models start at once, so request latency follows the slowest model rather than the sum
+    data_version = state.ingestor.store.data_version
+    tasks = {name: asyncio.ensure_future(model_recommendations(state, name, user_id, data_version))
+             for name in ("UserBasedCF", "ItemBasedCF", "ContentBased")}
+    tasks["Hybrid"] = asyncio.ensure_future(
+        hybrid_recommendations(state, user_id, data_version, tasks["ItemBasedCF"], tasks["ContentBased"])
+    )
+    return tasks
+
+def detailed(state, mids):
+    with span("API", "enrichment"):
+        return [state.movie_details[mid] for mid in mids]
+
+def demographics_from_query(gender, age, occupation):
+    # users.pkl encoding of the demographics a new user supplied; None when none were given
+    if gender is not None and gender not in GENDER_CODES:
+        raise HTTPException(status_code=400, detail=f"gender must be one of {list(GENDER_CODES)}.")
+    if gender is None and age is None and occupation is None:
+        return None
+    return {"Gender": GENDER_CODES.get(gender), "Age": age, "Occupation": occupation}
+
+def cold_start_recommendations(state, demographics):
+    # Users missing from the rating matrix: every model would fall back to popularity, so all lists are slices of
+    # the ranking of the user's demographic segment (the global ranking without demographics)
+    for name in state.models:
+        count(RECOMMENDATION_SOURCES, name, "popularity")
+    return {
+        name: detailed(state, state.popularity_rankings.for_segment(model_params[name]["top_k"], demographics).tolist())
+        for name in state.models
+    }
+
+def profiled_recommendations(state, user_id):
+    # Every model scored live, one after the other on the calling thread: cProfile only follows one thread
+    data_version = state.ingestor.store.data_version
+    results = {name: score_model(state, name, user_id, data_version) for name in ("UserBasedCF", "ItemBasedCF", "ContentBased")}
+    results["Hybrid"] = score_model(
+        state, "Hybrid", user_id, data_version, child_scores=[results["ItemBasedCF"][1], results["ContentBased"][1]]
+    )
+    return {name: detailed(state, mids) for name, (mids, _) in results.items()}
+
 @app.get("/recommend")
-async def recommend(user_id: int = None, random_user: bool = False):
+async def recommend(user_id: int = None, random_user: bool = False, profile: bool = False,
+                    x_profile: str | None = Header(default=None), gender: str | None = None, age: int | None = None,
+                    occupation: int | None = None):
+    # gender ('F'/'M'), age and occupation (users.dat codes) personalize the popularity lists of new users
+    state = serving
     if random_user or user_id is None:
-        user_id = random.choice(users)
+        user_id = random.choice(state.users)
     
-    recommendations = {
-        "UserBasedCF": user_cf.recommend(user_id),
-        "ItemBasedCF": item_cf.recommend(user_id),
-        "ContentBased": content_cb.recommend(user_id),
-        "Hybrid": hybrid.recommend(user_id)
-    }
+    if user_id not in state.user_index:
+        return {
+            "UserID": user_id,
+            "Recommendations": cold_start_recommendations(state, demographics_from_query(gender, age, occupation)),
+            "Snapshot": state.version
+        }
+    
+    if ALLOW_PROFILING and (profile or x_profile in ("1", "true")):
+        loop = asyncio.get_running_loop()
+        recs_detailed, report = await loop.run_in_executor(
+            recommend_executor, profile_call, profiled_recommendations, state, user_id
+        )
+        return {
+            "UserID": user_id,
+            "Recommendations": recs_detailed,
+            "Profile": report,
+            "Snapshot": state.version
+        }
+    
+    tasks = recommendation_tasks(state, user_id)
+    results = await asyncio.gather(*tasks.values())
     
     recs_detailed = {}
-    for key, mids in recommendations.items():
-        recs_detailed[key] = []
-        for mid in mids:
-            recs_detailed[key].append({
-                "MovieID": mid, 
-                "Title": movies.loc[mid]["Title"],
-                "Genres": movies.loc[mid]["GenresStr"]
-            })
+    for key, (mids, _) in zip(tasks, results):
+        recs_detailed[key] = detailed(state, mids)
     return {
         "UserID": user_id,
-        "Recommendations": recs_detailed
-    }
\ No newline at end of file
+        "Recommendations": recs_detailed,
+        "Snapshot": state.version
+    }
+
+@app.get("/recommend/stream")
+async def recommend_stream(user_id: int = None, random_user: bool = False, format: str = "ndjson"):
+    # Emits each model's list as soon as it is ready, as NDJSON lines or server-sent events
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'.")
+    state = serving
+    if random_user or user_id is None:
+        user_id = random.choice(state.users)
+    
+    async def named(name, task):
+        mids, _ = await task
+        return name, mids
+    
+    async def events():
+        tasks = recommendation_tasks(state, user_id)
+        for finished in asyncio.as_completed([named(name, task) for name, task in tasks.items()]):
+            name, mids = await finished
+            payload = json.dumps({
+                "UserID": user_id, "Model": name, "Recommendations": jsonable_encoder(detailed(state, mids)),
+                "Snapshot": state.version
+            })
+            yield f"event: {name}\ndata: {payload}\n\n" if format == "sse" else payload + "\n"
+    
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
+class BatchRecommendIn(BaseModel):
+    user_ids: list[int]
+    models: list[str] | None = None
+    fields: list[str] = BATCH_FIELDS
+    layout: str = "records"
+    format: str = "json"
+
+def batch_recommendations(state, name, user_ids, data_version):
+    # One model for many users: lists from the precomputed table or the result cache where available,
+    # every other user scored in one recommend_batch call (blocks of users as matrix products)
+    lists = [stored_recommendations(state, name, user_id, data_version) for user_id in user_ids]
+    missing = [row for row, mids in enumerate(lists) if mids is None]
+    if missing:
+        missing_ids = [user_ids[row] for row in missing]
+        with state.model_locks[name]:
+            recommendations = state.models[name].recommend_batch(missing_ids).tolist()
+        count(RECOMMENDATION_SOURCES, name, "live", amount=len(missing))
+        for row, user_id, mids in zip(missing, missing_ids, recommendations):
+            state.result_cache.put(cache_key(name, user_id), data_version, mids)
+            lists[row] = mids
+    return lists
+
+def enrich_batch(state, lists, fields):
+    # Every list of a model enriched at once: one index lookup for all MovieIDs, then one take per field.
+    # Returns {field: values per user}.
+    with span("API", "batch_enrichment"):
+        lengths = [len(mids) for mids in lists]
+        positions = state.movie_positions.get_indexer(np.fromiter(itertools.chain.from_iterable(lists), dtype=np.int64))
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+        columns = {}
+        for field in fields:
+            values = state.movie_fields[field][positions].tolist()
+            columns[field] = [values[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        return columns
+
+def batch_content(state, user_ids, columns, fields, layout):
+    # "columnar": per model, one list of values per user for each field (UserIDs gives the row order);
+    # "records": per user, the /recommend shape restricted to the selected fields
+    if layout == "columnar":
+        return {"UserIDs": user_ids, "Recommendations": columns, "Snapshot": state.version}
+    return [{
+        "UserID": user_id,
+        "Recommendations": {
+            name: [dict(zip(fields, values)) for values in zip(*(model_columns[field][row] for field in fields))]
+            for name, model_columns in columns.items()
+        }
+    } for row, user_id in enumerate(user_ids)]
+
+def encoded_response(content, format, headers=None):
+    if format == "msgpack":
+        return Response(msgpack.packb(content), media_type="application/msgpack", headers=headers)
+    if orjson is not None:
+        return Response(orjson.dumps(content), media_type="application/json", headers=headers)
+    return JSONResponse(content, headers=headers)
+
+@app.post("/recommend/batch")
+async def recommend_batch(request: BatchRecommendIn):
+    # Recommendations of many users in one call, e.g. for campaign jobs. Models run concurrently in the worker pool.
+    # The snapshot version is sent in the X-Snapshot-Version header (records are a bare list).
+    state = serving
+    model_names = request.models if request.models is not None else list(state.models)
+    unknown_models = [name for name in model_names if name not in state.models]
+    if unknown_models:
+        raise HTTPException(status_code=400, detail=f"Unknown models: {unknown_models}")
+    unknown_fields = [field for field in request.fields if field not in state.movie_fields]
+    if unknown_fields:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {unknown_fields}")
+    if request.layout not in ("records", "columnar"):
+        raise HTTPException(status_code=400, detail="layout must be 'records' or 'columnar'.")
+    if request.format not in ("json", "msgpack"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'msgpack'.")
+    if request.format == "msgpack" and msgpack is None:
+        raise HTTPException(status_code=400, detail="format 'msgpack' needs the msgpack package.")
+    if len(request.user_ids) > MAX_BATCH_USERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_USERS} user_ids per request.")
+    
+    data_version = state.ingestor.store.data_version
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(recommend_executor, batch_recommendations, state, name, request.user_ids, data_version)
+        for name in model_names
+    ))
+    columns = {name: enrich_batch(state, lists, request.fields) for name, lists in zip(model_names, results)}
+    return encoded_response(
+        batch_content(state, request.user_ids, columns, request.fields, request.layout), request.format,
+        headers={"X-Snapshot-Version": state.version or ""}
+    )
+
+@app.get("/popular")
+async def popular(kind: str = "global", top_k: int = Query(10, ge=1), gender: str | None = None, age: int | None = None,
+                  occupation: int | None = None):
+    # kind: 'global' (rating count), 'recent' (time-decayed rating count) or 'segment' (users with the given
+    # demographics; lists longer than the stored segment rankings fall back to the global ranking)
+    if kind not in ("global", "recent", "segment"):
+        raise HTTPException(status_code=400, detail="kind must be 'global', 'recent' or 'segment'.")
+    state = serving
+    if kind == "segment":
+        mids = state.popularity_rankings.for_segment(top_k, demographics_from_query(gender, age, occupation))
+    else:
+        mids = state.popularity_rankings.top(top_k, kind)
+    return {"Kind": kind, "Recommendations": detailed(state, mids.tolist()), "Snapshot": state.version}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    state = serving
+    return dict(state.result_cache.stats(), Snapshot=state.version)
+
+@app.post("/admin/reload", status_code=202)
+async def admin_reload(snapshot: str | None = None):
+    # Loads a snapshot (the current published one by default) in the background; requests are served from the
+    # loaded one until the new one is warm. GET /admin/snapshot reports the progress.
+    try:
+        snapshot_path, snapshot = snapshots.resolve_snapshot(SNAPSHOT_ROOT, snapshot)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if snapshot_path is None:
+        raise HTTPException(status_code=404, detail="No snapshot has been published.")
+    if reload_lock.locked():
+        raise HTTPException(status_code=409, detail="A reload is already in progress.")
+    threading.Thread(target=reload_snapshot, args=(snapshot,), daemon=True).start()
+    return {"Snapshot": serving.version, "Target": snapshot}
+
+@app.get("/admin/snapshot")
+async def admin_snapshot():
+    return {
+        "Snapshot": serving.version,
+        "DataPath": str(serving.data_path),
+        "Published": snapshots.current_version(SNAPSHOT_ROOT),
+        "Reload": dict(reload_status)
+    }
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(instrumentation.registry.render(), media_type="text/plain; version=0.0.4")
+
+class RatingIn(BaseModel):
+    UserID: int
+    MovieID: int
+    Rating: float
+    Timestamp: int | None = None
+
+@app.post("/ratings")
+def ingest_ratings(ratings: list[RatingIn]):
+    # Plain def: FastAPI runs the in-place matrix updates in its thread pool
+    with ingest_lock:
+        state = serving
+        data_version = state.ingestor.store.data_version
+        try:
+            result = state.ingestor.ingest([rating.model_dump() for rating in ratings])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # Precomputed lists that no longer reflect the updated matrices are served live from now on
+        if result["data_version"] != data_version:
+            state.precomputed.invalidate_users(rating.UserID for rating in ratings)
+    return dict(result, Snapshot=state.version)
\ No newline at end of file
@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+try:
+    from backend.matrix_store import get_store
+    from backend.user_similarity import similarity_row, DEFAULT_MIN_CO_RATED
+except ImportError:
+    from matrix_store import get_store
+    from user_similarity import similarity_row, DEFAULT_MIN_CO_RATED
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_PATH = Path(os.environ.get('RECOMMENDER_DATA_PATH', BASE_DIR / 'data' / 'processed'))
+
+# Append-only log of ingested ratings, merged into ratings.dat by the next preprocessing run (compaction)
+INGESTED_RATINGS_FILE = 'ingested_ratings.csv'
+RATING_COLUMNS = ['UserID', 'MovieID', 'Rating', 'Timestamp']
+
+def load_ingested_ratings(data_path=DATA_PATH):
+    log_file = Path(data_path) / INGESTED_RATINGS_FILE
+    if not log_file.exists():
+        return pd.DataFrame(columns=RATING_COLUMNS)
+    return pd.read_csv(log_file, names=RATING_COLUMNS)
+
+class RatingIngestor:
+    # Applies new ratings to the production matrices in place:
+    # - item cosine similarity and adjusted (item-centered) similarity: row and column of the rated item
+    # - user similarity: row and column of the rating user, recomputed from the ratings of the items they rated
+    # Running sums and sums of squares per item are maintained here; the off-diagonal dot products are recovered
+    # from the similarity row being updated, so no extra Gram matrix is kept in memory.
+    # Ratings of users or movies unknown to the matrices are only logged and picked up by the next compaction,
+    # as are popularity counts and the top-N neighbor lists. So is every rating on the CSR backend (SPARSE_BACKEND),
+    # which has no dense matrices to update.
+    # Updates live in this process only (copy-on-write mappings); other workers see them after compaction.
+    # log_path: directory of the ingestion log, data_path by default (the processed directory when serving a snapshot)
+    def __init__(self, data_path=DATA_PATH, log_path=None):
+        self.data_path = Path(data_path)
+        self.log_path = Path(log_path) if log_path is not None else self.data_path
+        self.store = get_store(data_path)
+        self.store.enable_updates()
+        self._lock = threading.Lock()
+        self.catalog = pd.Index(pd.read_pickle(self.data_path / 'movies.pkl')['MovieID'])
+
+        self.in_place = self.store.has_frame('user_item_matrix')
+        if not self.in_place:
+            return
+        user_item_matrix = self.store.load_frame('user_item_matrix')
+        self.user_index = user_item_matrix.index
+        self.item_index = user_item_matrix.columns
+        self.ratings = user_item_matrix.values
+
+        self.item_similarity = self._aligned_values('item_similarity_matrix_df', self.item_index)
+        self.adjusted_item_similarity = self._aligned_values('adjusted_item_similarity_matrix_df', self.item_index)
+        # Absent when preprocessing kept only the top-N user neighbor lists
+        self.user_correlation = None
+        if self.store.has_matrix('user_correlation_matrix'):
+            self.user_correlation = self._aligned_values('user_correlation_matrix', self.user_index)
+            self.min_co_rated = self.store.matrix_meta('user_correlation_matrix').get("min_co_rated", DEFAULT_MIN_CO_RATED)
+
+        self.item_sums = self.ratings.sum(axis=0)
+        self.item_squares = np.einsum('ij,ij->j', self.ratings, self.ratings)
+        self.user_sums = self.ratings.sum(axis=1)
+        self.user_counts = (self.ratings != 0).sum(axis=1)
+
+    def _aligned_values(self, name, ids):
+        df = self.store.load_frame(name)
+        if not (df.index.equals(ids) and df.columns.equals(ids)):
+            raise ValueError(f"Matrix '{name}' is not aligned with the User-Item matrix, rerun preprocessing.")
+        return df.values
+
+    def ingest(self, ratings):
+        # ratings: DataFrame (or list of dicts) with UserID, MovieID, Rating and optional Timestamp
+        ratings = pd.DataFrame(ratings)
+        if 'Timestamp' not in ratings:
+            ratings['Timestamp'] = np.nan
+        ratings['Timestamp'] = pd.to_numeric(ratings['Timestamp']).fillna(int(time.time())).astype(np.int64)
+        ratings = ratings[RATING_COLUMNS]
+        if (ratings['Rating'] <= 0).any():
+            raise ValueError("Ratings must be positive: 0 marks an unrated item.")
+        unknown_movies = ~ratings['MovieID'].isin(self.catalog)
+        if unknown_movies.any():
+            raise ValueError(f"Unknown MovieIDs: {ratings.loc[unknown_movies, 'MovieID'].unique().tolist()}")
+
+        with self._lock:
+            applied, _ = self._apply_ratings(ratings)
+            ratings.to_csv(self.log_path / INGESTED_RATINGS_FILE, mode='a', header=False, index=False)
+
+        return {"applied": applied, "deferred": len(ratings) - applied, "data_version": self.store.data_version}
+
+    def replay(self, ratings):
+        # Re-applies logged ratings (load_ingested_ratings) without logging them again, e.g. to a freshly loaded
+        # snapshot. Ratings the snapshot already contains leave it unchanged. Returns the users whose ratings changed.
+        with self._lock:
+            return self._apply_ratings(ratings)[1]
+
+    def _apply_ratings(self, ratings):
+        # Applies the ratings of known users and movies in order.
+        # Returns how many were applied and the UserIDs of those that changed a stored rating.
+        if not self.in_place:
+            return 0, []
+        user_rows = self.user_index.get_indexer(ratings['UserID'])
+        item_cols = self.item_index.get_indexer(ratings['MovieID'])
+        applied, changed = 0, []
+        for user_id, user_row, item_col, rating in zip(ratings['UserID'].values, user_rows, item_cols, ratings['Rating'].values):
+            if user_row >= 0 and item_col >= 0:
+                applied += 1
+                if self._apply(user_row, item_col, float(rating)):
+                    changed.append(int(user_id))
+        if changed:
+            self.store.mark_updated()
+        return applied, changed
+
+    def _apply(self, u, i, rating):
+        old_rating = self.ratings[u, i]
+        delta = rating - old_rating
+        if delta == 0:
+            return False
+        n_users, n_items = self.ratings.shape
+        new_item_square = self.item_squares[i] + rating ** 2 - old_rating ** 2
+
+        # Item i against every item: dot products recovered from the cosine row, then shifted by the changed rating
+        item_norms = np.sqrt(self.item_squares)
+        item_dots = self.item_similarity[i] * item_norms[i] * item_norms
+        item_dots += delta * self.ratings[u]
+        item_dots[i] = new_item_square
+
+        # Running statistics and the rating itself
+        self.item_sums[i] += delta
+        self.item_squares[i] = new_item_square
+        self.user_sums[u] += delta
+        self.user_counts[u] += old_rating == 0
+        self.ratings[u, i] = rating
+        self._update_sparse_rating(u, i, rating)
+
+        # Cosine similarity row/column of item i
+        item_norms[i] = np.sqrt(new_item_square)
+        norm_products = item_norms[i] * item_norms
+        cosine_row = np.divide(item_dots, norm_products, out=np.zeros(n_items), where=norm_products > 0)
+        self.item_similarity[i, :] = cosine_row
+        self.item_similarity[:, i] = cosine_row
+
+        # Adjusted similarity: cosine of item vectors centered by their mean over all users
+        item_means = self.item_sums / n_users
+        centered_dots = item_dots - n_users * item_means[i] * item_means
+        centered_squares = np.maximum(self.item_squares - n_users * item_means ** 2, 0)
+        centered_norms = np.sqrt(centered_squares[i] * centered_squares)
+        adjusted_row = np.divide(centered_dots, centered_norms, out=np.zeros(n_items), where=centered_norms > 0)
+        self.adjusted_item_similarity[i, :] = adjusted_row
+        self.adjusted_item_similarity[:, i] = adjusted_row
+
+        # Similarity row/column of user u: only u's mean and ratings changed, so no other pair is affected
+        if self.user_correlation is not None:
+            user_means = np.divide(self.user_sums, self.user_counts, out=np.zeros(n_users), where=self.user_counts > 0)
+            similarity = similarity_row(self.ratings, user_means, u, self.min_co_rated)
+            self.user_correlation[u, :] = similarity
+            self.user_correlation[:, u] = similarity
+        return True
+
+    def _update_sparse_rating(self, u, i, rating):
+        # Keep the CSR copy used by sparse-mode recommenders in sync, if one is loaded
+        cached = self.store.cached_sparse('user_item_csr')
+        if cached is None:
+            return
+        csr = cached[0]
+        start, end = csr.indptr[u], csr.indptr[u + 1]
+        position = np.searchsorted(csr.indices[start:end], i)
+        if position < end - start and csr.indices[start + position] == i:
+            csr.data[start + position] = rating
+        else:
+            # New entry: scipy rebuilds the arrays of the same matrix object, so every holder sees it
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                csr[u, i] = rating
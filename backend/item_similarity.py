@@ -0,0 +1,64 @@
+import numpy as np
+import scipy.sparse as sp
+
+try:
+    from backend.matrix_store import save_matrix_blocks, save_neighbor_index
+    from backend.neighbor_index import top_n_block, DEFAULT_TOP_N
+    from backend.user_similarity import DENSE_OPERAND_LIMIT
+except ImportError:
+    from matrix_store import save_matrix_blocks, save_neighbor_index
+    from neighbor_index import top_n_block, DEFAULT_TOP_N
+    from user_similarity import DENSE_OPERAND_LIMIT
+
+# Items per row block; capped so each float64 (block x items) product holds at most BLOCK_ELEMENTS values
+ITEM_SIMILARITY_BLOCK_SIZE = 1024
+BLOCK_ELEMENTS = 1 << 24
+
+def similarity_blocks(features, centered=False, block_size=None):
+    # Cosine similarity of every pair of rows of a (items x features) matrix, dense or sparse, in float64 row blocks:
+    # yields (start_row, block) with block[a, j] the similarity of row start_row + a and row j.
+    # centered=True first subtracts each row's mean over all its features, zeros included (the adjusted cosine of
+    # the item-based recommender). The centered matrix is never built: its products follow from the raw ones as
+    # x_i . x_j - n m_i m_j, so the features stay sparse.
+    # Rows without any variation (e.g. all zeros) have similarity 0, as with sklearn's cosine_similarity.
+    features = sp.csr_matrix(features, dtype=np.float64)
+    n_rows, n_features = features.shape
+    means = np.asarray(features.sum(axis=1)).ravel() / max(n_features, 1) if centered else np.zeros(n_rows)
+    squares = np.asarray(features.multiply(features).sum(axis=1)).ravel() - n_features * means ** 2
+    norms = np.sqrt(np.maximum(squares, 0))
+
+    # Right operand of every block product, densified for BLAS when it fits
+    right = features.T.toarray() if n_rows * n_features * 8 <= DENSE_OPERAND_LIMIT else features.T.tocsc()
+    block_size = block_size or max(1, min(ITEM_SIMILARITY_BLOCK_SIZE, BLOCK_ELEMENTS // max(n_rows, 1)))
+
+    for start in range(0, n_rows, block_size):
+        end = min(start + block_size, n_rows)
+        block = features[start:end] @ right
+        block = block.toarray() if sp.issparse(block) else np.asarray(block)
+        if centered:
+            block -= n_features * np.outer(means[start:end], means)
+        norm_products = np.outer(norms[start:end], norms)
+        yield start, np.divide(block, norm_products, out=np.zeros_like(block), where=norm_products > 0)
+
+def save_item_similarity(features, ids, data_path, name=None, topn_name=None, centered=False, top_n=DEFAULT_TOP_N,
+                         precision=None):
+    # Same single pass as save_user_similarity: the full (items x items) matrix is written block by block (when name
+    # is given) and/or only the top_n neighbors of every item are kept (when topn_name is given)
+    n_rows = features.shape[0]
+    top_n = min(top_n, n_rows - 1)
+    indices = np.empty((n_rows, top_n), dtype=np.int32)
+    scores = np.empty((n_rows, top_n), dtype=np.float32)
+
+    def blocks():
+        for start, block in similarity_blocks(features, centered):
+            if topn_name:
+                indices[start:start + len(block)], scores[start:start + len(block)] = top_n_block(block, start, top_n)
+            yield start, block
+
+    if name:
+        save_matrix_blocks(blocks(), (n_rows, n_rows), ids, ids, data_path, name, dtype=np.float64, precision=precision)
+    else:
+        for _ in blocks():
+            pass
+    if topn_name:
+        save_neighbor_index(indices, scores, ids, data_path, topn_name)
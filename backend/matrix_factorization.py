@@ -0,0 +1,95 @@
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from backend.matrix_store import get_store, save_arrays
+except ImportError:
+    from matrix_store import get_store, save_arrays
+
+# Rows solved together: their (rank x rank) normal equations are stacked into one batched LAPACK call
+ALS_BLOCK_SIZE = 1024
+
+# Parameters of the factors built by preprocessing (MatrixFactorizationRecommender's defaults)
+DEFAULT_ALS_PARAMS = {"rank": 32, "reg": 0.1, "implicit": False, "alpha": 40.0, "n_iter": 15, "random_seed": 42}
+
+def _solve_side(ratings, fixed, reg, implicit, alpha, n_jobs):
+    # One ALS half-step: new factors for every row of `ratings` with the other side's factors fixed.
+    # Every row's normal equations are gathered with two sparse products instead of a Python loop:
+    # the Gram matrices via (rows x items) @ (items x rank*rank) outer products of the fixed factors.
+    rank = fixed.shape[1]
+    outer = np.einsum('ij,ik->ijk', fixed, fixed).reshape(len(fixed), rank * rank)
+    identity = np.eye(rank)
+
+    if implicit:
+        # Hu, Koren & Volinsky: confidence 1 + alpha * r, preference 1 for every rated item
+        confidence = ratings.copy()
+        confidence.data = alpha * confidence.data
+        gram_base = fixed.T @ fixed
+        targets = confidence.copy()
+        targets.data = targets.data + 1
+    else:
+        confidence = ratings.copy()
+        confidence.data = np.ones_like(confidence.data)
+        gram_base = np.zeros((rank, rank))
+        targets = ratings
+    counts = np.diff(ratings.indptr)
+
+    def solve_block(start):
+        end = min(start + ALS_BLOCK_SIZE, ratings.shape[0])
+        gram = (confidence[start:end] @ outer).reshape(-1, rank, rank) + gram_base
+        # Weighted regularization: lambda scaled by the number of ratings of each row (explicit),
+        # plain lambda for implicit feedback
+        reg_scale = reg * (np.maximum(counts[start:end], 1) if not implicit else np.ones(end - start))
+        gram += reg_scale[:, None, None] * identity
+        rhs = np.asarray(targets[start:end] @ fixed)
+        return np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+
+    starts = range(0, ratings.shape[0], ALS_BLOCK_SIZE)
+    # np.linalg.solve and the BLAS products release the GIL, so blocks are solved on several threads
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return np.vstack(list(executor.map(solve_block, starts)))
+
+def train_als(ratings, rank=32, reg=0.1, implicit=False, alpha=40.0, n_iter=15, random_seed=42, n_jobs=None):
+    # Alternating least squares on a CSR (users x items) rating matrix; returns float32 user and item factors
+    ratings = sp.csr_matrix(ratings, dtype=np.float64)
+    ratings_t = ratings.T.tocsr()
+    rng = np.random.default_rng(random_seed)
+    user_factors = rng.normal(scale=0.1, size=(ratings.shape[0], rank))
+    item_factors = rng.normal(scale=0.1, size=(ratings.shape[1], rank))
+
+    for _ in range(n_iter):
+        user_factors = _solve_side(ratings, item_factors, reg, implicit, alpha, n_jobs)
+        item_factors = _solve_side(ratings_t, user_factors, reg, implicit, alpha, n_jobs)
+
+    return user_factors.astype(np.float32), item_factors.astype(np.float32)
+
+def factors_name(rank, reg, implicit, alpha, n_iter, random_seed, eval_mode=False):
+    kind = 'implicit' if implicit else 'explicit'
+    alpha_part = f'_a{alpha}' if implicit else ''
+    name = f'mf_{kind}_r{rank}_l{reg}{alpha_part}_i{n_iter}_s{random_seed}'
+    return 'eval_' + name if eval_mode else name
+
+def ratings_fingerprint(ratings):
+    digest = hashlib.sha1()
+    for array in (ratings.indptr, ratings.indices, ratings.data):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+def load_or_train_factors(ratings, data_path, name, n_jobs=None, **als_params):
+    # Factors are reused as long as they were trained with the same parameters on the same ratings
+    store = get_store(data_path)
+    fingerprint = ratings_fingerprint(ratings)
+    if store.has_arrays(name):
+        arrays, meta = store.load_arrays(name)
+        if meta.get("fingerprint") == fingerprint and meta.get("als_params") == als_params:
+            return arrays["user_factors"], arrays["item_factors"]
+
+    return train_and_save_factors(ratings, data_path, name, n_jobs=n_jobs, **als_params)
+
+def train_and_save_factors(ratings, data_path, name, n_jobs=None, **als_params):
+    user_factors, item_factors = train_als(ratings, n_jobs=n_jobs, **als_params)
+    save_arrays({"user_factors": user_factors, "item_factors": item_factors}, data_path, name,
+                meta={"fingerprint": ratings_fingerprint(ratings), "als_params": als_params})
+    return user_factors, item_factors
@@ -0,0 +1,394 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from pathlib import Path
+
+STORE_DIRNAME = 'matrix_store'
+
+# Layout version recorded in the meta file of every dense matrix (version 1 files have no precision field)
+FORMAT_VERSION = 2
+
+# Storage precisions of dense matrices. float16 and int8 matrices stay memory-mapped in their storage precision
+# (see CompactMatrix); int8 keeps one float32 scale per row and is meant for similarity matrices, not ratings.
+MATRIX_PRECISIONS = ('float64', 'float32', 'float16', 'int8')
+
+# int8 code of missing values (NaN); other values are stored as -127..127 times their row's scale
+INT8_NAN = -128
+
+# float32 values widened at once by a CompactMatrix product
+ROW_BLOCK_ELEMENTS = 1 << 22
+
+def _write_atomic(path, save_fn):
+    # Write next to the target and rename, so processes that already mmap the old file keep a valid mapping
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        save_fn(f)
+    os.replace(tmp_path, path)
+
+def quantize_int8(values):
+    # Symmetric per-row quantization: each row's scale is its largest absolute value / 127
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    values = np.where(missing, 0, values)
+    magnitude = np.abs(values).max(axis=1) if values.shape[1] else np.zeros(len(values))
+    scales = np.where(magnitude > 0, magnitude / 127, 1).astype(np.float32)
+    codes = np.rint(values / scales[:, None]).astype(np.int8)
+    codes[missing] = INT8_NAN
+    return codes, scales
+
+class CompactMatrix:
+    # Read/write view of a float16 or int8 matrix that stays in its storage precision (memory-mapped). Indexing
+    # returns float32 copies of the selected rows only, and other @ matrix widens one row block at a time, so the
+    # full float32 matrix is never built. Indexing takes rows, or (rows, columns) with the columns selected after
+    # the rows are widened.
+    # Defers ndarray operators (ndarray @ matrix calls __rmatmul__ instead of building an object array)
+    __array_ufunc__ = None
+    ndim = 2
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, codes, scales=None):
+        # codes: float16 values, or int8 codes with their per-row scales (see quantize_int8)
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _widen(self, rows):
+        values = self.codes[rows].astype(np.float32)
+        if self.scales is not None:
+            missing = values == INT8_NAN
+            values *= np.asarray(self.scales[rows], dtype=np.float32)[..., None]
+            values[missing] = np.nan
+        return values
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        return self._widen(rows)[..., columns]
+
+    def __rmatmul__(self, other):
+        if sp.issparse(other):
+            other = other.tocsc()
+        result = np.zeros(other.shape[:-1] + (self.shape[1],), dtype=np.result_type(other.dtype, np.float32))
+        block_size = max(1, ROW_BLOCK_ELEMENTS // max(self.shape[1], 1))
+        for start in range(0, self.shape[0], block_size):
+            end = min(start + block_size, self.shape[0])
+            part = other[start:end] if other.ndim == 1 else other[:, start:end]
+            result += np.asarray(part @ self._widen(slice(start, end)))
+        return result
+
+    def __setitem__(self, key, values):
+        # In-place update of a row (matrix[i] / matrix[i, :]) or a column (matrix[:, j]); needs writable codes,
+        # see MatrixStore.enable_updates
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        if self.scales is None:
+            self.codes[rows, columns] = values
+            return
+        if np.isscalar(rows):
+            row = self[rows]
+            row[columns] = values
+            codes, scales = quantize_int8(row[None, :])
+            self.codes[rows], self.scales[rows] = codes[0], scales[0]
+            return
+
+        # Column: every value is coded with its row's scale, except in rows whose scale is too small for it or that
+        # were all zeros (scale 1, see quantize_int8), which are requantized whole
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64), (self.shape[0],))
+        codes = np.rint(values / self.scales)
+        overflow = (np.abs(codes) > 127) | ((self.scales == 1) & (values != 0))
+        codes = np.where(np.isnan(values), INT8_NAN, np.clip(np.nan_to_num(codes), -127, 127)).astype(np.int8)
+        self.codes[:, columns] = codes
+        for row in np.flatnonzero(overflow):
+            self[int(row), columns] = values[row]
+
+def dense_frame(frame):
+    # DataFrame of a loaded matrix, widening CompactFrames (a full float32 copy)
+    return frame.to_frame() if isinstance(frame, CompactFrame) else frame
+
+class CompactFrame:
+    # What MatrixStore.load_frame returns for float16/int8 matrices: values is a CompactMatrix, index and columns
+    # are the labels of a DataFrame
+    def __init__(self, values, index, columns):
+        self.values = values
+        self.index = index
+        self.columns = columns
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def to_frame(self):
+        return pd.DataFrame(self.values[:], index=self.index, columns=self.columns, copy=False)
+
+def _label_index(values, name):
+    # Row/column labels shared by every thread using the store. The hash table behind get_indexer/get_loc is built
+    # lazily and not thread-safe, so it is built here, before the index is handed out.
+    index = pd.Index(values, name=name)
+    index.is_unique
+    return index
+
+def save_matrix(df, data_path, name, precision=None):
+    # precision: one of MATRIX_PRECISIONS, or None to keep the DataFrame's dtype
+    if precision is not None and precision not in MATRIX_PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {MATRIX_PRECISIONS}.")
+    store_path = Path(data_path) / STORE_DIRNAME
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    values = np.ascontiguousarray(df.values)
+    if precision == 'int8':
+        values, scales = quantize_int8(values)
+        _write_atomic(store_path / f'{name}.scales.npy', lambda f: np.save(f, scales))
+    elif precision is not None:
+        values = values.astype(precision)
+
+    # Raw values plus ID index files, so the matrix can be opened with np.load(mmap_mode='r')
+    _write_atomic(store_path / f'{name}.npy', lambda f: np.save(f, values))
+    _save_matrix_labels(store_path, name, df.index, df.columns, precision or str(values.dtype))
+
+def save_matrix_blocks(blocks, shape, index, columns, data_path, name, dtype=np.float32, precision=None, meta=None):
+    # Dense matrix written one row block at a time straight into its memory-mapped .npy file, so it never has to
+    # fit in memory. blocks yields (start_row, block); precision as in save_matrix, dtype when None.
+    # meta: extra entries for the meta file (e.g. the parameters the matrix was computed with).
+    if precision is not None and precision not in MATRIX_PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {MATRIX_PRECISIONS}.")
+    store_path = Path(data_path) / STORE_DIRNAME
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    path = store_path / f'{name}.npy'
+    tmp_path = path.with_name(path.name + '.tmp')
+    values = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int8 if precision == 'int8' else (precision or dtype), shape=shape)
+    scales = np.ones(shape[0], dtype=np.float32)
+    for start, block in blocks:
+        end = start + len(block)
+        if precision == 'int8':
+            values[start:end], scales[start:end] = quantize_int8(block)
+        else:
+            values[start:end] = block
+    values.flush()
+    stored_dtype = str(values.dtype)
+    del values
+    os.replace(tmp_path, path)
+
+    if precision == 'int8':
+        _write_atomic(store_path / f'{name}.scales.npy', lambda f: np.save(f, scales))
+    _save_matrix_labels(store_path, name, index, columns, precision or stored_dtype, meta)
+
+def remove_matrix(data_path, name):
+    # Deletes a dense matrix and its label files, e.g. an artifact a later preprocessing configuration no longer
+    # writes; processes that mmap it keep a valid mapping until they release it
+    store_path = Path(data_path) / STORE_DIRNAME
+    for suffix in ('npy', 'scales.npy', 'index.npy', 'columns.npy', 'meta.json'):
+        (store_path / f'{name}.{suffix}').unlink(missing_ok=True)
+    (Path(data_path) / f'{name}.pkl').unlink(missing_ok=True)
+
+def _save_matrix_labels(store_path, name, index, columns, precision, extra_meta=None):
+    _write_atomic(store_path / f'{name}.index.npy', lambda f: np.save(f, np.asarray(index)))
+    _write_atomic(store_path / f'{name}.columns.npy', lambda f: np.save(f, np.asarray(columns)))
+
+    meta = dict(
+        extra_meta or {},
+        index_name=index.name,
+        columns_name=columns.name,
+        format_version=FORMAT_VERSION,
+        precision=precision
+    )
+    _write_atomic(store_path / f'{name}.meta.json', lambda f: f.write(json.dumps(meta).encode()))
+
+def save_sparse_matrix(matrix, index, columns, data_path, name):
+    store_path = Path(data_path) / STORE_DIRNAME
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    # CSR components are stored as separate arrays so each one can be memory-mapped
+    csr = sp.csr_matrix(matrix)
+    csr.sort_indices()
+    _write_atomic(store_path / f'{name}.data.npy', lambda f: np.save(f, csr.data))
+    _write_atomic(store_path / f'{name}.indices.npy', lambda f: np.save(f, csr.indices))
+    _write_atomic(store_path / f'{name}.indptr.npy', lambda f: np.save(f, csr.indptr))
+    _write_atomic(store_path / f'{name}.index.npy', lambda f: np.save(f, np.asarray(index)))
+    _write_atomic(store_path / f'{name}.columns.npy', lambda f: np.save(f, np.asarray(columns)))
+
+    meta = {"index_name": index.name, "columns_name": columns.name, "format": "csr", "shape": list(csr.shape)}
+    _write_atomic(store_path / f'{name}.meta.json', lambda f: f.write(json.dumps(meta).encode()))
+
+def save_neighbor_index(indices, scores, ids, data_path, name):
+    store_path = Path(data_path) / STORE_DIRNAME
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    # Top-N neighbor lists: positions into ids and their similarity scores
+    _write_atomic(store_path / f'{name}.neighbors.npy', lambda f: np.save(f, indices.astype(np.int32)))
+    _write_atomic(store_path / f'{name}.scores.npy', lambda f: np.save(f, scores.astype(np.float32)))
+    _write_atomic(store_path / f'{name}.index.npy', lambda f: np.save(f, np.asarray(ids)))
+
+    meta = {"index_name": ids.name, "format": "neighbors", "top_n": int(indices.shape[1])}
+    _write_atomic(store_path / f'{name}.meta.json', lambda f: f.write(json.dumps(meta).encode()))
+
+def save_arrays(arrays, data_path, name, meta=None):
+    # Generic named group of arrays (e.g. an ANN index), stored as '<name>.<key>.npy' plus '<name>.meta.json'
+    store_path = Path(data_path) / STORE_DIRNAME
+    store_path.mkdir(parents=True, exist_ok=True)
+    for key, array in arrays.items():
+        _write_atomic(store_path / f'{name}.{key}.npy', lambda f, array=array: np.save(f, np.asarray(array)))
+    meta = dict(meta or {}, arrays=sorted(arrays))
+    _write_atomic(store_path / f'{name}.meta.json', lambda f: f.write(json.dumps(meta).encode()))
+
+class MatrixStore:
+    def __init__(self, data_path, mmap_mode='r'):
+        self.data_path = Path(data_path)
+        self.store_path = self.data_path / STORE_DIRNAME
+        self.mmap_mode = mmap_mode
+        self._frames = {}
+        self._sparse = {}
+        self._neighbors = {}
+        self._arrays = {}
+        self._pickles = {}
+        self._lock = threading.Lock()
+        # Bumped on every in-process update, so caches built on top of the matrices can be invalidated
+        self.data_version = 0
+
+    def enable_updates(self):
+        # Copy-on-write mappings: in-process updates (see ingestion.py) are visible through every view handed out,
+        # while the files on disk stay untouched until the next preprocessing run
+        with self._lock:
+            if self.mmap_mode != 'c' and (self._frames or self._sparse or self._neighbors):
+                raise RuntimeError("enable_updates() must be called before any matrix is loaded.")
+            self.mmap_mode = 'c'
+
+    def mark_updated(self):
+        with self._lock:
+            self.data_version += 1
+
+    def cached_sparse(self, name):
+        # Already loaded CSR entry or None, without triggering a load
+        with self._lock:
+            return self._sparse.get(name)
+
+    def matrix_meta(self, name):
+        return self._read_meta(name)
+
+    def has_matrix(self, name):
+        return (self.store_path / f'{name}.npy').exists()
+
+    def has_frame(self, name):
+        # Whether load_frame can open the matrix, from the store or from a legacy pickle
+        return self.has_matrix(name) or (self.data_path / f'{name}.pkl').exists()
+
+    def load_frame(self, name):
+        # Every caller gets the same DataFrame (CompactFrame for float16/int8 matrices) wrapping the same mapped buffer
+        with self._lock:
+            if name not in self._frames:
+                self._frames[name] = self._open_frame(name)
+            return self._frames[name]
+
+    def load_pickle(self, filename):
+        # Pickled tables of the data directory (popularity, users, movies), read once and shared like the matrices
+        with self._lock:
+            if filename not in self._pickles:
+                self._pickles[filename] = pd.read_pickle(self.data_path / filename)
+            return self._pickles[filename]
+
+    def has_sparse(self, name):
+        return (self.store_path / f'{name}.indptr.npy').exists()
+
+    def load_sparse(self, name):
+        # Returns (csr_matrix, row index, column index); the CSR arrays are shared like dense frames
+        with self._lock:
+            if name not in self._sparse:
+                self._sparse[name] = self._open_sparse(name)
+            return self._sparse[name]
+
+    def load_sparse_or_dense(self, name, dense_name):
+        # CSR view of a matrix, converted from its dense artifact when no CSR version was written
+        if self.has_sparse(name):
+            return self.load_sparse(name)
+        df = self.load_frame(dense_name)
+        csr = sp.csr_matrix(np.nan_to_num(df.values))
+        csr.sort_indices()
+        return csr, df.index, df.columns
+
+    def _open_sparse(self, name):
+        meta = self._read_meta(name)
+        data = np.load(self.store_path / f'{name}.data.npy', mmap_mode=self.mmap_mode)
+        indices = np.load(self.store_path / f'{name}.indices.npy', mmap_mode=self.mmap_mode)
+        indptr = np.load(self.store_path / f'{name}.indptr.npy', mmap_mode=self.mmap_mode)
+        index = _label_index(np.load(self.store_path / f'{name}.index.npy'), meta.get("index_name"))
+        columns = _label_index(np.load(self.store_path / f'{name}.columns.npy'), meta.get("columns_name"))
+
+        csr = sp.csr_matrix((data, indices, indptr), shape=tuple(meta["shape"]), copy=False)
+        return csr, index, columns
+
+    def has_neighbors(self, name):
+        return (self.store_path / f'{name}.neighbors.npy').exists()
+
+    def load_neighbors(self, name):
+        # Returns (neighbor positions, neighbor scores, ids the positions refer to)
+        with self._lock:
+            if name not in self._neighbors:
+                meta = self._read_meta(name)
+                indices = np.load(self.store_path / f'{name}.neighbors.npy', mmap_mode=self.mmap_mode)
+                scores = np.load(self.store_path / f'{name}.scores.npy', mmap_mode=self.mmap_mode)
+                ids = _label_index(np.load(self.store_path / f'{name}.index.npy'), meta.get("index_name"))
+                self._neighbors[name] = (indices, scores, ids)
+            return self._neighbors[name]
+
+    def has_arrays(self, name):
+        return 'arrays' in self._read_meta(name)
+
+    def load_arrays(self, name):
+        # Returns (dict of memory-mapped arrays, meta) for a group written by save_arrays
+        with self._lock:
+            if name not in self._arrays:
+                meta = self._read_meta(name)
+                arrays = {
+                    key: np.load(self.store_path / f'{name}.{key}.npy', mmap_mode=self.mmap_mode)
+                    for key in meta["arrays"]
+                }
+                self._arrays[name] = (arrays, meta)
+            return self._arrays[name]
+
+    def _read_meta(self, name):
+        meta_file = self.store_path / f'{name}.meta.json'
+        return json.loads(meta_file.read_text()) if meta_file.exists() else {}
+
+    def _open_frame(self, name):
+        if not self.has_matrix(name):
+            # Legacy layout: artifacts written as DataFrame pickles
+            return pd.read_pickle(self.data_path / f'{name}.pkl')
+
+        values = np.load(self.store_path / f'{name}.npy', mmap_mode=self.mmap_mode)
+        index = np.load(self.store_path / f'{name}.index.npy')
+        columns = np.load(self.store_path / f'{name}.columns.npy')
+
+        meta = self._read_meta(name)
+        index = _label_index(index, meta.get("index_name"))
+        columns = _label_index(columns, meta.get("columns_name"))
+        # Compact precisions stay memory-mapped as well and are widened row by row where they are used
+        if meta.get("precision") == 'int8':
+            return CompactFrame(CompactMatrix(values, np.load(self.store_path / f'{name}.scales.npy')), index, columns)
+        if values.dtype == np.float16:
+            return CompactFrame(CompactMatrix(values), index, columns)
+
+        return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(data_path):
+    # One store per data directory per process
+    key = str(Path(data_path).resolve())
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = MatrixStore(data_path)
+        return _stores[key]
+
+def release_store(data_path):
+    # Forgets the store of a data directory (e.g. a replaced snapshot); its mappings are closed once the last
+    # recommender holding them is gone
+    with _stores_lock:
+        _stores.pop(str(Path(data_path).resolve()), None)
@@ -0,0 +1,46 @@
+import numpy as np
+import scipy.sparse as sp
+
+DEFAULT_TOP_N = 100
+
+def build_top_n(sim_values, n=DEFAULT_TOP_N, exclude_self=True, block_size=1024):
+    # Pruned neighbor lists of a square similarity matrix: (n_rows, n) int32 positions and float32 scores,
+    # sorted by descending similarity
+    n_rows = sim_values.shape[0]
+    n = min(n, n_rows - 1 if exclude_self else n_rows)
+
+    indices = np.empty((n_rows, n), dtype=np.int32)
+    scores = np.empty((n_rows, n), dtype=np.float32)
+
+    # Row blocks keep the float32 working copy small even for large matrices
+    for start in range(0, n_rows, block_size):
+        end = min(start + block_size, n_rows)
+        indices[start:end], scores[start:end] = top_n_block(sim_values[start:end], start, n, exclude_self)
+    return indices, scores
+
+def top_n_block(block, start, n, exclude_self=True):
+    # Neighbor lists of the rows start..start+len(block) of a square similarity matrix, as in build_top_n.
+    # Works on a float32 copy: the block itself is left untouched.
+    block = np.array(block, dtype=np.float32)
+    block[np.isnan(block)] = -np.inf
+    if exclude_self:
+        block[np.arange(len(block)), np.arange(start, start + len(block))] = -np.inf
+
+    top = np.argpartition(-block, n - 1, axis=1)[:, :n]
+    top_scores = np.take_along_axis(block, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    indices = np.take_along_axis(top, order, axis=1)
+    scores = np.take_along_axis(top_scores, order, axis=1)
+
+    # Missing similarities (NaN) are kept as neighbors with zero weight
+    scores[np.isinf(scores)] = 0
+    return indices, scores
+
+def neighbor_matrix(neighbor_indices, neighbor_scores, n_columns):
+    # Neighbor lists as a pruned CSR similarity matrix, for scoring many users with one product
+    n_rows, n = neighbor_indices.shape
+    indptr = np.arange(0, n_rows * n + 1, n)
+    return sp.csr_matrix(
+        (np.asarray(neighbor_scores).ravel(), np.asarray(neighbor_indices).ravel(), indptr),
+        shape=(n_rows, n_columns)
+    )
@@ -0,0 +1,176 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+try:
+    from backend.matrix_store import save_arrays
+    from backend.neighbor_index import top_n_block
+except ImportError:
+    from matrix_store import save_arrays
+    from neighbor_index import top_n_block
+
+# Demographic columns of users.pkl that define the popularity segments
+SEGMENT_COLUMNS = ('Gender', 'Age', 'Occupation')
+
+# users.dat gender letters, as encoded in users.pkl
+GENDER_CODES = {'F': 0, 'M': 1}
+
+# A rating's weight in the time-decayed popularity halves every POPULARITY_HALF_LIFE_DAYS before the latest rating
+POPULARITY_HALF_LIFE_DAYS = 90
+
+# Length of the stored ranking of every demographic segment; the global and recent rankings cover every item
+SEGMENT_TOP_N = 100
+
+# Segments ranked per matrix product
+SEGMENT_BLOCK = 64
+
+def _segment_shares(ratings, users, item_positions, n_items):
+    # Per segment column: the column's values and a (n_values, n_items) array with each item's share of the ratings
+    # given by the users with that value
+    user_attributes = users.drop_duplicates('UserID').set_index('UserID')
+    shares = {}
+    for column in SEGMENT_COLUMNS:
+        values = np.sort(users[column].dropna().unique())
+        codes = pd.Index(values).get_indexer(ratings['UserID'].map(user_attributes[column]))
+        known = (codes >= 0) & (item_positions >= 0)
+        counts = np.bincount(codes[known] * n_items + item_positions[known], minlength=len(values) * n_items)
+        counts = counts.reshape(len(values), n_items).astype(np.float64)
+        totals = counts.sum(axis=1, keepdims=True)
+        shares[column] = (values, np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0))
+    return shares
+
+def segment_combinations(segment_values):
+    # Attribute codes of every segment, in row order: code 0 leaves the attribute unspecified, code i + 1 is the
+    # i-th value. Row of a code tuple = sum(code * stride) with mixed-radix strides, the last column varying fastest.
+    return list(itertools.product(*(range(len(values) + 1) for values in segment_values)))
+
+def save_popularity_rankings(popularity, ratings, users, data_path, name, half_life_days=POPULARITY_HALF_LIFE_DAYS,
+                             top_n=SEGMENT_TOP_N):
+    # Ranked MovieID arrays for O(1) cold-start serving, computed once per preprocessing run:
+    # - global: by rating count, in the same order as sorting popularity.pkl by NumRatings
+    # - recent: by time-decayed rating count (exponential decay with half_life_days)
+    # - segments: top_n of every Gender/Age/Occupation combination, any attribute possibly unspecified; an item's
+    #   segment score is its mean share of the ratings of each specified attribute value
+    # plus the aligned counts, decayed counts and per-value shares the recommenders score known users with.
+    # popularity: MovieID/NumRatings table; ratings: UserID/MovieID/Timestamp rows behind it; users: users.pkl
+    movie_ids = popularity['MovieID'].to_numpy()
+    counts = popularity['NumRatings'].to_numpy(dtype=np.float64)
+    n_items = len(movie_ids)
+    item_positions = pd.Index(movie_ids).get_indexer(ratings['MovieID'])
+    rated = item_positions >= 0
+
+    timestamps = ratings['Timestamp'].to_numpy(dtype=np.float64)
+    age_days = (timestamps.max() - timestamps) / 86400 if len(timestamps) else timestamps
+    weights = 0.5 ** (age_days / half_life_days)
+    decayed = np.bincount(item_positions[rated], weights=weights[rated], minlength=n_items)
+
+    global_ranking = popularity.sort_values(by='NumRatings', ascending=False)['MovieID'].to_numpy()
+    recent_ranking = movie_ids[np.argsort(-decayed, kind='stable')]
+
+    shares = _segment_shares(ratings, users, item_positions, n_items)
+    segment_values = [shares[column][0] for column in SEGMENT_COLUMNS]
+    share_matrix = np.vstack([shares[column][1] for column in SEGMENT_COLUMNS])
+    offsets = np.cumsum([0] + [len(values) for values in segment_values[:-1]])
+
+    # Segments scored SEGMENT_BLOCK at a time: (segments x attribute values) averaging weights @ shares
+    top_n = min(top_n, n_items)
+    combinations = segment_combinations(segment_values)
+    segments = np.empty((len(combinations), top_n), dtype=movie_ids.dtype)
+    for start in range(0, len(combinations), SEGMENT_BLOCK):
+        block = combinations[start:start + SEGMENT_BLOCK]
+        averaging = np.zeros((len(block), len(share_matrix)))
+        for row, codes in enumerate(block):
+            specified = [offset + code - 1 for offset, code in zip(offsets, codes) if code > 0]
+            averaging[row, specified] = 1 / max(len(specified), 1)
+        positions, _ = top_n_block(averaging @ share_matrix, 0, top_n, exclude_self=False)
+        segments[start:start + len(block)] = movie_ids[positions]
+    # Nothing specified: the global ranking
+    segments[0] = global_ranking[:top_n]
+
+    meta = {
+        "segment_columns": list(SEGMENT_COLUMNS),
+        "segment_values": [values.tolist() for values in segment_values],
+        "half_life_days": half_life_days
+    }
+    save_arrays({
+        "movie_ids": movie_ids, "counts": counts, "decayed": decayed, "shares": share_matrix.astype(np.float32),
+        "global": global_ranking, "recent": recent_ranking, "segments": segments
+    }, data_path, name, meta=meta)
+
+def _check_top_k(top_k):
+    # A slice with top_k <= 0 would silently return an empty list or drop items from the end of the ranking
+    if top_k < 1:
+        raise ValueError("top_k must be at least 1.")
+
+class PopularityRankings:
+    # Serving side of save_popularity_rankings: every list is a slice of a ranked array, so its cost does not depend
+    # on the catalog size. Built from popularity.pkl alone (global ranking only) for data directories without them.
+    def __init__(self, movie_ids, counts, global_ranking, decayed=None, recent_ranking=None, shares=None, segments=None,
+                 segment_values=None):
+        self.movie_ids = movie_ids
+        self.counts = counts
+        self.decayed = decayed if decayed is not None else counts
+        self.rankings = {"global": global_ranking, "recent": recent_ranking if recent_ranking is not None else global_ranking}
+        self.shares = shares
+        self.segments = segments
+        # Per segment column: attribute value -> code (see segment_combinations) and the row stride of the code
+        segment_values = segment_values or [[] for _ in SEGMENT_COLUMNS]
+        self.segment_codes = [{value: code + 1 for code, value in enumerate(values)} for values in segment_values]
+        sizes = [len(values) + 1 for values in segment_values]
+        self.segment_strides = [int(np.prod(sizes[position + 1:])) for position in range(len(sizes))]
+        self.share_offsets = np.cumsum([0] + [len(values) for values in segment_values[:-1]])
+
+    @classmethod
+    def from_popularity(cls, popularity):
+        if popularity is None:
+            return cls(np.array([], dtype=np.int64), np.array([]), np.array([], dtype=np.int64))
+        global_ranking = popularity.sort_values(by='NumRatings', ascending=False)['MovieID'].to_numpy()
+        return cls(popularity['MovieID'].to_numpy(), popularity['NumRatings'].to_numpy(dtype=np.float64), global_ranking)
+
+    @classmethod
+    def load(cls, store, name):
+        arrays, meta = store.load_arrays(name)
+        return cls(
+            arrays["movie_ids"], arrays["counts"], arrays["global"], decayed=arrays["decayed"], recent_ranking=arrays["recent"],
+            shares=arrays["shares"], segments=arrays["segments"], segment_values=meta["segment_values"]
+        )
+
+    @property
+    def has_segments(self):
+        return self.segments is not None
+
+    def top(self, top_k, kind='global'):
+        # kind: 'global' (rating count) or 'recent' (time-decayed rating count)
+        _check_top_k(top_k)
+        return self.rankings[kind][:top_k]
+
+    def segment_attributes(self, demographics):
+        # demographics: {column: value} for any of SEGMENT_COLUMNS; None and unknown values leave a column unspecified
+        demographics = demographics or {}
+        return [codes.get(demographics.get(column), 0) for column, codes in zip(SEGMENT_COLUMNS, self.segment_codes)]
+
+    def for_segment(self, top_k, demographics=None):
+        # Most popular items among users like a new user, from whatever demographics they supplied.
+        # Falls back to the global ranking without segments, demographics, or for lists longer than SEGMENT_TOP_N.
+        _check_top_k(top_k)
+        if not self.has_segments or top_k > self.segments.shape[1]:
+            return self.top(top_k)
+        row = sum(code * stride for code, stride in zip(self.segment_attributes(demographics), self.segment_strides))
+        return self.segments[row, :top_k]
+
+    def aligned(self, values, item_index):
+        # values aligned to movie_ids (along the last axis) reordered to item_index, 0 for items without ratings
+        values = np.asarray(values, dtype=np.float64)
+        positions = pd.Index(self.movie_ids).get_indexer(item_index)
+        aligned = np.zeros(values.shape[:-1] + (len(item_index),))
+        aligned[..., positions >= 0] = values[..., positions[positions >= 0]]
+        return aligned
+
+    def segment_averaging(self, attributes):
+        # (n_users, n_attribute_values) weights that average the shares of each user's specified attribute values,
+        # for users given as (n_users, len(SEGMENT_COLUMNS)) attribute codes; rows of users without any are 0
+        attributes = np.asarray(attributes, dtype=np.int64).reshape(-1, len(SEGMENT_COLUMNS))
+        averaging = np.zeros((len(attributes), len(self.shares)))
+        rows, columns = np.nonzero(attributes > 0)
+        averaging[rows, self.share_offsets[columns] + attributes[rows, columns] - 1] = 1
+        return averaging / np.maximum(averaging.sum(axis=1, keepdims=True), 1)
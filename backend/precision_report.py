@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from matrix_store import MatrixStore, CompactMatrix, get_store, save_matrix, dense_frame, STORE_DIRNAME, MATRIX_PRECISIONS
+
+DATA_PATH = '../data/processed'
+
+# Dense similarity and correlation matrices written with the selected precision (production and evaluation)
+SIMILARITY_MATRICES = [
+    'item_similarity_matrix_df', 'adjusted_item_similarity_matrix_df', 'user_correlation_matrix',
+    'content_similarity_matrix_one_hot', 'content_similarity_matrix_tfidf', 'content_one_hot_aligned', 'content_tfidf_aligned',
+    'eval_item_similarity_matrix', 'eval_adjusted_item_similarity_matrix', 'eval_user_correlation_matrix'
+]
+
+METRICS = ["Precision", "Recall", "F1-Score", "User Coverage", "NDCG", "MAP", "MRR", "Catalog Coverage"]
+
+def _link(source, target):
+    # Symlinks where the platform allows them, copies otherwise
+    try:
+        os.symlink(source.resolve(), target)
+    except OSError:
+        shutil.copy2(source, target)
+
+def build_variant(source_path, target_path, precision):
+    # Every processed artifact linked from source_path, with the similarity matrices rewritten at `precision`.
+    # save_matrix replaces the links atomically, so the source files are never modified.
+    source_path, target_path = Path(source_path), Path(target_path)
+    for source in source_path.rglob('*'):
+        if source.is_file():
+            target = target_path / source.relative_to(source_path)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            _link(source, target)
+
+    source_store = MatrixStore(source_path)
+    for name in SIMILARITY_MATRICES:
+        if source_store.has_matrix(name):
+            save_matrix(dense_frame(source_store.load_frame(name)), target_path, name, precision=precision)
+
+def similarity_size_mb(data_path):
+    store_path = Path(data_path) / STORE_DIRNAME
+    size = 0
+    for name in SIMILARITY_MATRICES:
+        for suffix in ('npy', 'scales.npy'):
+            path = store_path / f'{name}.{suffix}'
+            if path.exists():
+                size += path.stat().st_size
+    return size / 2 ** 20
+
+def evaluate(data_path, config):
+    # Runs in a child process whose RECOMMENDER_DATA_PATH points at data_path (read when recommenders is imported)
+    from recommenders import MODEL_CLASSES
+    from evaluation_methods import run_evaluation_pipeline
+
+    store = get_store(data_path)
+    start = time.perf_counter()
+    for name in SIMILARITY_MATRICES:
+        if store.has_matrix(name):
+            # Touch every value: pages in the memory-mapped files, float16/int8 ones in their storage precision
+            values = store.load_frame(name).values
+            np.sum(values.codes if isinstance(values, CompactMatrix) else values)
+    load_seconds = time.perf_counter() - start
+
+    models = {model_name: MODEL_CLASSES[model_name](**params) for model_name, params in config["MODELS"].items()}
+    results_df = run_evaluation_pipeline(
+        user_item_matrix=store.load_sparse_or_dense('user_item_csr', 'user_item_matrix'),
+        models=models,
+        top_k=config["TOP_K"],
+        test_ratio=config["TEST_RATIO"],
+        random_seed=config["RANDOM_SEED"],
+        n_jobs=config.get("N_JOBS", 1),
+        data_path=data_path
+    )
+    return {"load_seconds": load_seconds, "results": results_df.to_dict(orient='records')}
+
+def precision_report(precisions, config_path, data_path=DATA_PATH):
+    # One evaluation per precision on a scratch copy of the processed data; deltas are relative to float64
+    precisions = ['float64'] + [precision for precision in precisions if precision != 'float64']
+    rows = []
+    for precision in precisions:
+        with tempfile.TemporaryDirectory() as variant_path:
+            build_variant(data_path, variant_path, precision)
+            env = dict(os.environ, RECOMMENDER_DATA_PATH=str(Path(variant_path).resolve()))
+            output = subprocess.run(
+                [sys.executable, __file__, '--evaluate', variant_path, '--config', config_path],
+                env=env, check=True, stdout=subprocess.PIPE, text=True
+            ).stdout
+            evaluation = json.loads(output.strip().splitlines()[-1])
+            size_mb = similarity_size_mb(variant_path)
+        for result in evaluation["results"]:
+            rows.append(dict(result, **{"Dtype": precision, "Size (MB)": size_mb, "Load (s)": evaluation["load_seconds"]}))
+        print(f"Precision Report: {precision} evaluated.", file=sys.stderr)
+
+    report = pd.DataFrame(rows)
+    baseline = report[report["Dtype"] == 'float64'].set_index("Model")[METRICS]
+    for metric in METRICS:
+        report[f"{metric} Change"] = report[metric] - report["Model"].map(baseline[metric])
+    columns = ["Dtype", "Model", "Size (MB)", "Load (s)"] + [
+        column for metric in METRICS for column in (metric, f"{metric} Change")
+    ]
+    return report[columns]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report how the storage precision of the similarity matrices changes evaluation metrics.")
+    parser.add_argument('--precisions', nargs='+', choices=MATRIX_PRECISIONS, default=['float32', 'float16', 'int8'])
+    parser.add_argument('--config', default='evaluation_config.json')
+    parser.add_argument('--output', default=None, help="Also write the report to this CSV file.")
+    parser.add_argument('--evaluate', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = json.load(f)
+
+    if args.evaluate:
+        # Worker process of precision_report: the last stdout line is the JSON result
+        evaluation = evaluate(args.evaluate, config)
+        print(json.dumps(evaluation))
+        sys.exit(0)
+
+    report = precision_report(args.precisions, args.config)
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(report)
+    if args.output:
+        report.to_csv(args.output, index=False)
@@ -0,0 +1,158 @@
+import argparse
+import hashlib
+import inspect
+import json
+import threading
+import numpy as np
+
+try:
+    from backend.matrix_store import get_store, save_arrays
+    from backend.preprocessing_pipeline import file_hash, MANIFEST_FILE
+    from backend.recommenders import MODEL_CLASSES, DATA_PATH
+    from backend.snapshots import publish_snapshot
+except ImportError:
+    from matrix_store import get_store, save_arrays
+    from preprocessing_pipeline import file_hash, MANIFEST_FILE
+    from recommenders import MODEL_CLASSES, DATA_PATH
+    from snapshots import publish_snapshot
+
+# Number of recommendations stored per user; requests for up to this many items are answered from the table
+PRECOMPUTE_TOP_N = 20
+
+# Configurations served by the FastAPI app and the Streamlit defaults, precomputed next to evaluation_config.json's
+DEFAULT_MODEL_CONFIGS = [(model_name, {}) for model_name in MODEL_CLASSES] + [("UserBasedCFRecommender", {"alpha": 0.0})]
+
+def normalized_params(model_name, params):
+    # Constructor parameters with defaults filled in. top_k is left out when it only sets the list length
+    # (TOP_K_IS_LENGTH), since the table then serves every top_k up to its width; recommenders that also score with it
+    # (e.g. the number of neighbors of UserBasedCF) get one table per top_k. data_path is left out since a table
+    # belongs to the data directory it is stored in.
+    model_class = MODEL_CLASSES[model_name]
+    excluded = ('self', 'data_path') + (('top_k',) if model_class.TOP_K_IS_LENGTH else ())
+    bound = inspect.signature(model_class.__init__).bind_partial(None, **params)
+    bound.apply_defaults()
+    return {key: value for key, value in bound.arguments.items() if key not in excluded}
+
+def precomputable(params):
+    # Configurations searching an ANN index (directly or through a hybrid's children) are always scored live: their
+    # lists depend on the index built with the snapshot and on its search parameters, not only on the scores
+    children = params.get("children") or []
+    return not (params.get("use_ann_index") or any(child.get("use_ann_index") for child in children))
+
+def table_name(model_name, params):
+    params_key = json.dumps(normalized_params(model_name, params), sort_keys=True)
+    return f'topn_{model_name}_{hashlib.sha1(params_key.encode()).hexdigest()[:12]}'
+
+def source_fingerprint(data_path):
+    # Tables are only valid for the artifacts recorded by the preprocessing run they were built from
+    return file_hash(f'{data_path}/{MANIFEST_FILE}')
+
+def precompute_table(model_name, params, data_path=DATA_PATH, top_n=PRECOMPUTE_TOP_N):
+    if not precomputable(params):
+        raise ValueError(f"{model_name} {params} searches an ANN index and is scored live, not precomputed.")
+    model = MODEL_CLASSES[model_name](**dict(params, data_path=data_path))
+    user_ids = np.asarray(model.user_index, dtype=np.int64)
+    recommendations = model.recommend_batch(user_ids, top_k=top_n).astype(np.int32)
+
+    # Offset index: row of user_id is user_offsets[user_id - min_user_id], -1 for users missing from the table
+    min_user_id = int(user_ids.min())
+    user_offsets = np.full(int(user_ids.max()) - min_user_id + 1, -1, dtype=np.int32)
+    user_offsets[user_ids - min_user_id] = np.arange(len(user_ids), dtype=np.int32)
+
+    meta = {
+        "model": model_name,
+        "params": normalized_params(model_name, params),
+        "top_n": recommendations.shape[1],
+        "min_user_id": min_user_id,
+        "source": source_fingerprint(data_path)
+    }
+    name = table_name(model_name, params)
+    save_arrays({"recommendations": recommendations, "user_offsets": user_offsets}, data_path, name, meta=meta)
+    return name
+
+class PrecomputedTable:
+    def __init__(self, recommendations, user_offsets, min_user_id):
+        self.recommendations = recommendations
+        self.user_offsets = user_offsets
+        self.min_user_id = min_user_id
+
+    def lookup(self, user_id, top_k):
+        # O(1): one offset read and one row slice; None when the user or top_k is not covered
+        offset = user_id - self.min_user_id
+        if top_k > self.recommendations.shape[1] or not 0 <= offset < len(self.user_offsets):
+            return None
+        row = self.user_offsets[offset]
+        if row < 0:
+            return None
+        return self.recommendations[row, :top_k].tolist()
+
+class PrecomputedRecommendations:
+    # Serving-side registry of the tables in the matrix store, loaded (memory-mapped) on first use.
+    # Once ingested ratings changed the matrices, tables that no longer match them fall back to live scoring (see
+    # invalidate_users) until the next precomputation.
+    def __init__(self, data_path=DATA_PATH):
+        self.data_path = data_path
+        self.store = get_store(data_path)
+        self.source = source_fingerprint(data_path)
+        self._tables = {}
+        self._stale_users = set()
+        self._shared_stale = False
+        self._lock = threading.Lock()
+
+    def table(self, model_name, params):
+        # Memoized per (model, params) so a lookup does not rebuild the table name
+        key = (model_name, json.dumps(params, sort_keys=True))
+        table = self._tables.get(key)
+        if table is None and key not in self._tables:
+            with self._lock:
+                if key not in self._tables:
+                    self._tables[key] = self._load_table(table_name(model_name, params))
+                table = self._tables[key]
+        return table
+
+    def _load_table(self, name):
+        if not self.store.has_arrays(name):
+            return None
+        arrays, meta = self.store.load_arrays(name)
+        if meta["source"] != self.source:
+            print(f"Precomputed table '{name}' was built from other artifacts, serving it live instead.")
+            return None
+        return PrecomputedTable(arrays["recommendations"], arrays["user_offsets"], meta["min_user_id"])
+
+    def lookup(self, model_name, params, user_id, top_k):
+        if user_id in self._stale_users or (self._shared_stale and not MODEL_CLASSES[model_name].USER_LOCAL_SCORES):
+            return None
+        if not precomputable(params):
+            return None
+        table = self.table(model_name, params)
+        return table.lookup(user_id, top_k) if table is not None else None
+
+    def invalidate_users(self, user_ids):
+        # The ratings of these users were changed in place. Their own rows are stale in every table, and so is every
+        # row of the recommenders whose scores also depend on the item or user similarities or on other users'
+        # ratings (USER_LOCAL_SCORES False): ingestion updates those for everyone.
+        user_ids = [int(user_id) for user_id in user_ids]
+        if user_ids:
+            self._stale_users.update(user_ids)
+            self._shared_stale = True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute top-N recommendation tables for every configured recommender.")
+    parser.add_argument('--config', default='evaluation_config.json')
+    parser.add_argument('--top-n', type=int, default=PRECOMPUTE_TOP_N)
+    parser.add_argument('--no-snapshot', action='store_true', help="Do not publish a new snapshot including the tables.")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = json.load(f)
+
+    model_configs = DEFAULT_MODEL_CONFIGS + list(config["MODELS"].items())
+    for model_name, params in model_configs:
+        if not precomputable(params):
+            print(f"Precomputed Recommendations: {model_name} ({params}) searches an ANN index, served live.")
+            continue
+        top_n = max(args.top_n, params.get("top_k", 0))
+        name = precompute_table(model_name, params, top_n=top_n)
+        print(f"Precomputed Recommendations: Table '{name}' ({model_name}, {params}) saved successfully.")
+    if not args.no_snapshot:
+        print(f"Precomputed Recommendations: Snapshot '{publish_snapshot(DATA_PATH)}' published successfully.")
@@ -0,0 +1,138 @@
+import hashlib
+import io
+import json
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+MANIFEST_FILE = 'pipeline_manifest.json'
+
+def read_dat(path, names, encoding=None):
+    # MovieLens '::'-separated file through the C parser: re-delimit the raw bytes instead of using engine='python'
+    with open(path, 'rb') as f:
+        data = f.read().replace(b'::', b'\t')
+    return pd.read_csv(io.BytesIO(data), sep='\t', names=names, encoding=encoding, quoting=3)
+
+def file_hash(path):
+    path = Path(path)
+    if not path.exists():
+        return 'missing'
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Stage:
+    # A named preprocessing step.
+    # run(*dependency_values) computes and saves the stage's artifacts and returns its value for downstream stages;
+    # load() rebuilds that value from the saved artifacts when the stage is skipped.
+    # params: settings that change the stage's artifacts without changing its inputs (e.g. storage precision).
+    def __init__(self, name, run, load=None, inputs=(), deps=(), outputs=(), version=1, params=None):
+        self.name = name
+        self.run = run
+        self.load = load
+        self.inputs = list(inputs)
+        self.deps = list(deps)
+        self.outputs = list(outputs)
+        self.version = version
+        self.params = params or {}
+
+class Pipeline:
+    def __init__(self, stages, data_path, max_workers=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.data_path = Path(data_path)
+        self.max_workers = max_workers
+        self._values = {}
+        self._value_locks = {name: threading.Lock() for name in self.stages}
+
+    def _read_manifest(self):
+        manifest_file = self.data_path / MANIFEST_FILE
+        return json.loads(manifest_file.read_text()) if manifest_file.exists() else {}
+
+    def _write_manifest(self, manifest):
+        (self.data_path / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+    def _stage_keys(self):
+        # A stage's key covers its version and params, the content of its input files and the keys of its
+        # dependencies, so a change anywhere upstream invalidates everything below it
+        keys = {}
+        for name in self._topological_order():
+            stage = self.stages[name]
+            digest = hashlib.sha256(f'{name}:{stage.version}'.encode())
+            if stage.params:
+                digest.update(json.dumps(stage.params, sort_keys=True).encode())
+            for input_path in stage.inputs:
+                digest.update(f'{input_path}:{file_hash(input_path)}'.encode())
+            for dep in stage.deps:
+                digest.update(keys[dep].encode())
+            keys[name] = digest.hexdigest()
+        return keys
+
+    def _topological_order(self):
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle at stage '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def _value(self, name):
+        # Value of a finished stage, loaded from disk on first use if the stage was skipped
+        with self._value_locks[name]:
+            if name not in self._values:
+                stage = self.stages[name]
+                self._values[name] = stage.load() if stage.load else None
+            return self._values[name]
+
+    def _run_stage(self, name):
+        stage = self.stages[name]
+        dep_values = [self._value(dep) for dep in stage.deps]
+        value = stage.run(*dep_values)
+        with self._value_locks[name]:
+            self._values[name] = value
+
+    def run(self, force=False):
+        manifest = self._read_manifest()
+        keys = self._stage_keys()
+
+        pending = set()
+        for name in self._topological_order():
+            stage = self.stages[name]
+            outputs_exist = all((self.data_path / output).exists() for output in stage.outputs)
+            if force or manifest.get(name) != keys[name] or not outputs_exist:
+                pending.add(name)
+            else:
+                print(f"Data Preprocessing: Stage '{name}' is up to date, skipped.")
+
+        # Independent stages run concurrently; NumPy, BLAS and scikit-learn release the GIL for the heavy work
+        finished = set(self.stages) - pending
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in sorted(pending):
+                    if all(dep in finished for dep in self.stages[name].deps):
+                        running[executor.submit(self._run_stage, name)] = name
+                        pending.discard(name)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    future.result()
+                    finished.add(name)
+                    manifest[name] = keys[name]
+                    self._write_manifest(manifest)
+
+        return keys
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Per-user metric columns, in report order.
+# Users without held-out ratings score 0 on every accuracy metric.
+PER_USER_METRICS = ["Precision", "Recall", "F1-Score", "Hit", "NDCG", "AP", "RR", "Novelty", "Popularity"]
+
+# Report names of the per-user means ("User Coverage" is the hit rate: share of users with at least one hit)
+SUMMARY_NAMES = {"Hit": "User Coverage", "AP": "MAP", "RR": "MRR"}
+
+# Bootstrap resamples drawn per matrix product
+BOOTSTRAP_CHUNK = 100
+
+def recommendation_positions(recommendations, item_ids, k):
+    # (n_users, k) positions into item_ids of the recommended MovieIDs, from a 2D array (recommend_batch) or a list
+    # of lists (recommend). Short lists are padded with -1, which also marks MovieIDs missing from item_ids.
+    positions = np.full((len(recommendations), k), -1, dtype=np.int64)
+    if isinstance(recommendations, np.ndarray) and recommendations.ndim == 2:
+        ids = recommendations[:, :k]
+        positions[:, :ids.shape[1]] = item_ids.get_indexer(ids.ravel()).reshape(ids.shape)
+    else:
+        for row, items in enumerate(recommendations):
+            items = list(items)[:k]
+            positions[row, :len(items)] = item_ids.get_indexer(items)
+    return positions
+
+def hit_matrix(positions, test_csr):
+    # hits[u, r]: the item at rank r of user u is one of u's held-out items.
+    # (user, item) pairs are encoded as user * n_items + item and looked up in the sorted test pairs.
+    test_csr = sp.csr_matrix(test_csr)
+    n_items = test_csr.shape[1]
+    rated = test_csr.data > 0
+    test_rows = np.repeat(np.arange(test_csr.shape[0], dtype=np.int64), np.diff(test_csr.indptr))
+    test_keys = np.sort(test_rows[rated] * n_items + test_csr.indices[rated])
+    if len(test_keys) == 0:
+        return np.zeros(positions.shape, dtype=bool)
+
+    keys = np.arange(len(positions), dtype=np.int64)[:, None] * n_items + positions
+    found = np.minimum(np.searchsorted(test_keys, keys), len(test_keys) - 1)
+    return (test_keys[found] == keys) & (positions >= 0)
+
+def per_user_metrics(positions, test_csr, item_counts, n_train_users, k):
+    # Every metric of every user at once, as a (n_users, len(PER_USER_METRICS)) DataFrame.
+    # item_counts: training ratings per item, for the popularity bias (mean count of the recommended items)
+    # and novelty (mean self-information -log2(count / n_train_users) of the recommended items).
+    hits = hit_matrix(positions, test_csr)
+    n_relevant = np.diff(sp.csr_matrix(test_csr).indptr)
+    n_hits = hits.sum(axis=1)
+    has_relevant = n_relevant > 0
+
+    precision = n_hits / k
+    recall = np.divide(n_hits, n_relevant, out=np.zeros(len(hits)), where=has_relevant)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(hits)), where=precision + recall > 0)
+
+    # Binary relevance: DCG over the hit ranks, normalized by the DCG of min(n_relevant, k) hits at the top
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    ideal_hits = np.minimum(n_relevant, k)
+    ideal_dcg = np.concatenate([[0], np.cumsum(discounts)])[ideal_hits]
+    ndcg = np.divide(hits @ discounts, ideal_dcg, out=np.zeros(len(hits)), where=ideal_dcg > 0)
+
+    # Average precision at k: precision at each hit rank, averaged over min(n_relevant, k)
+    precision_at_rank = np.cumsum(hits, axis=1) / np.arange(1, k + 1)
+    average_precision = np.divide((precision_at_rank * hits).sum(axis=1), ideal_hits,
+                                  out=np.zeros(len(hits)), where=ideal_hits > 0)
+    reciprocal_rank = np.where(hits.any(axis=1), 1 / (hits.argmax(axis=1) + 1), 0)
+
+    # Popularity of the recommended items; padding positions are left out of the means
+    recommended = positions >= 0
+    n_recommended = recommended.sum(axis=1)
+    counts = np.where(recommended, item_counts[np.maximum(positions, 0)], 0)
+    self_information = np.where(recommended, -np.log2(np.maximum(counts, 1) / n_train_users), 0)
+    popularity = np.divide(counts.sum(axis=1), n_recommended, out=np.zeros(len(hits)), where=n_recommended > 0)
+    novelty = np.divide(self_information.sum(axis=1), n_recommended, out=np.zeros(len(hits)), where=n_recommended > 0)
+
+    return pd.DataFrame(
+        np.column_stack([precision, recall, f1, hits.any(axis=1), ndcg, average_precision, reciprocal_rank, novelty, popularity]),
+        columns=PER_USER_METRICS
+    )
+
+def catalog_coverage(positions, n_items):
+    return len(np.unique(positions[positions >= 0])) / n_items
+
+def bootstrap_ci(per_user, n_resamples=1000, confidence=0.95, random_seed=42):
+    # Percentile bootstrap over users of the mean of every column: ('CI Low', 'CI High') rows.
+    # Each chunk of resamples is a (resamples x users) matrix of draw counts times the per-user values.
+    values = per_user.to_numpy(dtype=float)
+    n_users = len(values)
+    rng = np.random.default_rng(random_seed)
+    means = np.empty((n_resamples, values.shape[1]))
+    for start in range(0, n_resamples, BOOTSTRAP_CHUNK):
+        size = min(BOOTSTRAP_CHUNK, n_resamples - start)
+        draws = rng.integers(0, n_users, (size, n_users)) + np.arange(size)[:, None] * n_users
+        counts = np.bincount(draws.ravel(), minlength=size * n_users).reshape(size, n_users)
+        means[start:start + size] = counts @ values / n_users
+    tail = (1 - confidence) / 2
+    return pd.DataFrame(np.quantile(means, [tail, 1 - tail], axis=0), index=["CI Low", "CI High"], columns=per_user.columns)
+
+def summarize(per_user, positions, n_items, n_resamples=0, random_seed=42):
+    # One report row: per-user means under their report names, catalog coverage, and bootstrap intervals
+    # ('<name> CI Low' / '<name> CI High') of the means when n_resamples > 0
+    summary = {SUMMARY_NAMES.get(metric, metric): per_user[metric].mean() for metric in PER_USER_METRICS}
+    summary["Catalog Coverage"] = catalog_coverage(positions, n_items)
+    if n_resamples > 0:
+        intervals = bootstrap_ci(per_user, n_resamples=n_resamples, random_seed=random_seed)
+        for metric in PER_USER_METRICS:
+            name = SUMMARY_NAMES.get(metric, metric)
+            summary[f"{name} CI Low"], summary[f"{name} CI High"] = intervals[metric]
+    return summary
@@ -1,189 +1,826 @@
+import copy
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 import os
+from functools import cached_property
 from pathlib import Path
 
+try:
+    from backend.matrix_store import get_store
+    from backend.sparse_matrix import csr_row
+    from backend.neighbor_index import neighbor_matrix
+    from backend.ann_index import load_ann_index, DEFAULT_N_PROBE
+    from backend.matrix_factorization import load_or_train_factors, factors_name
+    from backend.instrumentation import span
+    from backend.popularity import PopularityRankings, SEGMENT_COLUMNS
+except ImportError:
+    from matrix_store import get_store
+    from sparse_matrix import csr_row
+    from neighbor_index import neighbor_matrix
+    from ann_index import load_ann_index, DEFAULT_N_PROBE
+    from matrix_factorization import load_or_train_factors, factors_name
+    from instrumentation import span
+    from popularity import PopularityRankings, SEGMENT_COLUMNS
+
 BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_PATH = BASE_DIR / 'data' / 'processed'
+# RECOMMENDER_DATA_PATH points the recommenders at another processed dataset (e.g. the benchmark's synthetic data)
+DATA_PATH = Path(os.environ.get('RECOMMENDER_DATA_PATH', BASE_DIR / 'data' / 'processed'))
+
+# Number of users scored together by recommend_batch
+BATCH_SIZE = 512
+
+# Number of items rescored exactly after an approximate nearest-neighbor search
+ANN_CANDIDATES = 200
+
+# Similarity values widened to float64 at once when scoring from a dense similarity matrix (see weighted_row_sums)
+SIMILARITY_BLOCK_ELEMENTS = 1 << 22
+
+# Per-child score normalizations supported by HybridRecommender
+HYBRID_NORMALIZATIONS = ('none', 'minmax', 'zscore', 'rank')
+
+def top_k_positions(scores, k):
+    # Row-wise positions of the k highest scores, best first, without sorting whole rows.
+    # Ties go to the lower position, so a row's top k is always a prefix of its top k + m.
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    
+    # Rows whose k-th score is shared with items argpartition left out: keep the lowest tied positions instead
+    threshold = top_scores.min(axis=1, keepdims=True)
+    ambiguous = np.flatnonzero((scores >= threshold).sum(axis=1) > k)
+    if len(ambiguous):
+        candidates = scores[ambiguous]
+        above = candidates > threshold[ambiguous]
+        ties = candidates == threshold[ambiguous]
+        ties &= np.cumsum(ties, axis=1) <= k - above.sum(axis=1, keepdims=True)
+        top[ambiguous] = np.nonzero(above | ties)[1].reshape(len(ambiguous), k)
+        top_scores[ambiguous] = np.take_along_axis(candidates, top[ambiguous], axis=1)
+    
+    order = np.lexsort((top, -top_scores), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+def _to_dense(matrix):
+    return matrix.toarray() if sp.issparse(matrix) else np.asarray(matrix)
+
+def weighted_row_sums(weights, matrix):
+    # weights (n_rows x n, sparse) @ matrix (n x n_items) in float64. Only the matrix rows some weight uses are read
+    # and widened, one fixed block of rows at a time, so float32/float16/int8 matrices are never converted whole.
+    # Every output row adds its weighted rows in the same order whether it is computed alone or within a batch: a
+    # user gets bit-identical scores (and ties) from recommend, recommend_batch and the precomputed tables.
+    weights = sp.csc_matrix(weights, dtype=np.float64)
+    scores = np.zeros((weights.shape[0], matrix.shape[1]))
+    block_size = max(1, SIMILARITY_BLOCK_ELEMENTS // max(matrix.shape[1], 1))
+    for start in range(0, matrix.shape[0], block_size):
+        block = weights[:, start:start + block_size]
+        used = np.flatnonzero(np.diff(block.indptr))
+        if len(used):
+            scores += sp.csr_matrix(block[:, used]) @ np.asarray(matrix[start + used], dtype=np.float64)
+    return scores
+
+def _unrated_top_k(scores_array, rated_items, item_index, top_k):
+    # MovieIDs of one user's top_k unrated items, ranked like recommend_batch (ties to the lower position)
+    scores = np.nan_to_num(scores_array)
+    scores[rated_items] = -np.inf
+    return item_index.values[top_k_positions(scores[None, :], top_k)[0]].tolist()
 
 class RecommenderBase:
-    def __init__(self, data_path=DATA_PATH, eval_mode=False):
-        # Collaborative filtering matrices
-        self.user_item_matrix = pd.read_pickle(data_path / 'user_item_matrix.pkl')
-        self.item_user_matrix = pd.read_pickle(data_path / 'item_user_matrix.pkl')
-        self.item_similarity_matrix = pd.read_pickle(data_path / 'item_similarity_matrix_df.pkl')
-        self.adjusted_item_similarity_matrix = pd.read_pickle(data_path / 'adjusted_item_similarity_matrix_df.pkl')
-        
-        # Content-based matrices
-        self.content_similarity_matrix_one_hot = pd.read_pickle(data_path / 'content_similarity_matrix_one_hot.pkl')
-        self.content_similarity_matrix_tfidf = pd.read_pickle(data_path / 'content_similarity_matrix_tfidf.pkl')
-        
-        # Popularity data
-        self.popularity = pd.read_pickle(data_path / 'popularity.pkl')
-        
-        # User and movie metadata
-        self.users = pd.read_pickle(data_path / 'users.pkl')
-        self.movies = pd.read_pickle(data_path / 'movies.pkl')
-        
-        # User correlation matrix for user-based CF
-        self.user_correlation_matrix = pd.read_pickle(data_path / 'user_correlation_matrix.pkl')
-        
-        if eval_mode:
-            self.user_item_matrix = pd.read_pickle(data_path / 'eval_train_matrix.pkl')
-            self.item_user_matrix = pd.read_pickle(data_path / 'eval_item_user_matrix.pkl')
-            self.item_similarity_matrix = pd.read_pickle(data_path / 'eval_item_similarity_matrix.pkl')
-            self.adjusted_item_similarity_matrix = pd.read_pickle(data_path / 'eval_adjusted_item_similarity_matrix.pkl')
-            self.user_correlation_matrix = pd.read_pickle(data_path / 'eval_user_correlation_matrix.pkl')
-            self.popularity = pd.read_pickle(data_path / 'eval_popularity.pkl')
+    # Artifacts are loaded on first access and cached per recommender, so each recommender only touches the matrices
+    # it uses. In eval mode the evaluation versions are loaded instead of (never after) the production ones.
+    
+    # Constructor parameters that only recombine or rank the score components of a user block: variants with other
+    # values of them (see with_params) are ranked from a single scoring pass by recommend_variants
+    SWEEP_PARAMS = ('top_k',)
+    
+    # Whether a user's scores depend only on their own ratings and on artifacts ingestion never updates in place, so
+    # an ingested rating changes no other user's recommendations (see PrecomputedRecommendations.invalidate_users)
+    USER_LOCAL_SCORES = False
+    
+    # Whether top_k only sets the length of the ranked list, so a top_k list is a prefix of every longer one and
+    # a precomputed table serves every top_k up to its width; False when top_k also changes the scores
+    TOP_K_IS_LENGTH = True
+    
+    def __init__(self, data_path=DATA_PATH, eval_mode=False, sparse=None):
+        # Shared process-wide store: matrices are memory-mapped once and every recommender gets views of them
+        self.store = get_store(data_path)
+        self.eval_mode = eval_mode
+        # Label of this recommender's timing spans (see instrumentation.py)
+        self.model_name = type(self).__name__
+        # None: CSR ratings when preprocessing did not write the dense User-Item matrix (SPARSE_BACKEND)
+        self.sparse = sparse if sparse is not None else not self.store.has_frame(self._user_item_names[0])
+    
+    @property
+    def _user_item_names(self):
+        return ('eval_train_matrix', 'eval_train_csr') if self.eval_mode else ('user_item_matrix', 'user_item_csr')
+    
+    def _load_dense(self, name, alternative):
+        # Dense artifacts are not written on the CSR backend; alternative names the constructor option that does without
+        if not self.store.has_frame(name):
+            raise ValueError(f"Matrix '{name}' was not built by preprocessing (SPARSE_BACKEND), use {alternative}.")
+        return self.store.load_frame(name)
+    
+    # Collaborative filtering matrices
+    @cached_property
+    def _user_item(self):
+        # (dense matrix, CSR matrix, user index, item index); the matrix of the other backend is None
+        dense_name, csr_name = self._user_item_names
+        if self.sparse:
+            # CSR ratings: memory and scoring cost scale with the number of ratings, not users x items
+            user_item_csr, user_index, item_index = self.store.load_sparse_or_dense(csr_name, dense_name)
+            return None, user_item_csr, user_index, item_index
+        user_item_matrix = self._load_dense(dense_name, 'sparse=True')
+        return user_item_matrix, None, user_item_matrix.index, user_item_matrix.columns
+    
+    @property
+    def user_item_matrix(self):
+        return self._user_item[0]
+    
+    @property
+    def user_item_csr(self):
+        return self._user_item[1]
+    
+    @property
+    def user_index(self):
+        return self._user_item[2]
+    
+    @property
+    def item_index(self):
+        return self._user_item[3]
+    
+    @cached_property
+    def item_user_matrix(self):
+        return self.user_item_matrix.T if self.user_item_matrix is not None else None
+    
+    @property
+    def _item_similarity_name(self):
+        return 'eval_item_similarity_matrix' if self.eval_mode else 'item_similarity_matrix_df'
+    
+    @property
+    def _adjusted_item_similarity_name(self):
+        return 'eval_adjusted_item_similarity_matrix' if self.eval_mode else 'adjusted_item_similarity_matrix_df'
+    
+    @property
+    def _user_correlation_name(self):
+        return 'eval_user_correlation_matrix' if self.eval_mode else 'user_correlation_matrix'
+    
+    @cached_property
+    def item_similarity_matrix(self):
+        return self._load_dense(self._item_similarity_name, 'use_neighbor_index=True')
+    
+    @cached_property
+    def adjusted_item_similarity_matrix(self):
+        return self._load_dense(self._adjusted_item_similarity_name, 'use_neighbor_index=True')
+    
+    # User correlation matrix for user-based CF
+    @cached_property
+    def user_correlation_matrix(self):
+        return self._load_dense(self._user_correlation_name, 'use_neighbor_index=True')
+    
+    # Content-based matrices
+    @cached_property
+    def content_similarity_matrix_one_hot(self):
+        return self._load_dense('content_similarity_matrix_one_hot', 'use_neighbor_index=True or use_profile=True')
+    
+    @cached_property
+    def content_similarity_matrix_tfidf(self):
+        return self._load_dense('content_similarity_matrix_tfidf', 'use_neighbor_index=True or use_profile=True')
+    
+    # Popularity data
+    @cached_property
+    def popularity(self):
+        return self.store.load_pickle('eval_popularity.pkl' if self.eval_mode else 'popularity.pkl')
+    
+    @cached_property
+    def popularity_rankings(self):
+        # Ranked arrays written by preprocessing (see popularity.py); data directories without them only get the
+        # global ranking, sorted once here
+        name = 'eval_popularity_rankings' if self.eval_mode else 'popularity_rankings'
+        if self.store.has_arrays(name):
+            return PopularityRankings.load(self.store, name)
+        return PopularityRankings.from_popularity(self.popularity)
+    
+    @cached_property
+    def popularity_blend(self):
+        # Rating counts aligned to item_index and scaled to [0, 1], allocated once for the popularity blends
+        counts = self.popularity_rankings.aligned(self.popularity_rankings.counts, self.item_index)
+        return counts / counts.max() if len(counts) and counts.max() > 0 else counts
+    
+    # User and movie metadata
+    @cached_property
+    def users(self):
+        return self.store.load_pickle('users.pkl')
+    
+    @cached_property
+    def movies(self):
+        return self.store.load_pickle('movies.pkl')
+    
+    def _load_neighbor_index(self, name, ids):
+        # Precomputed top-N lists (see neighbor_index.py); positions must refer to the loaded ids
+        indices, scores, neighbor_ids = self.store.load_neighbors(name)
+        if not neighbor_ids.equals(ids):
+            raise ValueError(f"Neighbor index '{name}' does not match the loaded rating matrix, rerun preprocessing.")
+        return indices, scores
+    
+    def _load_ann_index(self, name, vectors_name, ids):
+        # ANN index and the L2-normalized item vectors it was built from (see ann_index.py)
+        ann_index = load_ann_index(self.store, name)
+        if not ann_index.ids.equals(ids):
+            raise ValueError(f"ANN index '{name}' does not match the loaded rating matrix, rerun preprocessing.")
+        return ann_index, self._load_item_vectors(vectors_name, ids)
+    
+    def _load_item_vectors(self, name, ids):
+        # L2-normalized feature rows (CSR) of the items in ids, in that order
+        vectors, vector_ids, _ = self.store.load_sparse(name)
+        if not vector_ids.equals(ids):
+            raise ValueError(f"Item vectors '{name}' do not match the loaded rating matrix, rerun preprocessing.")
+        return vectors
+    
+    def _ann_scores(self, rated_items, weights):
+        # The user profile is the weighted sum of the rated items' vectors: its inner product with an item vector
+        # equals the similarity-weighted score. Only the ANN candidates are scored (exactly), every other item gets 0.
+        with span(self.model_name, 'candidates'):
+            profile = sp.csr_matrix(np.asarray(weights, dtype=np.float64).reshape(1, -1)) @ self.ann_vectors[rated_items]
+            positions, _ = self.ann_index.query(profile, self.ann_candidates + len(rated_items), n_probe=self.n_probe)
+            candidates = positions[0][positions[0] >= 0]
+        scores_array = np.zeros(len(self.item_index))
+        scores_array[candidates] = _to_dense(self.ann_vectors[candidates] @ profile.T).ravel()
+        return scores_array
+    
+    def _ann_block(self, rows, rating_weighted=True):
+        # _ann_scores of every user of a block, searched user by user (the rated items weighted by 1 without
+        # rating_weighted), so recommend_batch scores ANN configurations like recommend does
+        scores = np.zeros((len(rows), len(self.item_index)))
+        for position, row in enumerate(rows):
+            rated_items, ratings = self._row_ratings(row)
+            if len(rated_items):
+                weights = ratings if rating_weighted else np.ones(len(rated_items))
+                scores[position] = self._ann_scores(rated_items, weights)
+        return scores
+    
+    def _user_ratings(self, user_id):
+        # Positions (in item_index) and values of the items rated by the user
+        return self._row_ratings(self.user_index.get_loc(user_id))
+    
+    def _row_ratings(self, row):
+        if self.sparse:
+            return csr_row(self.user_item_csr, row)
+        user_vector = self.user_item_matrix.values[row]
+        rated_items = np.flatnonzero(user_vector > 0)
+        return rated_items, user_vector[rated_items]
+    
+    def _user_item_block(self, rows):
+        # Rating rows of several users: dense array or CSR, depending on the backend
+        if self.sparse:
+            return self.user_item_csr[rows]
+        return self.user_item_matrix.values[rows]
+    
+    def _rated_block(self, rows):
+        return _to_dense(self._user_item_block(rows) > 0)
+    
+    def _popular_items(self, top_k):
+        # Cold-start list: a slice of the precomputed global ranking
+        return self.popularity_rankings.top(top_k)
+    
+    def _score_components(self, rows):
+        # Expensive part of the scores of known users, shared by every value of SWEEP_PARAMS; implemented by each recommender
+        raise NotImplementedError
+    
+    def _combine_components(self, components, rows):
+        # Scores from the components under this recommender's SWEEP_PARAMS values
+        return components
+    
+    def _score_block(self, rows):
+        # Dense (len(rows), n_items) score array for known users
+        return self._combine_components(self._score_components(rows), rows)
+    
+    def _top_k_from_components(self, components, rows, rated, top_k):
+        # Item positions of each row's top_k unrated items
+        scores = np.nan_to_num(self._combine_components(components, rows))
+        scores[rated] = -np.inf
+        return top_k_positions(scores, top_k)
+    
+    def with_params(self, **params):
+        # Copy sharing every loaded artifact, with other values of SWEEP_PARAMS
+        unknown = set(params) - set(self.SWEEP_PARAMS)
+        if unknown:
+            raise ValueError(f"{self.model_name} cannot vary {sorted(unknown)} without rescoring, expected {self.SWEEP_PARAMS}.")
+        variant = copy.copy(self)
+        variant.__dict__.update(params)
+        return variant
+    
+    def user_scores(self, user_id):
+        # Score of every item (aligned with item_index) for one known user
+        return np.nan_to_num(self._score_block(np.array([self.user_index.get_loc(user_id)]))[0])
+    
+    def recommend_batch(self, user_ids, top_k=None):
+        # (n_users, top_k) array of MovieIDs; users are scored BATCH_SIZE at a time as matrix products
+        return self.recommend_variants(user_ids, [(self, top_k if top_k else self.top_k)])[0]
+    
+    def recommend_variants(self, user_ids, variants):
+        # recommend_batch of several (variant, top_k) pairs, variants being with_params copies of this recommender:
+        # every user block is scored once and ranked by each variant. Returns one MovieID array per pair.
+        user_rows = self.user_index.get_indexer(np.asarray(user_ids))
+        
+        # New users (Cold Start) and users without ratings get the most popular items
+        results = [np.tile(self._popular_items(top_k), (len(user_rows), 1)) for _, top_k in variants]
+        
+        for start in range(0, len(user_rows), BATCH_SIZE):
+            block_rows = user_rows[start:start + BATCH_SIZE]
+            known = np.flatnonzero(block_rows >= 0)
+            if len(known) == 0:
+                continue
+            
+            rows = block_rows[known]
+            with span(self.model_name, 'batch_scoring'):
+                components = self._score_components(rows)
+            with span(self.model_name, 'batch_masking'):
+                rated = self._rated_block(rows)
+            has_ratings = rated.any(axis=1)
+            
+            for (variant, top_k), recommendations in zip(variants, results):
+                with span(self.model_name, 'batch_top_k'):
+                    block_recommendations = self.item_index.values[variant._top_k_from_components(components, rows, rated, top_k)]
+                recommendations[start + known[has_ratings]] = block_recommendations[has_ratings]
+        
+        return results
         
 # User-Based Collaborative Filtering Recommender
 class UserBasedCFRecommender(RecommenderBase):
-    def __init__(self, top_k=10, alpha=1.0, eval_mode=False):
-        super().__init__(eval_mode=eval_mode)
+    # top_k is also the number of neighbors, so only the popularity blend can vary without rescoring
+    SWEEP_PARAMS = ('alpha',)
+    TOP_K_IS_LENGTH = False
+    
+    def __init__(self, top_k=10, alpha=1.0, eval_mode=False, sparse=None, use_neighbor_index=None, data_path=DATA_PATH):
+        super().__init__(data_path=data_path, eval_mode=eval_mode, sparse=sparse)
         self.top_k = top_k
         self.alpha = alpha
+        # None: the neighbor lists when preprocessing kept only those (SPARSE_BACKEND or --user-topn-only)
+        if use_neighbor_index is None:
+            use_neighbor_index = not self.store.has_frame(self._user_correlation_name)
+        self.use_neighbor_index = use_neighbor_index
+        if use_neighbor_index:
+            self.user_neighbors, _ = self._load_neighbor_index('eval_user_topn' if eval_mode else 'user_topn', self.user_index)
     
     def recommend(self, user_id):
-        if user_id not in self.user_item_matrix.index:
-            # New User (Cold Start): Recommend most popular items
-            if self.popularity is not None:
-                return self.popularity.sort_values(by='NumRatings', ascending=False).head(self.top_k)['MovieID'].tolist()
-            else:
-                return []
-        
-        # Top K Nearest Neighbors
-        neighbors = self.user_correlation_matrix[user_id].sort_values(ascending=False).iloc[1:self.top_k+1].index
+        # Same scoring and tie-breaking as recommend_batch, so single lists, batches and precomputed tables agree
+        return self.recommend_batch([user_id])[0].tolist()
+    
+    def _score_components(self, rows):
+        # Top K neighbors of every user in the block
+        if self.use_neighbor_index:
+            neighbor_rows = self.user_neighbors[rows, :self.top_k]
+        else:
+            correlations = np.array(self.user_correlation_matrix.values[rows], dtype=float)
+            correlations[np.isnan(correlations)] = -np.inf
+            correlations[np.arange(len(rows)), rows] = -np.inf
+            neighbor_rows = top_k_positions(correlations, self.top_k)
         
-        # Predict scores based on neighbors' ratings
-        pred_scores = self.user_item_matrix.loc[neighbors].mean(axis=0)
-        already_rated = self.user_item_matrix.loc[user_id]
-        pred_scores = pred_scores[already_rated.isna() | (already_rated == 0)]
+        # Neighbor averages as one sparse (block x users) @ (users x items) product
+        n_neighbors = neighbor_rows.shape[1]
+        averaging = sp.csr_matrix(
+            (np.full(neighbor_rows.size, 1 / n_neighbors), neighbor_rows.ravel(), np.arange(0, neighbor_rows.size + 1, n_neighbors)),
+            shape=(len(rows), len(self.user_index))
+        )
+        all_ratings = self.user_item_csr if self.sparse else self.user_item_matrix.values
+        pred_scores = _to_dense(averaging @ all_ratings)
         
-        # Optional: Adjust scores with alpha (popularity hybridization)
+        # Normalized by each user's best unrated score, ready for the popularity blend
         if self.popularity is not None:
-            pop_scores = self.popularity.set_index('MovieID')['NumRatings']
-            pop_scores = pop_scores / pop_scores.max()  # normalization
-            pred_scores = pred_scores / pred_scores.max()  # normalization
-            pop_scores_for_candidates = pop_scores.reindex(pred_scores.index).fillna(0)
-            pred_scores = self.alpha * pred_scores + (1 - self.alpha) * pop_scores_for_candidates
-        
-        top_items = pred_scores.sort_values(ascending=False).head(self.top_k).index.tolist()
-        return top_items
+            candidate_max = np.where(self._rated_block(rows), -np.inf, pred_scores).max(axis=1, keepdims=True)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pred_scores = pred_scores / candidate_max
+        return pred_scores
+    
+    def _combine_components(self, pred_scores, rows):
+        # Optional: Adjust scores with alpha (popularity hybridization)
+        if self.popularity is None:
+            return pred_scores
+        return self.alpha * pred_scores + (1 - self.alpha) * self.popularity_blend
 
 # Item-Based Collaborative Filtering Recommender
 class ItemBasedCFRecommender(RecommenderBase):
-    def __init__(self, adjusted=False, top_k=10, eval_mode=False):
-        super().__init__(eval_mode=eval_mode)
+    def __init__(self, adjusted=False, top_k=10, eval_mode=False, sparse=None, use_neighbor_index=None,
+                 use_ann_index=False, ann_candidates=ANN_CANDIDATES, n_probe=DEFAULT_N_PROBE, data_path=DATA_PATH):
+        super().__init__(data_path=data_path, eval_mode=eval_mode, sparse=sparse)
         self.scores = None
+        self.score_vector = None
         self.top_k = top_k
-        self.sim_matrix = self.adjusted_item_similarity_matrix if adjusted else self.item_similarity_matrix
+        self.adjusted = adjusted
+        # None: the neighbor lists when the similarity matrix was not built (SPARSE_BACKEND)
+        if use_neighbor_index is None:
+            use_neighbor_index = not self.store.has_frame(self._adjusted_item_similarity_name if adjusted else self._item_similarity_name)
+        self.use_neighbor_index = use_neighbor_index
+        self._neighbor_matrix = None
+        if use_neighbor_index:
+            neighbor_name = 'adjusted_item_topn' if adjusted else 'item_topn'
+            neighbor_name = 'eval_' + neighbor_name if eval_mode else neighbor_name
+            self.neighbor_indices, self.neighbor_scores = self._load_neighbor_index(neighbor_name, self.item_index)
+        self.use_ann_index = use_ann_index
+        self.ann_candidates = ann_candidates
+        self.n_probe = n_probe
+        if use_ann_index:
+            # Adjusted similarities are not inner products of fixed item vectors, so they cannot be searched this way
+            if adjusted:
+                raise ValueError("The ANN index supports plain cosine item similarity only, not adjusted=True.")
+            prefix = 'eval_' if eval_mode else ''
+            self.ann_index, self.ann_vectors = self._load_ann_index(f'{prefix}item_ann', f'{prefix}item_vectors', self.item_index)
+    
+    @property
+    def sim_matrix(self):
+        return self.adjusted_item_similarity_matrix if self.adjusted else self.item_similarity_matrix
     
     def recommend(self, user_id, top_k=None):
         actual_used_top_k = top_k if top_k else self.top_k
         
-        if user_id not in self.user_item_matrix.index:
+        if user_id not in self.user_index:
             # New User (Cold Start): Recommend most popular items
-            if self.popularity is not None:
-                return self.popularity.sort_values(by='NumRatings', ascending=False).head(actual_used_top_k)['MovieID'].tolist()
-            else:
-                return []
+            return self._popular_items(actual_used_top_k).tolist()
         
         scores = {}
         
-        user_vectors = self.user_item_matrix.loc[user_id].values
-        sim_matrix = self.sim_matrix.values
-        scores_array = user_vectors @ sim_matrix
-        
-        scores_array[user_vectors > 0] = 0
-        
-        scores_array = np.nan_to_num(scores_array)
-        
-        scores = pd.Series(scores_array, index=self.user_item_matrix.columns)
+        rated_items, _ = self._user_ratings(user_id)
+        if len(rated_items) == 0:
+            return self._popular_items(actual_used_top_k).tolist()
         
-        scores = scores[scores.notna()]
-        scores = scores.fillna(0)
+        scores_array = self.user_scores(user_id)
         
-        self.scores = scores.to_dict()
-        
-        top_items = sorted(self.scores, key=self.scores.get, reverse=True)[:actual_used_top_k]
+        with span(self.model_name, 'top_k'):
+            scores = pd.Series(scores_array, index=self.item_index)
+            
+            scores = scores[scores.notna()]
+            scores = scores.fillna(0)
+            
+            self.scores = scores.to_dict()
+            
+            top_items = _unrated_top_k(scores_array, rated_items, self.item_index, actual_used_top_k)
         return top_items
     
     def get_scores(self):
         return self.scores
+    
+    def user_scores(self, user_id):
+        # Scored as a one-user block of recommend_batch; only the similarity rows of rated items contribute
+        rated_items, _ = self._user_ratings(user_id)
+        with span(self.model_name, 'scoring'):
+            scores_array = self._score_components(np.array([self.user_index.get_loc(user_id)]))[0]
+        
+        with span(self.model_name, 'masking'):
+            scores_array[rated_items] = 0
+            self.score_vector = np.nan_to_num(scores_array)
+        return self.score_vector
+    
+    def _score_components(self, rows):
+        if self.use_ann_index:
+            return self._ann_block(rows)
+        ratings = sp.csr_matrix(self._user_item_block(rows), dtype=np.float64)
+        if self.use_neighbor_index:
+            if self._neighbor_matrix is None:
+                self._neighbor_matrix = neighbor_matrix(self.neighbor_indices, self.neighbor_scores, len(self.item_index))
+            return _to_dense(ratings @ self._neighbor_matrix)
+        return weighted_row_sums(ratings, self.sim_matrix.values)
 
 # Content-Based Recommender
 class ContentBasedRecommender(RecommenderBase):
-    def __init__(self, use_tfidf=False, top_k=10, eval_mode=False):
-        super().__init__(eval_mode=eval_mode)
+    # Scores are sums of content similarities to the user's rated items, weighted by their ratings when
+    # rating_weighted is set. use_profile computes the same sums from the items' L2-normalized genre/TF-IDF vectors:
+    # the user profile is the weighted sum of the rated items' vectors, scored against every item in one sparse product.
+    USER_LOCAL_SCORES = True
+    
+    def __init__(self, use_tfidf=False, top_k=10, eval_mode=False, sparse=None, use_neighbor_index=None,
+                 use_ann_index=False, ann_candidates=ANN_CANDIDATES, n_probe=DEFAULT_N_PROBE, use_profile=False, rating_weighted=False,
+                 data_path=DATA_PATH):
+        super().__init__(data_path=data_path, eval_mode=eval_mode, sparse=sparse)
         self.scores = None
+        self.score_vector = None
         self.top_k = top_k
-        self.sim_matrix = self.content_similarity_matrix_tfidf if use_tfidf else self.content_similarity_matrix_one_hot 
+        self.rating_weighted = rating_weighted
+        self.use_tfidf = use_tfidf
+        content_name = 'content_tfidf' if use_tfidf else 'content_one_hot'
+        # None: the neighbor lists when the content similarity matrices were not built (SPARSE_BACKEND)
+        if use_neighbor_index is None:
+            sim_name = 'content_similarity_matrix_tfidf' if use_tfidf else 'content_similarity_matrix_one_hot'
+            use_neighbor_index = not (use_profile or self.store.has_frame(f'{content_name}_aligned') or self.store.has_frame(sim_name))
+        self.use_neighbor_index = use_neighbor_index
+        self._neighbor_matrix = None
+        if use_neighbor_index:
+            self.neighbor_indices, self.neighbor_scores = self._load_neighbor_index(f'{content_name}_topn', self.item_index)
+        self.use_ann_index = use_ann_index
+        self.ann_candidates = ann_candidates
+        self.n_probe = n_probe
+        if use_ann_index:
+            self.ann_index, self.ann_vectors = self._load_ann_index(f'{content_name}_ann', f'{content_name}_vectors', self.item_index)
+        self.use_profile = use_profile
+        if use_profile:
+            self.content_vectors = self._load_item_vectors(f'{content_name}_vectors', self.item_index)
+        
+        # Similarities aligned to the rating matrix: row and column i belong to MovieID item_index[i]
+        self.aligned_sim = None
+        if not (use_profile or use_neighbor_index):
+            self.aligned_sim = self._load_aligned_similarity(content_name)
+    
+    @property
+    def sim_matrix(self):
+        return self.content_similarity_matrix_tfidf if self.use_tfidf else self.content_similarity_matrix_one_hot
+    
+    def _load_aligned_similarity(self, content_name):
+        # float32, C-contiguous and memory-mapped when written by the content_aligned preprocessing stage;
+        # otherwise aligned here, once per recommender
+        name = f'{content_name}_aligned'
+        if self.store.has_matrix(name):
+            aligned = self.store.load_frame(name)
+            if aligned.index.equals(self.item_index) and aligned.columns.equals(self.item_index):
+                return aligned.values
+        # Positional gather: float16/int8 matrices (CompactFrame) only support row selection
+        positions = self.sim_matrix.index.get_indexer(self.item_index)
+        return np.ascontiguousarray(self.sim_matrix.values[positions][:, positions], dtype=np.float32)
     
     def recommend(self, user_id, top_k=None):
         actual_used_top_k = top_k if top_k else self.top_k
         
-        if user_id not in self.user_item_matrix.index:
+        if user_id not in self.user_index:
             # New User (Cold Start): Recommend most popular items
-            if self.popularity is not None:
-                return self.popularity.sort_values(by='NumRatings', ascending=False).head(actual_used_top_k)['MovieID'].tolist()
-            else:
-                return []
+            return self._popular_items(actual_used_top_k).tolist()
         
         scores = {}
             
-        user_vectors = self.user_item_matrix.loc[user_id].values
-        
-        liked_indices = np.where(user_vectors > 0)[0]
+        liked_indices, _ = self._user_ratings(user_id)
         if len(liked_indices) == 0:
-            return self.popularity.sort_values(by='NumRatings', ascending=False).head(actual_used_top_k)['MovieID'].tolist() if self.popularity is not None else []
-        
-        sim_matrix = self.sim_matrix.loc[self.user_item_matrix.columns, self.user_item_matrix.columns].values
-        scores_array = sim_matrix[liked_indices].sum(axis=0)
-        scores_array[liked_indices] = 0
-        
-        scores_array = np.nan_to_num(scores_array)
-        
-        scores = pd.Series(scores_array, index=self.user_item_matrix.columns)
+            return self._popular_items(actual_used_top_k).tolist()
         
-        scores = scores[scores.notna()]
-        scores = scores.fillna(0)
+        scores_array = self.user_scores(user_id)
         
-        self.scores = scores.to_dict()
-        
-        top_items = sorted(self.scores, key=self.scores.get, reverse=True)[:actual_used_top_k]
+        with span(self.model_name, 'top_k'):
+            scores = pd.Series(scores_array, index=self.item_index)
+            
+            scores = scores[scores.notna()]
+            scores = scores.fillna(0)
+            
+            self.scores = scores.to_dict()
+            
+            top_items = _unrated_top_k(scores_array, liked_indices, self.item_index, actual_used_top_k)
         return top_items
     
     def get_scores(self):
         return self.scores
+    
+    def user_scores(self, user_id):
+        # Scored as a one-user block of recommend_batch, so single lists, batches and precomputed tables agree
+        liked_indices, _ = self._user_ratings(user_id)
+        with span(self.model_name, 'scoring'):
+            scores_array = self._score_components(np.array([self.user_index.get_loc(user_id)]))[0]
+        with span(self.model_name, 'masking'):
+            scores_array[liked_indices] = 0
+            self.score_vector = np.nan_to_num(scores_array)
+        return self.score_vector
+    
+    def _score_components(self, rows):
+        if self.use_ann_index:
+            return self._ann_block(rows, self.rating_weighted)
+        # Weights of the rated items (ratings, or 1) as sparse rows; every path below sums each user's rows in a fixed
+        # order, so a user's scores do not depend on the other users of the block
+        block = self._user_item_block(rows)
+        liked = sp.csr_matrix(block if self.rating_weighted else block > 0, dtype=np.float64)
+        liked.data = np.nan_to_num(liked.data)
+        if self.use_neighbor_index:
+            if self._neighbor_matrix is None:
+                self._neighbor_matrix = neighbor_matrix(self.neighbor_indices, self.neighbor_scores, len(self.item_index))
+            return _to_dense(liked @ self._neighbor_matrix)
+        if self.use_profile:
+            profiles = _to_dense(liked @ self.content_vectors)
+            return _to_dense(self.content_vectors @ profiles.T).T
+        # float64 sums over the rated rows of the mapped float32 matrix, widened block by block
+        return weighted_row_sums(liked, self.aligned_sim)
+
+# Matrix Factorization Recommender
+class MatrixFactorizationRecommender(RecommenderBase):
+    # ALS factors of the rating matrix (or of the evaluation training split), trained on first use and kept in the
+    # matrix store: memory and scoring cost grow with rank x (users + items) instead of items x items
+    USER_LOCAL_SCORES = True
+    
+    def __init__(self, top_k=10, rank=32, reg=0.1, implicit=False, alpha=40.0, n_iter=15, random_seed=42, eval_mode=False, sparse=None,
+                 data_path=DATA_PATH):
+        super().__init__(data_path=data_path, eval_mode=eval_mode, sparse=sparse)
+        self.top_k = top_k
+        csr_name, dense_name = ('eval_train_csr', 'eval_train_matrix') if eval_mode else ('user_item_csr', 'user_item_matrix')
+        ratings, user_index, item_index = self.store.load_sparse_or_dense(csr_name, dense_name)
+        if not (user_index.equals(self.user_index) and item_index.equals(self.item_index)):
+            raise ValueError(f"Matrix '{csr_name}' does not match the loaded rating matrix, rerun preprocessing.")
+        
+        als_params = {"rank": rank, "reg": reg, "implicit": implicit, "alpha": alpha, "n_iter": n_iter, "random_seed": random_seed}
+        name = factors_name(eval_mode=eval_mode, **als_params)
+        self.user_factors, self.item_factors = load_or_train_factors(ratings, self.store.data_path, name, **als_params)
+    
+    def recommend(self, user_id, top_k=None):
+        actual_used_top_k = top_k if top_k else self.top_k
+        
+        if user_id not in self.user_index:
+            # New User (Cold Start): Recommend most popular items
+            return self._popular_items(actual_used_top_k).tolist()
+        
+        with span(self.model_name, 'scoring'):
+            scores_array = self.user_scores(user_id)
+        with span(self.model_name, 'masking'):
+            rated_items, _ = self._user_ratings(user_id)
+            scores_array[rated_items] = -np.inf
+        with span(self.model_name, 'top_k'):
+            return self.item_index.values[top_k_positions(scores_array[None, :], actual_used_top_k)[0]].tolist()
+    
+    def user_scores(self, user_id):
+        return self.item_factors @ self.user_factors[self.user_index.get_loc(user_id)]
+    
+    def _score_components(self, rows):
+        return self.user_factors[rows] @ self.item_factors.T
+
+# Popularity Recommender (also the cold-start fallback of every other recommender)
+class PopularityRecommender(RecommenderBase):
+    # Ranks by rating count, or by time-decayed rating count with decay=True. With segmented=True, users are ranked
+    # by the popularity among users sharing their Gender/Age/Occupation (users.pkl for known users, the demographics
+    # argument of recommend for new ones).
+    USER_LOCAL_SCORES = True
+    
+    def __init__(self, top_k=10, eval_mode=False, sparse=None, decay=False, segmented=False, data_path=DATA_PATH):
+        super().__init__(data_path=data_path, eval_mode=eval_mode, sparse=sparse)
+        self.top_k = top_k
+        self.decay = decay
+        self.segmented = segmented
+        rankings = self.popularity_rankings
+        if segmented and not rankings.has_segments:
+            raise ValueError("Segmented popularity needs the popularity rankings, rerun preprocessing.")
+        self.pop_scores = rankings.aligned(rankings.decayed if decay else rankings.counts, self.item_index)
+        if segmented:
+            # Segment shares aligned to item_index, and the attribute codes of every known user
+            self.segment_shares = rankings.aligned(rankings.shares, self.item_index)
+            users = self.users.drop_duplicates('UserID').set_index('UserID').reindex(self.user_index)
+            self.user_segments = np.column_stack([
+                [codes.get(value, 0) for value in users[column]] for column, codes in zip(SEGMENT_COLUMNS, rankings.segment_codes)
+            ])
+    
+    def recommend(self, user_id, top_k=None, demographics=None):
+        # demographics: {column: value} of SEGMENT_COLUMNS (users.pkl encoding), used for users missing from the
+        # rating matrix when segmented
+        actual_used_top_k = top_k if top_k else self.top_k
+        if self.segmented and user_id not in self.user_index:
+            return self.popularity_rankings.for_segment(actual_used_top_k, demographics).tolist()
+        return self.recommend_batch([user_id], top_k=actual_used_top_k)[0].tolist()
+    
+    def _popular_items(self, top_k):
+        return self.popularity_rankings.top(top_k, 'recent' if self.decay else 'global')
+    
+    def _score_components(self, rows):
+        if not self.segmented:
+            return np.tile(self.pop_scores, (len(rows), 1))
+        averaging = self.popularity_rankings.segment_averaging(self.user_segments[rows])
+        scores = averaging @ self.segment_shares
+        # Users without demographics: their rows are 0, ranked by the overall popularity instead
+        scores[averaging.sum(axis=1) == 0] = self.pop_scores
+        return scores
+
+def normalize_scores(scores, candidates, method):
+    # Row-wise normalization over each row's candidate items; other items are left at -inf
+    if method == 'none':
+        normalized = scores.copy()
+    elif method == 'rank':
+        # Rank among the candidates, scaled to [0, 1] (best = 1)
+        masked = np.where(candidates, scores, -np.inf)
+        ranks = np.argsort(np.argsort(masked, axis=1, kind='stable'), axis=1) - (~candidates).sum(axis=1, keepdims=True)
+        normalized = ranks / np.maximum(candidates.sum(axis=1, keepdims=True) - 1, 1)
+    else:
+        masked = np.where(candidates, scores, np.nan)
+        with np.errstate(invalid='ignore'):
+            if method == 'minmax':
+                low = np.nanmin(masked, axis=1, keepdims=True)
+                spread = np.nanmax(masked, axis=1, keepdims=True) - low
+            else:
+                low = np.nanmean(masked, axis=1, keepdims=True)
+                spread = np.nanstd(masked, axis=1, keepdims=True)
+        spread[~(spread > 0)] = 1
+        normalized = np.nan_to_num(masked - low) / spread
+    normalized[~candidates] = -np.inf
+    return normalized
 
 # Hybrid Recommender
 class HybridRecommender(RecommenderBase):
-    def __init__(self, alpha=0.8, top_k=10, candidate_factor=5, eval_mode=False):
-        super().__init__(eval_mode=eval_mode)
+    # Weighted blend of N child recommenders on aligned score arrays.
+    # children: list of {"model": <MODEL_CLASSES name>, "weight": w, **constructor params};
+    # by default item-based CF (alpha) and content-based (1 - alpha).
+    # Candidates are the union of every child's top n_candidates unrated items; only those are blended.
+    SWEEP_PARAMS = ('alpha', 'top_k', 'candidate_factor', 'normalization')
+    # top_k also sets the number of candidates taken from every child
+    TOP_K_IS_LENGTH = False
+    
+    def __init__(self, alpha=0.8, top_k=10, candidate_factor=5, eval_mode=False, sparse=None, use_neighbor_index=None, use_ann_index=False,
+                 children=None, normalization='none', data_path=DATA_PATH):
+        super().__init__(data_path=data_path, eval_mode=eval_mode, sparse=sparse)
+        if normalization not in HYBRID_NORMALIZATIONS:
+            raise ValueError(f"Unknown normalization '{normalization}', expected one of {HYBRID_NORMALIZATIONS}.")
         self.alpha = alpha
         self.top_k = top_k
         self.candidate_factor = candidate_factor
         self.n_candidates = top_k * candidate_factor
-        self.item_cf = ItemBasedCFRecommender(eval_mode=eval_mode)
-        self.content_based = ContentBasedRecommender(eval_mode=eval_mode)
+        self.normalization = normalization
+        self.child_configs = children
+        
+        if children is None:
+            self.item_cf = ItemBasedCFRecommender(eval_mode=eval_mode, sparse=sparse, use_neighbor_index=use_neighbor_index, use_ann_index=use_ann_index,
+                                                  data_path=data_path)
+            self.content_based = ContentBasedRecommender(eval_mode=eval_mode, sparse=sparse, use_neighbor_index=use_neighbor_index, use_ann_index=use_ann_index,
+                                                         data_path=data_path)
+            self.children = [self.item_cf, self.content_based]
+            self.weights = np.array([alpha, 1 - alpha])
+        else:
+            self.children = []
+            for child in children:
+                params = {key: value for key, value in child.items() if key not in ('model', 'weight')}
+                params.setdefault('eval_mode', eval_mode)
+                params.setdefault('sparse', sparse)
+                params.setdefault('data_path', data_path)
+                self.children.append(MODEL_CLASSES[child['model']](**params))
+            self.weights = np.array([child.get('weight', 1.0) for child in children], dtype=np.float64)
     
-    def recommend(self, user_id):
-        if user_id not in self.user_item_matrix.index:
+    def recommend(self, user_id, child_scores=None):
+        if user_id not in self.user_index:
             # New User (Cold Start): Recommend most popular items
-            if self.popularity is not None:
-                return self.popularity.sort_values(by='NumRatings', ascending=False).head(self.top_k)['MovieID'].tolist()
-            else:
-                return []
-        # Get recommendation scores from both collaborative filtering and content-based
-        self.item_cf.recommend(user_id, top_k=self.n_candidates)
-        self.content_based.recommend(user_id, top_k=self.n_candidates)
-        
-        item_cf_scores = self.item_cf.get_scores()
-        content_scores = self.content_based.get_scores()
+            return self._popular_items(self.top_k).tolist()
         
-        combined_scores = {}
-        for item in set(item_cf_scores) | set(content_scores):
-            combined_scores[item] = (self.alpha * item_cf_scores.get(item, 0) + (1 - self.alpha) * content_scores.get(item, 0))
+        rated_items, _ = self._user_ratings(user_id)
+        if len(rated_items) == 0:
+            return self._popular_items(self.top_k).tolist()
+        rated = np.zeros((1, len(self.item_index)), dtype=bool)
+        rated[0, rated_items] = True
         
-        top_items = sorted(combined_scores, key=combined_scores.get, reverse=True)[:self.top_k]
-        return top_items
\ No newline at end of file
+        # Score arrays of the children, unless the caller already has them from identically configured recommenders
+        child_scores = child_scores or [None] * len(self.children)
+        with span(self.model_name, 'scoring'):
+            scores = [
+                (provided if provided is not None else child.user_scores(user_id))[None, :]
+                for child, provided in zip(self.children, child_scores)
+            ]
+        with span(self.model_name, 'blending'):
+            blended = self._combine_components(self._child_components(scores, rated), None)
+            self.score_vector = blended[0]
+        with span(self.model_name, 'top_k'):
+            return self.item_index.values[top_k_positions(blended, self.top_k)[0]].tolist()
+    
+    def with_params(self, **params):
+        variant = super().with_params(**params)
+        variant.n_candidates = variant.top_k * variant.candidate_factor
+        if variant.child_configs is None:
+            variant.weights = np.array([variant.alpha, 1 - variant.alpha])
+        return variant
+    
+    def _child_components(self, child_scores, rated):
+        # child_scores: one (n_rows, n_items) array per child
+        return {"masked_scores": [np.where(rated, -np.inf, np.nan_to_num(scores)) for scores in child_scores], "rated": rated}
+    
+    def _score_components(self, rows):
+        return self._child_components([child._score_block(rows) for child in self.children], self._rated_block(rows))
+    
+    def _candidates(self, components):
+        # Candidate columns of every row, ascending: each child's top n_candidates items, with a valid mask that drops
+        # rated items and repeats, and the normalized child scores on them. Kept in the components per
+        # (n_candidates, normalization), so variants differing only in alpha reuse them.
+        masked_scores, rated = components["masked_scores"], components["rated"]
+        n_candidates = min(self.n_candidates, rated.shape[1])
+        key = (n_candidates, self.normalization)
+        if key not in components:
+            columns = np.sort(np.hstack([
+                np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates] for scores in masked_scores
+            ]), axis=1)
+            valid = ~np.take_along_axis(rated, columns, axis=1)
+            valid[:, 1:] &= columns[:, 1:] != columns[:, :-1]
+            normalized = [
+                normalize_scores(np.where(valid, np.take_along_axis(scores, columns, axis=1), 0), valid, self.normalization)
+                for scores in masked_scores
+            ]
+            components[key] = (columns, valid, normalized)
+        return components[key]
+    
+    def _blend_candidates(self, components):
+        columns, valid, normalized = self._candidates(components)
+        blended = np.zeros(columns.shape)
+        for weight, scores in zip(self.weights, normalized):
+            blended += weight * np.where(valid, scores, 0)
+        blended[~valid] = -np.inf
+        return columns, valid, blended
+    
+    def _combine_components(self, components, rows):
+        # Blended candidate scores scattered into full rows; every other item is -inf
+        columns, valid, blended = self._blend_candidates(components)
+        scores = np.full(components["rated"].shape, -np.inf)
+        scores[np.nonzero(valid)[0], columns[valid]] = blended[valid]
+        return scores
+    
+    def _top_k_from_components(self, components, rows, rated, top_k):
+        # Ranked on the candidate columns only
+        columns, _, blended = self._blend_candidates(components)
+        return np.take_along_axis(columns, top_k_positions(blended, top_k), axis=1)
+
+# Recommender classes by the names used in evaluation_config.json
+MODEL_CLASSES = {
+    "HybridRecommender": HybridRecommender,
+    "UserBasedCFRecommender": UserBasedCFRecommender,
+    "ItemBasedCFRecommender": ItemBasedCFRecommender,
+    "ContentBasedRecommender": ContentBasedRecommender,
+    "MatrixFactorizationRecommender": MatrixFactorizationRecommender,
+    "PopularityRecommender": PopularityRecommender
+}
\ No newline at end of file
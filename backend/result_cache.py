@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ResultCache:
+    # Bounded LRU cache with a time-to-live, shared by the request threads.
+    # Keys include the store's data_version, so ingested ratings make older entries unreachable;
+    # those are dropped as soon as a newer version is seen instead of waiting for LRU eviction.
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._data_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, data_version):
+        with self._lock:
+            self._check_version(data_version)
+            entry = self._entries.get((key, data_version))
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[(key, data_version)]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end((key, data_version))
+            self.hits += 1
+            return value
+
+    def put(self, key, data_version, value):
+        with self._lock:
+            self._check_version(data_version)
+            # A result computed against an older version is not stored
+            if data_version != self._data_version:
+                return
+            self._entries[(key, data_version)] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end((key, data_version))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def _check_version(self, data_version):
+        if self._data_version is None or data_version > self._data_version:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._data_version = data_version
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "data_version": self._data_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
@@ -0,0 +1,139 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+try:
+    from backend.matrix_store import STORE_DIRNAME
+    from backend.preprocessing_pipeline import file_hash
+    from backend.ingestion import INGESTED_RATINGS_FILE
+except ImportError:
+    from matrix_store import STORE_DIRNAME
+    from preprocessing_pipeline import file_hash
+    from ingestion import INGESTED_RATINGS_FILE
+
+# Immutable copies of the processed artifacts live in <snapshot root>/<version>/, next to the processed directory
+# by default; CURRENT names the version services should serve
+SNAPSHOTS_DIRNAME = 'snapshots'
+SNAPSHOT_MANIFEST = 'snapshot.json'
+CURRENT_FILE = 'CURRENT'
+
+# Published snapshots kept besides the current one; older ones are deleted when a new one is published
+KEEP_SNAPSHOTS = 3
+
+def snapshot_root(data_path):
+    return Path(os.environ.get('RECOMMENDER_SNAPSHOT_ROOT', Path(data_path).parent / SNAPSHOTS_DIRNAME))
+
+def _snapshot_files(data_path):
+    # Every artifact of the processed directory, except the ingestion log (it keeps growing between runs and is
+    # read from the processed directory) and partially written files
+    data_path = Path(data_path)
+    for path in sorted(data_path.rglob('*')):
+        if path.is_file() and path.name != INGESTED_RATINGS_FILE and not path.name.endswith('.tmp'):
+            yield path.relative_to(data_path)
+
+def _place(source, target):
+    # Matrix store files are only ever replaced by rename (see _write_atomic), never rewritten in place, so the
+    # snapshot can share them through hard links. Other artifacts (pickles, manifests) are overwritten in place
+    # by the next preprocessing run and are copied.
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if source.parts[-2] == STORE_DIRNAME:
+        try:
+            os.link(source, target)
+            return
+        except OSError:
+            pass
+    shutil.copy2(source, target)
+
+def current_version(root):
+    current_file = Path(root) / CURRENT_FILE
+    return current_file.read_text().strip() if current_file.exists() else None
+
+def _set_current(root, version):
+    tmp_file = Path(root) / f'{CURRENT_FILE}.tmp'
+    tmp_file.write_text(version)
+    os.replace(tmp_file, Path(root) / CURRENT_FILE)
+
+def read_manifest(snapshot_path):
+    return json.loads((Path(snapshot_path) / SNAPSHOT_MANIFEST).read_text())
+
+def publish_snapshot(data_path, root=None, keep=KEEP_SNAPSHOTS):
+    # Publishes the processed directory as a new snapshot and makes it current; returns its version.
+    # The snapshot is assembled in a temporary directory and renamed into place, so a published version is always
+    # complete. Nothing is published when the artifacts equal those of the current snapshot.
+    data_path = Path(data_path)
+    root = Path(root) if root is not None else snapshot_root(data_path)
+    root.mkdir(parents=True, exist_ok=True)
+
+    files = {str(path): {"sha256": file_hash(data_path / path), "size": (data_path / path).stat().st_size}
+             for path in _snapshot_files(data_path)}
+    digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()
+    current = current_version(root)
+    if current is not None and (root / current).exists() and read_manifest(root / current)["digest"] == digest:
+        return current
+
+    version = f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{digest[:8]}"
+    tmp_path = root / f'.{version}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    for path in files:
+        _place(data_path / path, tmp_path / path)
+    manifest = {"version": version, "created": time.time(), "digest": digest, "files": files}
+    (tmp_path / SNAPSHOT_MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp_path, root / version)
+    _set_current(root, version)
+
+    # Processes still serving a deleted snapshot keep their open mappings until they reload
+    versions = sorted(path.name for path in root.iterdir() if path.is_dir() and not path.name.startswith('.'))
+    for old_version in versions[:-(keep + 1)]:
+        if old_version != version:
+            shutil.rmtree(root / old_version, ignore_errors=True)
+    return version
+
+def verify_snapshot(snapshot_path, checksums=True):
+    # Raises ValueError when a file listed in the manifest is missing, has another size or (with checksums) other content
+    snapshot_path = Path(snapshot_path)
+    problems = []
+    for path, expected in read_manifest(snapshot_path)["files"].items():
+        file_path = snapshot_path / path
+        if not file_path.exists():
+            problems.append(f"{path}: missing")
+        elif file_path.stat().st_size != expected["size"]:
+            problems.append(f"{path}: size {file_path.stat().st_size}, expected {expected['size']}")
+        elif checksums and file_hash(file_path) != expected["sha256"]:
+            problems.append(f"{path}: checksum mismatch")
+    if problems:
+        raise ValueError(f"Snapshot '{snapshot_path.name}' is corrupt: {'; '.join(problems)}")
+
+def resolve_snapshot(root, version=None):
+    # (path, version) of the requested snapshot, the current one by default; (None, None) when none was published
+    version = version or current_version(root)
+    if version is None:
+        return None, None
+    snapshot_path = Path(root) / version
+    if not (snapshot_path / SNAPSHOT_MANIFEST).exists():
+        raise ValueError(f"Unknown snapshot '{version}'.")
+    return snapshot_path, version
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Publish, list or verify versioned snapshots of the processed artifacts.")
+    parser.add_argument('command', choices=['publish', 'list', 'verify'])
+    parser.add_argument('--data-path', default='../data/processed')
+    parser.add_argument('--version', default=None, help="Snapshot to verify (the current one by default).")
+    args = parser.parse_args()
+
+    root = snapshot_root(args.data_path)
+    if args.command == 'publish':
+        print(f"Snapshots: '{publish_snapshot(args.data_path, root)}' is current.")
+    elif args.command == 'list':
+        current = current_version(root)
+        for path in sorted(root.glob(f'*/{SNAPSHOT_MANIFEST}')):
+            print(f"{path.parent.name}{' (current)' if path.parent.name == current else ''}")
+    else:
+        snapshot_path, version = resolve_snapshot(root, args.version)
+        if snapshot_path is None:
+            raise SystemExit("Snapshots: nothing published yet.")
+        verify_snapshot(snapshot_path)
+        print(f"Snapshots: '{version}' verified successfully.")
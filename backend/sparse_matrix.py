@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+def ratings_to_csr(ratings, user_col='UserID', item_col='MovieID', value_col='Rating'):
+    # Long-format ratings straight to CSR, rows/columns ordered like ratings.pivot(...)
+    user_ids, user_codes = np.unique(ratings[user_col].values, return_inverse=True)
+    item_ids, item_codes = np.unique(ratings[item_col].values, return_inverse=True)
+
+    matrix = sp.csr_matrix(
+        (ratings[value_col].values.astype(np.float64), (user_codes, item_codes)),
+        shape=(len(user_ids), len(item_ids))
+    )
+    matrix.sum_duplicates()
+    matrix.sort_indices()
+    return matrix, pd.Index(user_ids, name=user_col), pd.Index(item_ids, name=item_col)
+
+def frame_to_csr(df):
+    # Dense zero-filled DataFrame (e.g. a train split) to CSR plus its ID indexes
+    matrix = sp.csr_matrix(np.nan_to_num(df.values))
+    matrix.sort_indices()
+    return matrix, df.index, df.columns
+
+def csr_row(matrix, row):
+    # Column positions and values of one CSR row, as zero-copy slices
+    start, end = matrix.indptr[row], matrix.indptr[row + 1]
+    return matrix.indices[start:end], matrix.data[start:end]
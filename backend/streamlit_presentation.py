@@ -1,12 +1,38 @@
 import streamlit as st
+import contextlib
 import json
+import threading
 import pandas as pd
 import numpy as np
-from recommenders import UserBasedCFRecommender, ItemBasedCFRecommender, ContentBasedRecommender, HybridRecommender
-from evaluation_methods import precision_recall_f1_hit, run_evaluation_pipeline
+from recommenders import MODEL_CLASSES
+from evaluation_methods import run_evaluation_pipeline
+from matrix_store import get_store
+from precomputed_recommendations import PrecomputedRecommendations
 
-movies = pd.read_pickle('../data/processed/movies.pkl').set_index('MovieID')
-users = pd.read_pickle('../data/processed/users.pkl')["UserID"].tolist()
+# Streamlit reruns this script on every widget change: everything loaded from disk is cached per server process
+@st.cache_resource
+def load_metadata():
+    movies = pd.read_pickle('../data/processed/movies.pkl').set_index('MovieID')
+    users = pd.read_pickle('../data/processed/users.pkl')["UserID"].tolist()
+    return movies, users, PrecomputedRecommendations('../data/processed')
+
+@st.cache_resource
+def load_recommender(model_name, params):
+    # One recommender per configuration, shared by every session; recommenders keep per-call state,
+    # so sessions take turns through the lock
+    return MODEL_CLASSES[model_name](**params), threading.Lock()
+
+movies, users, precomputed = load_metadata()
+
+def get_recommendations(model_name, params, user_id, use_precomputed=True):
+    # O(1) lookup in the precomputed tables; live scoring for users or parameters they don't cover
+    if use_precomputed:
+        recommendations = precomputed.lookup(model_name, params, user_id, params["top_k"])
+        if recommendations is not None:
+            return recommendations
+    model, lock = load_recommender(model_name, params)
+    with lock:
+        return model.recommend(user_id)
 
 st.title("MovieLens Recommender System")
 
@@ -32,17 +58,17 @@ if mode == 'User-Recommendation Mode':
     "</p>".format(min(users), max(users)),
     unsafe_allow_html=True
     )
-
+    use_precomputed = st.checkbox("Serve precomputed recommendations when available?", value=True)
     
     if recommender_type == "User-Based Collaborative Filtering":
         top_k = st.slider("Select number of recommendations (top_k):", min_value=1, max_value=20, value=10)
         alpha = st.slider("Select alpha value for optional popularity hybridization recommendation:", min_value=0.0, max_value=1.0, value=0.0)
-        recommender = UserBasedCFRecommender(top_k=top_k, alpha=alpha, eval_mode=False)
+        model_name, params = "UserBasedCFRecommender", {"top_k": top_k, "alpha": alpha, "eval_mode": False}
         
         if st.button("Get Recommendations"):
             try:
                 with st.spinner('Loading...'):
-                    recommendations = recommender.recommend(user_id)
+                    recommendations = get_recommendations(model_name, params, user_id, use_precomputed)
                     recs_detailed = []
                     for ind, mid in enumerate(recommendations):
                         recs_detailed.append({"Rank": ind+1, "Movie Title": movies.loc[mid]["Title"]})
@@ -54,12 +80,12 @@ if mode == 'User-Recommendation Mode':
     elif recommender_type == "Item-Based Collaborative Filtering":
         top_k = st.slider("Select number of recommendations (top_k):", min_value=1, max_value=20, value=10)
         adjusted = st.checkbox("Use Adjusted Cosine Similarity?", value=False)
-        recommender = ItemBasedCFRecommender(adjusted=adjusted, top_k=top_k, eval_mode=False)
+        model_name, params = "ItemBasedCFRecommender", {"adjusted": adjusted, "top_k": top_k, "eval_mode": False}
         
         if st.button("Get Recommendations"):
             try:
                 with st.spinner('Loading...'):
-                    recommendations = recommender.recommend(user_id)
+                    recommendations = get_recommendations(model_name, params, user_id, use_precomputed)
                     recs_detailed = []
                     for ind, mid in enumerate(recommendations):
                         recs_detailed.append({"Rank": ind+1, "Movie Title": movies.loc[mid]["Title"]})
@@ -71,12 +97,12 @@ if mode == 'User-Recommendation Mode':
     elif recommender_type == "Content-Based Filtering":
         top_k = st.slider("Select number of recommendations (top_k):", min_value=1, max_value=20, value=10)
         use_tfidf = st.checkbox("Use TF-IDF for content similarity?", value=False)
-        recommender = ContentBasedRecommender(use_tfidf=use_tfidf, top_k=top_k, eval_mode=False)
+        model_name, params = "ContentBasedRecommender", {"use_tfidf": use_tfidf, "top_k": top_k, "eval_mode": False}
         
         if st.button("Get Recommendations"):
             try:
                 with st.spinner('Loading...'):
-                    recommendations = recommender.recommend(user_id)
+                    recommendations = get_recommendations(model_name, params, user_id, use_precomputed)
                     recs_detailed = []
                     for ind, mid in enumerate(recommendations):
                         recs_detailed.append({"Rank": ind+1, "Movie Title": movies.loc[mid]["Title"]})
@@ -89,12 +115,12 @@ if mode == 'User-Recommendation Mode':
         top_k = st.slider("Select number of recommendations (top_k):", min_value=1, max_value=20, value=10)
         alpha = st.slider("Select alpha value for hybrid recommendation:", min_value=0.0, max_value=1.0, value=0.8)
         candidate_factor = st.slider("Select candidate factor:", min_value=1, max_value=10, value=5)
-        recommender = HybridRecommender(alpha=alpha, top_k=top_k, candidate_factor=candidate_factor, eval_mode=False)
+        model_name, params = "HybridRecommender", {"alpha": alpha, "top_k": top_k, "candidate_factor": candidate_factor, "eval_mode": False}
         
         if st.button("Get Recommendations"):
             try:
                 with st.spinner('Loading...'):
-                    recommendations = recommender.recommend(user_id)
+                    recommendations = get_recommendations(model_name, params, user_id, use_precomputed)
                     recs_detailed = []
                     for ind, mid in enumerate(recommendations):
                         recs_detailed.append({"Rank": ind+1, "Movie Title": movies.loc[mid]["Title"]})
@@ -104,13 +130,6 @@ if mode == 'User-Recommendation Mode':
             except:
                 st.error("An error occurred while generating recommendations. Please check the User ID and try again.")
 elif mode == 'Recommender Evaluation Mode':
-    MODEL_CLASSES = {
-    "HybridRecommender": HybridRecommender,
-    "UserBasedCFRecommender": UserBasedCFRecommender,
-    "ItemBasedCFRecommender": ItemBasedCFRecommender,
-    "ContentBasedRecommender": ContentBasedRecommender
-    }
-    
     config_check = st.checkbox("Please confirm that configurations for evaluation are set in the backend/evaluation_config.json file.", value=False)
     if config_check:
         data_preprocessing_check = st.checkbox("Please confirm that data preprocessing has been completed for evaluation purpose.", value=False)
@@ -124,25 +143,38 @@ elif mode == 'Recommender Evaluation Mode':
                     TOP_K = config["TOP_K"]
                     TEST_RATIO = config["TEST_RATIO"]
                     RANDOM_SEED = config["RANDOM_SEED"]
+                    BOOTSTRAP_RESAMPLES = config.get("BOOTSTRAP_RESAMPLES", 0)
                     model_configs = config["MODELS"]
 
                     models = {}
+                    locks = []
                     for model_name, params in model_configs.items():
                         model_class = MODEL_CLASSES.get(model_name)
                         if model_class:
-                            models[model_name] = model_class(**params)
+                            models[model_name], lock = load_recommender(model_name, params)
+                            locks.append(lock)
                         else:
                             raise ValueError(f"Unknown model class: {model_name}")
                     
-                    user_item_matrix = pd.read_pickle('../data/processed/user_item_matrix.pkl')
+                    user_item_matrix = get_store('../data/processed').load_sparse_or_dense('user_item_csr', 'user_item_matrix')
                     
-                    results_df = run_evaluation_pipeline(
-                        user_item_matrix=user_item_matrix,
-                        models=models,
-                        top_k=TOP_K,
-                        test_ratio=TEST_RATIO,
-                        random_seed=RANDOM_SEED
-                    )
+                    # The recommenders are the cached ones the recommendation sessions use: their locks are held
+                    # for the whole run, so no session calls recommend() on them meanwhile
+                    with contextlib.ExitStack() as held_locks:
+                        for lock in locks:
+                            held_locks.enter_context(lock)
+                        results_df = run_evaluation_pipeline(
+                            user_item_matrix=user_item_matrix,
+                            models=models,
+                            top_k=TOP_K,
+                            test_ratio=TEST_RATIO,
+                            random_seed=RANDOM_SEED,
+                            # Serial: forking worker processes from the multithreaded Streamlit server is unsafe, N_JOBS
+                            # only applies to python evaluation_pipeline.py
+                            n_jobs=1,
+                            data_path='../data/processed',
+                            n_bootstrap=BOOTSTRAP_RESAMPLES
+                        )
                     
                 st.success('Evaluation Completed!')
                 st.dataframe(results_df, hide_index=True)
\ No newline at end of file
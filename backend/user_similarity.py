@@ -0,0 +1,105 @@
+import numpy as np
+import scipy.sparse as sp
+
+try:
+    from backend.matrix_store import save_matrix_blocks, save_neighbor_index
+    from backend.neighbor_index import top_n_block, DEFAULT_TOP_N
+except ImportError:
+    from matrix_store import save_matrix_blocks, save_neighbor_index
+    from neighbor_index import top_n_block, DEFAULT_TOP_N
+
+# Users per row block; capped so each float32 (block x users) product holds at most BLOCK_ELEMENTS values
+USER_SIMILARITY_BLOCK_SIZE = 1024
+BLOCK_ELEMENTS = 1 << 26
+
+# Significance threshold: pairs of users with fewer co-rated items get no similarity (NaN)
+DEFAULT_MIN_CO_RATED = 5
+
+# Operands are densified for BLAS matrix products up to this size in bytes, larger ones are multiplied as CSR
+DENSE_OPERAND_LIMIT = 1 << 31
+
+def user_means(ratings):
+    # Mean rating of every user over the items they rated (0 for users without ratings)
+    ratings = sp.csr_matrix(ratings)
+    counts = np.diff(ratings.indptr)
+    sums = np.asarray(ratings.sum(axis=1)).ravel()
+    return np.divide(sums, counts, out=np.zeros(len(counts)), where=counts > 0)
+
+def _operands(ratings, dense):
+    # Ratings centered by each user's mean (unrated items stay 0), their squares and the rated mask, in float32
+    ratings = sp.csr_matrix(ratings, dtype=np.float64, copy=True)
+    ratings.eliminate_zeros()
+    centered = ratings.data - np.repeat(user_means(ratings), np.diff(ratings.indptr))
+    operands = []
+    for data in (centered, centered ** 2, np.ones_like(centered)):
+        operand = sp.csr_matrix((data.astype(np.float32), ratings.indices, ratings.indptr), shape=ratings.shape)
+        operands.append(operand.toarray() if dense else operand)
+    return operands
+
+def _gram(left, right):
+    product = left @ right.T
+    return product.toarray() if sp.issparse(product) else product
+
+def similarity_blocks(ratings, min_co_rated=DEFAULT_MIN_CO_RATED, block_size=None):
+    # Mean-centered similarity of every pair of users over the items both rated, in float32 row blocks:
+    # yields (start_row, block) with block[a, v] the similarity of user start_row + a and user v.
+    # Each user is centered by the mean of all their ratings; the sums of squares only run over the co-rated items.
+    # Pairs with fewer than min_co_rated co-rated items, or without variation over them, are NaN.
+    n_users, n_items = ratings.shape
+    dense = n_users * n_items * 4 <= DENSE_OPERAND_LIMIT
+    centered, squares, rated = _operands(ratings, dense)
+    block_size = block_size or max(1, min(USER_SIMILARITY_BLOCK_SIZE, BLOCK_ELEMENTS // n_users))
+
+    for start in range(0, n_users, block_size):
+        end = min(start + block_size, n_users)
+        numerator = _gram(centered[start:end], centered)
+        norms = _gram(squares[start:end], rated)
+        norms *= _gram(rated[start:end], squares)
+        np.sqrt(norms, out=norms)
+        block = np.divide(numerator, norms, out=np.full_like(numerator, np.nan), where=norms > 0)
+        np.clip(block, -1, 1, out=block)
+        if min_co_rated > 1:
+            block[_gram(rated[start:end], rated) < min_co_rated] = np.nan
+        yield start, block
+
+def similarity_row(ratings, means, row, min_co_rated=DEFAULT_MIN_CO_RATED):
+    # Similarity of one user against every user, as computed by similarity_blocks, from the dense (users x items)
+    # ratings and every user's mean. Only the columns the user rated are read, so it is cheap enough to recompute
+    # after each change of that user's ratings.
+    items = np.flatnonzero(ratings[row])
+    rated = ratings[:, items] != 0
+    centered = np.where(rated, ratings[:, items] - means[:, None], 0)
+    own_centered = centered[row]
+
+    numerator = centered @ own_centered
+    norms = np.sqrt((rated @ own_centered ** 2) * np.einsum('ij,ij->i', centered, centered))
+    similarity = np.divide(numerator, norms, out=np.full(len(numerator), np.nan), where=norms > 0)
+    np.clip(similarity, -1, 1, out=similarity)
+    if min_co_rated > 1:
+        similarity[rated.sum(axis=1) < min_co_rated] = np.nan
+    return similarity
+
+def save_user_similarity(ratings, user_index, data_path, name=None, topn_name=None, min_co_rated=DEFAULT_MIN_CO_RATED,
+                         top_n=DEFAULT_TOP_N, precision=None):
+    # One pass over the similarity blocks: the full matrix is written block by block to a memory-mapped file
+    # (when name is given) and/or only the top_n neighbors of every user are kept (when topn_name is given),
+    # so neither the matrix nor its products ever have to fit in memory.
+    n_users = ratings.shape[0]
+    top_n = min(top_n, n_users - 1)
+    indices = np.empty((n_users, top_n), dtype=np.int32)
+    scores = np.empty((n_users, top_n), dtype=np.float32)
+
+    def blocks():
+        for start, block in similarity_blocks(ratings, min_co_rated):
+            if topn_name:
+                indices[start:start + len(block)], scores[start:start + len(block)] = top_n_block(block, start, top_n)
+            yield start, block
+
+    if name:
+        save_matrix_blocks(blocks(), (n_users, n_users), user_index, user_index, data_path, name,
+                           precision=precision, meta={"min_co_rated": min_co_rated})
+    else:
+        for _ in blocks():
+            pass
+    if topn_name:
+        save_neighbor_index(indices, scores, user_index, data_path, topn_name)
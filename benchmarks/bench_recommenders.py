@@ -0,0 +1,64 @@
+# pytest-benchmark entry point: pytest benchmarks/bench_recommenders.py [--benchmark-json=report.json]
+# Scale and dataset directory come from BENCHMARK_SCALE (default 100k) and BENCHMARK_WORKDIR.
+# The API benchmark is defined first: the FastAPI app needs a store nothing has been loaded from yet.
+import errno
+import itertools
+import os
+import pytest
+import numpy as np
+from pathlib import Path
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmarks.run import default_workdir, use_dataset, prepare_dataset, build_pipeline
+
+SCALE = os.environ.get('BENCHMARK_SCALE', '100k')
+WORKDIR = Path(os.environ.get('BENCHMARK_WORKDIR', default_workdir(SCALE)))
+N_USERS = 50
+
+use_dataset(WORKDIR)
+
+from recommenders import MODEL_CLASSES
+
+@pytest.fixture(scope='session')
+def dataset():
+    WORKDIR.mkdir(parents=True, exist_ok=True)
+    try:
+        return prepare_dataset(WORKDIR, SCALE)
+    except (MemoryError, OSError) as e:
+        # Out of memory at this scale; mapping a matrix store file fails with ENOMEM instead of MemoryError
+        if isinstance(e, OSError) and e.errno != errno.ENOMEM:
+            raise
+        pytest.skip(f"Preprocessing the {SCALE} dataset does not fit in memory on this machine.")
+
+@pytest.fixture(scope='session')
+def users(dataset):
+    rng = np.random.default_rng(42)
+    return rng.integers(1, dataset["n_users"] + 1, N_USERS)
+
+def test_api_recommend(benchmark, users):
+    from fastapi.testclient import TestClient
+    from backend.fast_api import main
+
+    client = TestClient(main.app)
+    user_ids = itertools.cycle(users)
+    benchmark(lambda: client.get('/recommend', params={"user_id": int(next(user_ids))}).raise_for_status())
+
+def test_preprocessing(benchmark, dataset):
+    pipeline = build_pipeline(WORKDIR, SCALE)
+    benchmark.pedantic(pipeline.run, kwargs={"force": True}, rounds=1, iterations=1)
+
+@pytest.mark.parametrize('model_name', list(MODEL_CLASSES))
+def test_construct(benchmark, dataset, model_name):
+    benchmark(MODEL_CLASSES[model_name])
+
+@pytest.mark.parametrize('model_name', list(MODEL_CLASSES))
+def test_recommend(benchmark, users, model_name):
+    model = MODEL_CLASSES[model_name]()
+    user_ids = itertools.cycle(users)
+    benchmark(lambda: model.recommend(int(next(user_ids))))
+
+@pytest.mark.parametrize('model_name', list(MODEL_CLASSES))
+def test_recommend_batch(benchmark, users, model_name):
+    model = MODEL_CLASSES[model_name]()
+    benchmark(model.recommend_batch, users)
@@ -0,0 +1,224 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BACKEND_PATH = REPO_ROOT / 'backend'
+
+# Backend scripts import their siblings by bare name, the FastAPI app through the backend package
+for path in (str(REPO_ROOT), str(BACKEND_PATH)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from benchmarks.synthetic_data import SCALES, generate_dataset
+
+BENCHMARK_GROUPS = ('preprocessing', 'recommenders', 'api')
+
+# Scales preprocessed with the CSR backend (SPARSE_BACKEND in data_preprocessing.py): their dense (users x items)
+# and (items x items) matrices would not fit in memory
+SPARSE_SCALES = ('10m', '25m')
+
+def default_workdir(scale):
+    return Path(tempfile.gettempdir()) / f'recommender_benchmark_{scale}'
+
+def use_dataset(workdir):
+    # Must run before the recommenders are imported: their DATA_PATH is read at import time
+    os.environ['RECOMMENDER_DATA_PATH'] = str(Path(workdir) / 'processed')
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def summarize(name, durations, items=None):
+    durations = np.asarray(durations, dtype=np.float64)
+    items = items if items is not None else len(durations)
+    return {
+        "benchmark": name,
+        "n": len(durations),
+        "mean_ms": durations.mean() * 1000,
+        "p50_ms": np.percentile(durations, 50) * 1000,
+        "p95_ms": np.percentile(durations, 95) * 1000,
+        "p99_ms": np.percentile(durations, 99) * 1000,
+        "throughput_per_s": items / durations.sum() if durations.sum() > 0 else float('inf'),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def build_pipeline(workdir, scale, max_workers=1):
+    import data_preprocessing
+
+    # The stage functions read these module globals at call time
+    data_preprocessing.RAW_PATH = str(Path(workdir) / 'raw')
+    data_preprocessing.DATA_PATH = str(Path(workdir) / 'processed')
+    data_preprocessing.SPARSE_BACKEND = scale in SPARSE_SCALES
+    Path(data_preprocessing.DATA_PATH).mkdir(parents=True, exist_ok=True)
+    return data_preprocessing.build_pipeline(max_workers=max_workers)
+
+def prepare_dataset(workdir, scale, random_seed=42):
+    # Synthetic raw files (generated once per working directory) and their processed artifacts (skipped when up to date)
+    workdir = Path(workdir)
+    dataset_file = workdir / 'dataset.json'
+    if dataset_file.exists() and json.loads(dataset_file.read_text())["scale"] == scale:
+        dataset = json.loads(dataset_file.read_text())
+    else:
+        dataset = generate_dataset(workdir / 'raw', scale=scale, random_seed=random_seed)
+        dataset_file.write_text(json.dumps(dataset))
+    use_dataset(workdir)
+    with contextlib.redirect_stdout(sys.stderr):
+        build_pipeline(workdir, scale).run()
+    return dataset
+
+def bench_preprocessing(workdir, scale):
+    # Every stage rebuilt on one worker, so stage timings don't overlap
+    pipeline = build_pipeline(workdir, scale, max_workers=1)
+    durations = {}
+
+    def timed_stage(name, run):
+        def wrapper(*args):
+            value, durations[name] = timed(run, *args)
+            return value
+        return wrapper
+
+    for stage in pipeline.stages.values():
+        stage.run = timed_stage(stage.name, stage.run)
+    with contextlib.redirect_stdout(sys.stderr):
+        _, total = timed(pipeline.run, force=True)
+    results = [summarize(f'preprocessing/{name}', [duration]) for name, duration in durations.items()]
+    results.append(summarize('preprocessing/total', [total]))
+    return results
+
+def bench_recommenders(n_users, random_seed=42):
+    # Construction includes the first load of the shared matrices for the first recommender only
+    from recommenders import MODEL_CLASSES
+
+    rng = np.random.default_rng(random_seed)
+    results = []
+    for model_name, model_class in MODEL_CLASSES.items():
+        model, construction = timed(model_class)
+        results.append(summarize(f'construct/{model_name}', [construction]))
+
+        users = rng.choice(np.asarray(model.user_index), n_users)
+        durations = [timed(model.recommend, user_id)[1] for user_id in users]
+        results.append(summarize(f'recommend/{model_name}', durations))
+
+        _, batch_duration = timed(model.recommend_batch, users)
+        results.append(summarize(f'recommend_batch/{model_name}', [batch_duration], items=len(users)))
+    return results
+
+def bench_api(n_requests, random_seed=42):
+    # End to end through the FastAPI app, distinct users so the result cache does not answer
+    from fastapi.testclient import TestClient
+    from backend.fast_api import main
+
+    rng = np.random.default_rng(random_seed)
+    client = TestClient(main.app)
+    users = rng.permutation(main.serving.users)[:n_requests]
+    durations = []
+    for user_id in users:
+        response, duration = timed(client.get, '/recommend', params={"user_id": int(user_id)})
+        response.raise_for_status()
+        durations.append(duration)
+    return [summarize('api/recommend', durations)]
+
+def run_group(group, workdir, args):
+    # Each group runs in a fresh interpreter: peak RSS is per group and construction starts from a cold store.
+    # The FastAPI app also needs a store nothing has been loaded from yet (see RatingIngestor).
+    # Returns None when the worker failed (e.g. ran out of memory at this scale) instead of aborting the run.
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        output = Path(f.name)
+    command = [
+        sys.executable, '-m', 'benchmarks.run', '--group', group, '--scale', args.scale, '--workdir', str(workdir),
+        '--users', str(args.users), '--requests', str(args.requests), '--seed', str(args.seed), '--output', str(output)
+    ]
+    completed = subprocess.run(command, cwd=REPO_ROOT, stdout=sys.stderr)
+    results = json.loads(output.read_text()) if completed.returncode == 0 else None
+    output.unlink(missing_ok=True)
+    return results
+
+def skipped(group, reason):
+    # Report entry of a group that produced no results
+    return {"benchmark": group, "skipped": reason}
+
+def run_group_in_process(group, workdir, args):
+    if group == 'prepare':
+        return []
+    if group == 'preprocessing':
+        return bench_preprocessing(workdir, args.scale)
+    if group == 'recommenders':
+        return bench_recommenders(args.users, random_seed=args.seed)
+    return bench_api(args.requests, random_seed=args.seed)
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+def compare(report, baseline):
+    # p50 and throughput of this run relative to a previous report
+    baseline_results = {result["benchmark"]: result for result in baseline["results"]}
+    print(f"{'benchmark':<50} {'p50_ms':>10} {'baseline':>10} {'ratio':>7}")
+    for result in report["results"]:
+        previous = baseline_results.get(result["benchmark"])
+        if previous is None or "skipped" in result or "skipped" in previous:
+            continue
+        ratio = result["p50_ms"] / previous["p50_ms"] if previous["p50_ms"] > 0 else float('nan')
+        print(f"{result['benchmark']:<50} {result['p50_ms']:>10.3f} {previous['p50_ms']:>10.3f} {ratio:>7.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency, throughput and memory benchmarks on synthetic MovieLens-shaped data.")
+    parser.add_argument('--scale', choices=SCALES, default='100k')
+    parser.add_argument('--workdir', default=None, help="Directory for the synthetic dataset (reused across runs).")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARK_GROUPS, default=list(BENCHMARK_GROUPS))
+    parser.add_argument('--users', type=int, default=200, help="Users sampled for the recommend benchmarks.")
+    parser.add_argument('--requests', type=int, default=100, help="Requests sent to /recommend.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None, help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument('--compare', default=None, help="Previous JSON report to compare against.")
+    parser.add_argument('--group', choices=BENCHMARK_GROUPS + ('prepare',), default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir) if args.workdir else default_workdir(args.scale)
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    if args.group:
+        # Worker process of run_group
+        prepare_dataset(workdir, args.scale, random_seed=args.seed)
+        Path(args.output).write_text(json.dumps(run_group_in_process(args.group, workdir, args)))
+        sys.exit(0)
+
+    # The dataset is prepared in a worker as well, so a scale this machine cannot preprocess is reported as skipped
+    groups = [group for group in BENCHMARK_GROUPS if group in args.only]
+    if run_group('prepare', workdir, args) is None:
+        results = [skipped(group, f"preprocessing the {args.scale} dataset failed") for group in groups]
+    else:
+        results = []
+        for group in groups:
+            group_results = run_group(group, workdir, args)
+            results += group_results if group_results is not None else [skipped(group, "benchmark process failed")]
+
+    dataset_file = workdir / 'dataset.json'
+    dataset = json.loads(dataset_file.read_text()) if dataset_file.exists() else {"scale": args.scale}
+    report = {"dataset": dataset, "environment": environment(), "results": results}
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text()))
@@ -0,0 +1,85 @@
+import io
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# (users, movies, ratings) of the MovieLens releases the synthetic data imitates
+SCALES = {
+    '100k': (943, 1682, 100_000),
+    '1m': (6040, 3706, 1_000_209),
+    '10m': (69878, 10677, 10_000_054),
+    '25m': (162541, 59047, 25_000_095),
+}
+
+GENRES = [
+    "Action", "Adventure", "Animation", "Children's", "Comedy", "Crime", "Documentary", "Drama", "Fantasy",
+    "Film-Noir", "Horror", "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western"
+]
+
+# Every MovieLens user has at least 20 ratings (synthetic users may end up with slightly fewer distinct movies)
+MIN_USER_RATINGS = 20
+
+def _write_dat(df, path, encoding='utf-8'):
+    # MovieLens '::' separator: written tab-separated, then re-delimited
+    buffer = io.StringIO()
+    df.to_csv(buffer, sep='\t', header=False, index=False)
+    Path(path).write_bytes(buffer.getvalue().replace('\t', '::').encode(encoding))
+
+def generate_dataset(raw_path, scale='100k', random_seed=42):
+    # ratings.dat, movies.dat and users.dat in MovieLens format, with long-tailed user activity and item popularity
+    n_users, n_movies, n_ratings = SCALES[scale]
+    rng = np.random.default_rng(random_seed)
+    raw_path = Path(raw_path)
+    raw_path.mkdir(parents=True, exist_ok=True)
+
+    # Ratings per user: log-normal activity scaled to the target total, at least MIN_USER_RATINGS
+    activity = rng.lognormal(mean=0, sigma=1.2, size=n_users)
+    counts = MIN_USER_RATINGS + np.floor(activity / activity.sum() * (n_ratings - MIN_USER_RATINGS * n_users)).astype(np.int64)
+    counts = np.minimum(counts, n_movies)
+
+    # Movies drawn by Zipf-like popularity. Draws are oversampled, repeated (user, movie) pairs dropped,
+    # and each user keeps the first counts[user] distinct movies in draw order.
+    popularity = 1 / np.arange(1, n_movies + 1) ** 0.9
+    popularity = rng.permutation(popularity / popularity.sum())
+    draws = np.repeat(np.arange(n_users), 2 * counts)
+    draws = draws * n_movies + rng.choice(n_movies, size=len(draws), p=popularity)
+    pairs, first_draw = np.unique(draws, return_index=True)
+    pairs = pairs[np.argsort(first_draw, kind='stable')]
+    user_codes, movie_codes = pairs // n_movies, pairs % n_movies
+    order = np.argsort(user_codes, kind='stable')
+    user_codes, movie_codes = user_codes[order], movie_codes[order]
+    user_starts = np.searchsorted(user_codes, np.arange(n_users))
+    keep = np.arange(len(user_codes)) - user_starts[user_codes] < counts[user_codes]
+    user_codes, movie_codes = user_codes[keep], movie_codes[keep]
+    pairs = user_codes * n_movies + movie_codes
+
+    # Rating = global mean + user bias + movie bias + noise, rounded to the 1-5 star scale
+    user_bias = rng.normal(0, 0.4, n_users)
+    movie_bias = rng.normal(0, 0.6, n_movies)
+    stars = 3.6 + user_bias[user_codes] + movie_bias[movie_codes] + rng.normal(0, 0.8, len(pairs))
+    ratings = pd.DataFrame({
+        'UserID': user_codes + 1,
+        'MovieID': movie_codes + 1,
+        'Rating': np.clip(np.rint(stars), 1, 5).astype(np.int64),
+        'Timestamp': rng.integers(956703932, 1046454590, len(pairs))
+    })
+    _write_dat(ratings, raw_path / 'ratings.dat')
+
+    n_genres = rng.integers(1, 4, n_movies)
+    movies = pd.DataFrame({
+        'MovieID': np.arange(1, n_movies + 1),
+        'Title': [f"Synthetic Movie {i} ({year})" for i, year in zip(range(1, n_movies + 1), rng.integers(1919, 2001, n_movies))],
+        'Genres': ['|'.join(rng.choice(GENRES, n, replace=False)) for n in n_genres]
+    })
+    _write_dat(movies, raw_path / 'movies.dat', encoding='latin-1')
+
+    users = pd.DataFrame({
+        'UserID': np.arange(1, n_users + 1),
+        'Gender': rng.choice(['F', 'M'], n_users, p=[0.28, 0.72]),
+        'Age': rng.choice([1, 18, 25, 35, 45, 50, 56], n_users),
+        'Occupation': rng.integers(0, 21, n_users),
+        'Zip-code': rng.integers(10000, 99999, n_users)
+    })
+    _write_dat(users, raw_path / 'users.dat')
+
+    return {"scale": scale, "n_users": n_users, "n_movies": n_movies, "n_ratings": len(ratings)}
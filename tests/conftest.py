@@ -0,0 +1,29 @@
+# Shared fixtures: one small synthetic MovieLens-shaped dataset (see benchmarks/synthetic_data.py), generated and
+# preprocessed once per test session in a temporary directory
+import importlib
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import recommenders
+from backend.matrix_store import release_store
+from benchmarks.run import prepare_dataset
+
+TEST_SCALE = '100k'
+
+@pytest.fixture(scope='session')
+def data_path(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('dataset')
+    prepare_dataset(workdir, TEST_SCALE)
+    return workdir / 'processed'
+
+@pytest.fixture(scope='session')
+def api(data_path):
+    # The FastAPI module, serving data_path. It loads DATA_PATH when imported (use_dataset only helps before
+    # recommenders is imported), and its ingestor needs a fresh store to map the matrices copy-on-write.
+    recommenders.DATA_PATH = data_path
+    release_store(data_path)
+    return importlib.import_module('backend.fast_api.main')
+
+@pytest.fixture(scope='session')
+def client(api):
+    return TestClient(api.app)
@@ -0,0 +1,17 @@
+from backend.precomputed_recommendations import PrecomputedRecommendations, precompute_table
+
+def test_precomputed_lists_match_live_lists(api, client, data_path, monkeypatch):
+    # A user's list must not depend on whether it comes from a precomputed table or is scored live (table missing,
+    # stale after an ingest, or bypassed), ContentBased's many one-hot ties included
+    state = api.serving
+    for name, params in api.model_params.items():
+        precompute_table(type(state.models[name]).__name__, params, data_path=data_path)
+    monkeypatch.setattr(state, 'precomputed', PrecomputedRecommendations(data_path))
+    user_ids = [int(user_id) for user_id in state.user_index[:100]]
+
+    assert all(api.precomputed_recommendations(state, name, user_ids[0]) is not None for name in api.model_params)
+    precomputed = [client.get('/recommend', params={"user_id": user_id}).json()["Recommendations"] for user_id in user_ids]
+
+    monkeypatch.setattr(api, 'USE_PRECOMPUTED', False)
+    live = [client.get('/recommend', params={"user_id": user_id}).json()["Recommendations"] for user_id in user_ids]
+    assert precomputed == live
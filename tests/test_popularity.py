@@ -0,0 +1,32 @@
+import pytest
+
+from backend.matrix_store import MatrixStore
+from backend.popularity import PopularityRankings
+
+@pytest.fixture(scope='module')
+def rankings(data_path):
+    return PopularityRankings.load(MatrixStore(data_path), 'popularity_rankings')
+
+@pytest.mark.parametrize('top_k', [0, -3])
+def test_rankings_reject_top_k_below_one(rankings, top_k):
+    # A negative slice would return the ranking minus its last items instead of an error
+    with pytest.raises(ValueError):
+        rankings.top(top_k)
+    with pytest.raises(ValueError):
+        rankings.top(top_k, 'recent')
+    with pytest.raises(ValueError):
+        rankings.for_segment(top_k, {'Gender': 1})
+
+def test_rankings_lists_have_top_k_items(rankings):
+    assert len(rankings.top(7)) == 7
+    assert len(rankings.for_segment(7, {'Gender': 1})) == 7
+
+@pytest.mark.parametrize('top_k', [0, -3])
+def test_popular_endpoint_rejects_top_k_below_one(client, top_k):
+    assert client.get('/popular', params={"top_k": top_k}).status_code == 422
+
+def test_popular_endpoint_lists_top_k_items(client):
+    for kind in ('global', 'recent', 'segment'):
+        response = client.get('/popular', params={"kind": kind, "top_k": 7, "gender": 'M'})
+        assert response.status_code == 200
+        assert len(response.json()["Recommendations"]) == 7
@@ -0,0 +1,45 @@
+import pytest
+
+from backend.precomputed_recommendations import PrecomputedRecommendations, precompute_table, table_name
+from backend.recommenders import UserBasedCFRecommender, ContentBasedRecommender
+
+def test_tables_keyed_by_top_k_only_when_it_changes_the_scores():
+    assert table_name('UserBasedCFRecommender', {"top_k": 5}) != table_name('UserBasedCFRecommender', {"top_k": 10})
+    assert table_name('HybridRecommender', {"top_k": 5}) != table_name('HybridRecommender', {"top_k": 10})
+    assert table_name('ItemBasedCFRecommender', {"top_k": 5}) == table_name('ItemBasedCFRecommender', {"top_k": 10})
+
+@pytest.mark.parametrize('top_k', [5, 15])
+def test_user_cf_table_matches_live_recommendations(data_path, top_k):
+    # top_k is also the number of neighbors: the table must be built with it, not with the default 10
+    params = {"top_k": top_k}
+    precompute_table('UserBasedCFRecommender', params, data_path=data_path)
+    precomputed = PrecomputedRecommendations(data_path)
+    model = UserBasedCFRecommender(data_path=data_path, **params)
+
+    for user_id in model.user_index:
+        assert precomputed.lookup('UserBasedCFRecommender', params, int(user_id), top_k) == model.recommend(user_id)
+    assert precomputed.lookup('UserBasedCFRecommender', {"top_k": top_k + 1}, int(model.user_index[0]), top_k) is None
+
+@pytest.mark.parametrize('params', [{}, {"use_tfidf": True}, {"rating_weighted": True}])
+def test_content_based_table_matches_live_recommendations(data_path, params):
+    # One-hot content similarities have many exact ties: the batch scoring behind the table must break them like
+    # recommend does
+    precompute_table('ContentBasedRecommender', params, data_path=data_path)
+    precomputed = PrecomputedRecommendations(data_path)
+    model = ContentBasedRecommender(data_path=data_path, **params)
+
+    for user_id in model.user_index:
+        assert precomputed.lookup('ContentBasedRecommender', params, int(user_id), 10) == model.recommend(user_id)
+
+def test_ann_configurations_are_not_precomputed(data_path):
+    with pytest.raises(ValueError):
+        precompute_table('ContentBasedRecommender', {"use_ann_index": True}, data_path=data_path)
+    with pytest.raises(ValueError):
+        precompute_table('HybridRecommender', {"children": [{"model": "ItemBasedCFRecommender", "use_ann_index": True}]}, data_path=data_path)
+
+    # Lookups of ANN configurations fall through to live scoring
+    precompute_table('ItemBasedCFRecommender', {}, data_path=data_path)
+    precomputed = PrecomputedRecommendations(data_path)
+    user_id = int(ContentBasedRecommender(data_path=data_path).user_index[0])
+    assert precomputed.lookup('ItemBasedCFRecommender', {}, user_id, 10) is not None
+    assert precomputed.lookup('ItemBasedCFRecommender', {"use_ann_index": True}, user_id, 10) is None
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+from backend.ranking_metrics import recommendation_positions, per_user_metrics, summarize
+
+ITEM_IDS = pd.Index([10, 20, 30, 40, 50])
+# Training ratings per item and number of training users, for novelty and popularity
+ITEM_COUNTS = np.array([5, 4, 3, 2, 1])
+N_TRAIN_USERS = 10
+K = 3
+
+@pytest.fixture
+def positions():
+    # The last list is short and recommends a MovieID missing from ITEM_IDS: both are padded with -1
+    return recommendation_positions([[10, 20, 30], [50, 99], [10, 20, 30]], ITEM_IDS, K)
+
+@pytest.fixture
+def test_csr():
+    # Held-out items: 20 and 40 for the first user, 50 for the second, none for the third
+    return sp.csr_matrix(([4.0, 5.0, 3.0], ([0, 0, 1], [1, 3, 4])), shape=(3, len(ITEM_IDS)))
+
+def test_recommendation_positions(positions):
+    assert positions.tolist() == [[0, 1, 2], [4, -1, -1], [0, 1, 2]]
+    batch = recommendation_positions(np.array([[10, 20, 30, 40]]), ITEM_IDS, K)
+    assert batch.tolist() == [[0, 1, 2]]
+
+def test_per_user_metrics(positions, test_csr):
+    metrics = per_user_metrics(positions, test_csr, ITEM_COUNTS, N_TRAIN_USERS, K)
+
+    # One hit at rank 2 out of two held-out items
+    first = metrics.iloc[0]
+    assert first["Precision"] == pytest.approx(1 / 3)
+    assert first["Recall"] == pytest.approx(1 / 2)
+    assert first["F1-Score"] == pytest.approx(0.4)
+    assert first["Hit"] == 1
+    assert first["NDCG"] == pytest.approx((1 / np.log2(3)) / (1 + 1 / np.log2(3)))
+    assert first["AP"] == pytest.approx(0.25)
+    assert first["RR"] == pytest.approx(0.5)
+    assert first["Popularity"] == pytest.approx(4)
+
+    # One hit at rank 1 out of one held-out item; the padding is left out of popularity and novelty
+    second = metrics.iloc[1]
+    assert second["Precision"] == pytest.approx(1 / 3)
+    assert second[["Recall", "Hit", "NDCG", "AP", "RR"]].tolist() == pytest.approx([1, 1, 1, 1, 1])
+    assert second["Popularity"] == pytest.approx(1)
+    assert second["Novelty"] == pytest.approx(np.log2(N_TRAIN_USERS))
+
+    # No held-out items: every accuracy metric is 0
+    third = metrics.iloc[2]
+    assert third[["Precision", "Recall", "F1-Score", "Hit", "NDCG", "AP", "RR"]].tolist() == [0] * 7
+
+def test_summarize(positions, test_csr):
+    metrics = per_user_metrics(positions, test_csr, ITEM_COUNTS, N_TRAIN_USERS, K)
+    summary = summarize(metrics, positions, len(ITEM_IDS), n_resamples=200)
+
+    assert summary["User Coverage"] == pytest.approx(2 / 3)
+    assert summary["MRR"] == pytest.approx(0.5)
+    assert summary["Catalog Coverage"] == pytest.approx(0.8)
+    assert summary["Precision CI Low"] <= summary["Precision"] <= summary["Precision CI High"]
@@ -0,0 +1,49 @@
+import pytest
+
+from backend.recommenders import MODEL_CLASSES
+
+# Every recommender with the options that change how it scores
+CONFIGURATIONS = [
+    ("UserBasedCFRecommender", {}),
+    ("UserBasedCFRecommender", {"alpha": 0.5}),
+    ("UserBasedCFRecommender", {"top_k": 5}),
+    ("UserBasedCFRecommender", {"use_neighbor_index": True}),
+    ("UserBasedCFRecommender", {"sparse": True}),
+    ("ItemBasedCFRecommender", {}),
+    ("ItemBasedCFRecommender", {"adjusted": True}),
+    ("ItemBasedCFRecommender", {"use_neighbor_index": True}),
+    ("ItemBasedCFRecommender", {"use_ann_index": True}),
+    ("ItemBasedCFRecommender", {"sparse": True}),
+    ("ContentBasedRecommender", {}),
+    ("ContentBasedRecommender", {"use_tfidf": True}),
+    ("ContentBasedRecommender", {"use_profile": True}),
+    ("ContentBasedRecommender", {"use_profile": True, "use_tfidf": True}),
+    ("ContentBasedRecommender", {"rating_weighted": True}),
+    ("ContentBasedRecommender", {"use_neighbor_index": True}),
+    ("ContentBasedRecommender", {"use_ann_index": True}),
+    ("HybridRecommender", {}),
+    ("HybridRecommender", {"alpha": 0.5, "normalization": "rank"}),
+    ("HybridRecommender", {"normalization": "zscore", "use_neighbor_index": True}),
+    ("HybridRecommender", {"children": [{"model": "UserBasedCFRecommender", "weight": 0.5},
+                                        {"model": "MatrixFactorizationRecommender", "weight": 0.5}]}),
+    ("MatrixFactorizationRecommender", {}),
+    ("MatrixFactorizationRecommender", {"implicit": True}),
+    ("PopularityRecommender", {}),
+    ("PopularityRecommender", {"decay": True}),
+    ("PopularityRecommender", {"segmented": True}),
+]
+
+# Not in the rating matrix: cold-start list
+UNKNOWN_USER = 10 ** 9
+
+@pytest.mark.parametrize('model_name, params', CONFIGURATIONS, ids=lambda value: str(value))
+def test_recommend_batch_matches_recommend(data_path, model_name, params):
+    # recommend_batch feeds evaluation, parameter sweeps and the precomputed tables: it must return exactly the
+    # lists recommend serves, ties included
+    model = MODEL_CLASSES[model_name](data_path=data_path, **params)
+    user_ids = list(model.user_index) + [UNKNOWN_USER]
+    batch = model.recommend_batch(user_ids)
+
+    assert batch.shape == (len(user_ids), model.top_k)
+    for user_id, recommendations in zip(user_ids, batch):
+        assert [int(item) for item in model.recommend(user_id)] == recommendations.tolist()